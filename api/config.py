@@ -1,10 +1,27 @@
 # config.py
 import os
-from pymongo import MongoClient
 from dotenv import load_dotenv
 
 load_dotenv()  # Load environment variables from .env file
 
+def _optional_int(name, default=None):
+    """Reads an integer setting; an empty value means "not set"."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+def _float_mapping(name, default):
+    """Reads a "key=value,key=value" setting of float values, e.g. "AQI=100,CO2_level=1500"."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return dict(default)
+    mapping = {}
+    for item in value.split(","):
+        key, _, number = item.partition("=")
+        mapping[key.strip()] = float(number)
+    return mapping
+
 # ConfigurationS
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
@@ -17,6 +34,200 @@ AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 LANGCHAIN_API_KEY = os.getenv("LANGCHAIN_API_KEY")
 
-# MongoDB client setup
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
+# Insight generation
+# "digest" sends a bounded statistical summary of the window to the LLM, "raw" sends every reading.
+INSIGHT_PROMPT_MODE = os.getenv("INSIGHT_PROMPT_MODE", "digest")
+# Default look-back window for a sensor's insights in days (0 reads the sensor's whole history)
+INSIGHT_WINDOW_DAYS = float(os.getenv("INSIGHT_WINDOW_DAYS", "7"))
+
+# MongoDB connection pool (shared by all services, see api/services/mongo_client.py)
+MONGO_TLS = os.getenv("MONGO_TLS", "true").lower() == "true"
+MONGO_MAX_POOL_SIZE = _optional_int("MONGO_MAX_POOL_SIZE", 100)
+MONGO_MIN_POOL_SIZE = _optional_int("MONGO_MIN_POOL_SIZE", 0)
+MONGO_MAX_IDLE_TIME_MS = _optional_int("MONGO_MAX_IDLE_TIME_MS")
+MONGO_WAIT_QUEUE_TIMEOUT_MS = _optional_int("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000)
+MONGO_CONNECT_TIMEOUT_MS = _optional_int("MONGO_CONNECT_TIMEOUT_MS", 10000)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = _optional_int("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000)
+MONGO_SOCKET_TIMEOUT_MS = _optional_int("MONGO_SOCKET_TIMEOUT_MS")
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+# Documents fetched per cursor round trip when streaming readings
+MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", "1000"))
+# Create the readings collection as a MongoDB time-series collection when it does not exist yet
+MONGO_TIMESERIES = os.getenv("MONGO_TIMESERIES", "false").lower() == "true"
+
+def __getattr__(name):
+    # `client` and `db` used to be created here at import time; they now resolve
+    # lazily to the shared pooled client.
+    if name in ("client", "db"):
+        from api.services.mongo_client import mongo_manager
+        return mongo_manager.client if name == "client" else mongo_manager.get_database()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Async request path: concurrent calls allowed per downstream and per-stage timeouts (seconds)
+MONGO_MAX_CONCURRENCY = int(os.getenv("MONGO_MAX_CONCURRENCY", "32"))
+BEDROCK_MAX_CONCURRENCY = int(os.getenv("BEDROCK_MAX_CONCURRENCY", "8"))
+MONGO_STAGE_TIMEOUT = float(os.getenv("MONGO_STAGE_TIMEOUT", "15"))
+EMBEDDING_STAGE_TIMEOUT = float(os.getenv("EMBEDDING_STAGE_TIMEOUT", "10"))
+LLM_STAGE_TIMEOUT = float(os.getenv("LLM_STAGE_TIMEOUT", "60"))
+
+# Embeddings and the embedding cache
+EMBEDDING_MODEL_ID = os.getenv("EMBEDDING_MODEL_ID", "amazon.titan-embed-text-v1")
+# Persistent cache tier: "mongo" (collection in VECTOR_DB_NAME), "disk" (SQLite file) or "none"
+EMBEDDING_CACHE_BACKEND = os.getenv("EMBEDDING_CACHE_BACKEND", "mongo")
+EMBEDDING_CACHE_COLLECTION = os.getenv("EMBEDDING_CACHE_COLLECTION", "embedding_cache")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "2048"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+EMBEDDING_BATCH_WORKERS = int(os.getenv("EMBEDDING_BATCH_WORKERS", "4"))
+
+# Vector search
+# "atlas" uses Atlas $search knnBeta, "local" uses the in-process index in api/services/vector_index.py
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "atlas")
+VECTOR_SEARCH_K = int(os.getenv("VECTOR_SEARCH_K", "1000"))
+VECTOR_SEARCH_LIMIT = int(os.getenv("VECTOR_SEARCH_LIMIT", "100"))
+# Push the dates, periods and sensor IDs found in a question into the vector search as pre-filters
+# (false restores post-filtering VECTOR_SEARCH_K unfiltered candidates)
+VECTOR_SEARCH_PREFILTER = os.getenv("VECTOR_SEARCH_PREFILTER", "true").lower() == "true"
+# Candidates per result fetched by a pre-filtered search, which are then ranked by recency
+VECTOR_SEARCH_FILTERED_OVERFETCH = float(os.getenv("VECTOR_SEARCH_FILTERED_OVERFETCH", "2"))
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", "vector_index")
+
+# Bulk ingestion (api/services/ingestion.py)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "100"))
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+
+# Insight result cache (api/services/insight_cache.py)
+INSIGHT_CACHE_MAX_ENTRIES = int(os.getenv("INSIGHT_CACHE_MAX_ENTRIES", "256"))
+# Seconds a cached insight is served while the sensor has no newer readings (0 disables the cache)
+INSIGHT_CACHE_TTL = float(os.getenv("INSIGHT_CACHE_TTL", "900"))
+# Seconds past staleness (TTL expiry or new readings) that the old insight may still be served
+# while a fresh one is generated in the background (0 disables stale-while-revalidate)
+INSIGHT_CACHE_STALE_TTL = float(os.getenv("INSIGHT_CACHE_STALE_TTL", "0"))
+
+# Semantic answer cache for RAG queries (api/services/answer_cache.py)
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+# Seconds a cached answer is reused (0 disables the cache)
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Minimum cosine similarity between query embeddings for a cached answer to be reused
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+# RAG context packing (api/services/context_packing.py)
+# Estimated tokens of retrieved readings placed in the Claude prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Weight of recency against vector search relevance when ranking readings (0 to 1)
+CONTEXT_RECENCY_WEIGHT = float(os.getenv("CONTEXT_RECENCY_WEIGHT", "0.3"))
+
+# Logging
+# Log full prompts, retrieved documents and LLM responses (large; off by default)
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "false").lower() == "true"
+
+# Batch insights (GET /api/v1/get_batch_insights)
+BATCH_INSIGHT_MAX_SENSORS = int(os.getenv("BATCH_INSIGHT_MAX_SENSORS", "500"))
+# Default and maximum number of concurrent LLM generations per batch request
+BATCH_INSIGHT_CONCURRENCY = int(os.getenv("BATCH_INSIGHT_CONCURRENCY", "4"))
+BATCH_INSIGHT_MAX_CONCURRENCY = int(os.getenv("BATCH_INSIGHT_MAX_CONCURRENCY", "16"))
+
+# Rollups (api/services/rollups.py): per-sensor hourly and daily aggregates of the readings
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "false").lower() == "true"
+# How rollups are kept current: "ingest" (hook on ingested batches) or "change_stream" (tail the
+# readings collection; falls back to the ingest hook where change streams are unavailable)
+ROLLUP_SOURCE = os.getenv("ROLLUP_SOURCE", "ingest")
+ROLLUP_HOURLY_COLLECTION = os.getenv("ROLLUP_HOURLY_COLLECTION", "readings_hourly")
+ROLLUP_DAILY_COLLECTION = os.getenv("ROLLUP_DAILY_COLLECTION", "readings_daily")
+# Readings applied per bulk write when rebuilding rollups from the readings collection
+ROLLUP_REBUILD_BATCH_SIZE = int(os.getenv("ROLLUP_REBUILD_BATCH_SIZE", "10000"))
+# Resolution of the data behind insights: "raw", "hourly", "daily" or "auto"
+# (hourly rollups for digest insights without a limit when ROLLUPS_ENABLED)
+INSIGHT_RESOLUTION = os.getenv("INSIGHT_RESOLUTION", "auto")
+
+# Background insight pre-generation (api/services/insight_scheduler.py); needs the insight cache
+INSIGHT_PREGEN_ENABLED = os.getenv("INSIGHT_PREGEN_ENABLED", "false").lower() == "true"
+# Seconds between checks for new readings
+INSIGHT_PREGEN_INTERVAL = float(os.getenv("INSIGHT_PREGEN_INTERVAL", "30"))
+# Concurrent pre-generations (they share BEDROCK_MAX_CONCURRENCY with requests)
+INSIGHT_PREGEN_CONCURRENCY = int(os.getenv("INSIGHT_PREGEN_CONCURRENCY", "2"))
+# Sensors with readings in the last this many seconds are active (0: only viewed sensors are)
+INSIGHT_PREGEN_ACTIVE_SECONDS = float(os.getenv("INSIGHT_PREGEN_ACTIVE_SECONDS", "900"))
+# Viewed sensors are kept warm for this many seconds after their last view
+INSIGHT_PREGEN_VIEW_TTL = float(os.getenv("INSIGHT_PREGEN_VIEW_TTL", "86400"))
+# Half-life in seconds of a view in the most-viewed-first priority
+INSIGHT_PREGEN_VIEW_HALF_LIFE = float(os.getenv("INSIGHT_PREGEN_VIEW_HALF_LIFE", "3600"))
+# Upper bound on the sensors scheduled per check
+INSIGHT_PREGEN_MAX_SENSORS = int(os.getenv("INSIGHT_PREGEN_MAX_SENSORS", "100"))
+# Minimum seconds between pre-generations of the same sensor
+INSIGHT_PREGEN_MIN_INTERVAL = float(os.getenv("INSIGHT_PREGEN_MIN_INTERVAL", "300"))
+# Random delay of up to this many seconds before each pre-generation
+INSIGHT_PREGEN_JITTER = float(os.getenv("INSIGHT_PREGEN_JITTER", "5"))
+# Upper bound in seconds of the exponential backoff after failed pre-generations
+INSIGHT_PREGEN_MAX_BACKOFF = float(os.getenv("INSIGHT_PREGEN_MAX_BACKOFF", "900"))
+# /get_insights format pre-generated for sensors that were not viewed yet (the dashboard uses columnar)
+INSIGHT_PREGEN_FORMAT = os.getenv("INSIGHT_PREGEN_FORMAT", "columnar")
+
+# Startup warm-up (api/services/warmup.py): opens the MongoDB pool, creates the Bedrock clients and
+# imports the LangChain modules in parallel before the API serves its first request
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "false").lower() == "true"
+# MongoDB connections opened by the warm-up
+WARMUP_MONGO_CONNECTIONS = int(os.getenv("WARMUP_MONGO_CONNECTIONS", "4"))
+# Also send one embedding request, so the first query does not pay for Bedrock's connection setup
+WARMUP_BEDROCK_REQUEST = os.getenv("WARMUP_BEDROCK_REQUEST", "true").lower() == "true"
+# Seconds the warm-up may delay startup; unfinished steps continue in the background
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "30"))
+
+# Anomaly detection (api/services/anomalies.py)
+ANOMALY_ENABLED = os.getenv("ANOMALY_ENABLED", "true").lower() == "true"
+# Weight of the newest reading in the exponentially weighted mean and variance of each metric
+ANOMALY_EWMA_ALPHA = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.1"))
+# Readings whose EWMA or rolling z-score exceeds this (in absolute value) are anomalous
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "4"))
+# Readings in the rolling window behind the rolling z-score
+ANOMALY_WINDOW = int(os.getenv("ANOMALY_WINDOW", "60"))
+# Readings of a metric seen before its z-scores are used
+ANOMALY_MIN_READINGS = int(os.getenv("ANOMALY_MIN_READINGS", "20"))
+# Largest normal change per minute of each metric; changes are measured over at least
+# ANOMALY_RATE_MIN_INTERVAL seconds, so closely spaced readings are not over-weighted
+ANOMALY_RATE_LIMITS = _float_mapping("ANOMALY_RATE_LIMITS", {"temperature": 5.0, "humidity": 20.0, "AQI": 100.0,
+                                                             "CO2_level": 1500.0})
+ANOMALY_RATE_MIN_INTERVAL = float(os.getenv("ANOMALY_RATE_MIN_INTERVAL", "60"))
+# Sensors whose streaming state is kept (least recently updated are dropped first)
+ANOMALY_MAX_SENSORS = int(os.getenv("ANOMALY_MAX_SENSORS", "10000"))
+# Anomalies detected on ingested readings kept for /api/v1/recent_anomalies
+ANOMALY_MAX_EVENTS = int(os.getenv("ANOMALY_MAX_EVENTS", "1000"))
+# Anomalies listed as facts in insight prompts (the highest scoring)
+ANOMALY_MAX_INSIGHT_FACTS = int(os.getenv("ANOMALY_MAX_INSIGHT_FACTS", "10"))
+
+# In-memory hot window store (api/services/hot_store.py): the recent readings of the sensors being read,
+# kept in per-sensor ring buffers and served instead of querying MongoDB
+HOT_STORE_ENABLED = os.getenv("HOT_STORE_ENABLED", "false").lower() == "true"
+# Hours of readings kept per sensor; requests reaching further back are read from MongoDB
+HOT_STORE_WINDOW_HOURS = float(os.getenv("HOT_STORE_WINDOW_HOURS", str(INSIGHT_WINDOW_DAYS * 24)))
+# Memory budget of all buffers in MiB; the least recently read sensors are evicted first
+HOT_STORE_MAX_MB = float(os.getenv("HOT_STORE_MAX_MB", "256"))
+# How buffers are kept current: "ingest" (hook on batches ingested by this process) or "change_stream"
+# (tail the readings collection, also seeing other processes' inserts; falls back to "ingest")
+HOT_STORE_SOURCE = os.getenv("HOT_STORE_SOURCE", "ingest")
+
+# Live push of new readings (GET /api/v1/sensor_stream, api/services/live_feed.py)
+LIVE_FEED_ENABLED = os.getenv("LIVE_FEED_ENABLED", "true").lower() == "true"
+# Where new readings come from: "ingest" (batches ingested by this process) or "change_stream"
+# (tail the readings collection, also seeing other processes' inserts; falls back to "ingest")
+LIVE_FEED_SOURCE = os.getenv("LIVE_FEED_SOURCE", "ingest")
+# Batches queued per subscriber; a subscriber that falls further behind is told to reconnect
+LIVE_FEED_QUEUE_SIZE = int(os.getenv("LIVE_FEED_QUEUE_SIZE", "256"))
+# Upper bound on concurrent stream subscribers
+LIVE_FEED_MAX_SUBSCRIBERS = int(os.getenv("LIVE_FEED_MAX_SUBSCRIBERS", "1000"))
+# Seconds between keep-alive comments on an idle stream
+LIVE_FEED_HEARTBEAT = float(os.getenv("LIVE_FEED_HEARTBEAT", "15"))
+
+# Re-embedding of the vector collection (python -m api.services.reindex)
+# Readings per chunk; each chunk is embedded, bulk upserted and checkpointed as a unit
+REINDEX_BATCH_SIZE = int(os.getenv("REINDEX_BATCH_SIZE", "500"))
+# Chunks embedded concurrently
+REINDEX_CONCURRENCY = int(os.getenv("REINDEX_CONCURRENCY", "4"))
+# Upper bound on embedding requests per second across all workers (0 disables the limit)
+REINDEX_RATE_LIMIT = float(os.getenv("REINDEX_RATE_LIMIT", "20"))
+# Retries of a failed embedding request or bulk write, with exponential backoff from REINDEX_RETRY_DELAY seconds
+REINDEX_MAX_RETRIES = int(os.getenv("REINDEX_MAX_RETRIES", "5"))
+REINDEX_RETRY_DELAY = float(os.getenv("REINDEX_RETRY_DELAY", "1"))
+# Collection in VECTOR_DB_NAME holding each job's progress, so an interrupted job resumes where it stopped
+REINDEX_CHECKPOINT_COLLECTION = os.getenv("REINDEX_CHECKPOINT_COLLECTION", "reindex_checkpoints")
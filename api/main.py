@@ -5,11 +5,72 @@ import os
 # Add the current directory to the Python path
 # sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from fastapi import FastAPI
+import time
+# Start of the startup timing report
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from api.routes.insights import router as insights_router
 from api.routes.rag_query import router as rag_router
+from api.routes.system import router as system_router
+from api.routes.ingest import router as ingest_router
+from api.routes.charts import router as charts_router
+from api.routes.anomalies import router as anomalies_router
+from api.routes.live import router as live_router
+from api.services.metrics import HTTP_REQUEST_SECONDS, start_request_timings, server_timing_header
+from api.services.mongo_client import mongo_manager
+from api.services.rollups import start_rollup_maintenance, stop_rollup_maintenance
+from api.services.insight_scheduler import insight_scheduler
+from api.services.anomalies import anomaly_engine
+from api.services.hot_store import hot_store
+from api.services.live_feed import live_feed
+from api.services.warmup import startup_report, warm_up
+
+startup_report.begin(_import_started)
+startup_report.record("import", time.perf_counter() - _import_started)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared MongoDB client once per process and close it on shutdown
+    with startup_report.phase("mongo_client"):
+        mongo_manager.open()
+    with startup_report.phase("rollups"):
+        start_rollup_maintenance()
+    with startup_report.phase("anomalies"):
+        anomaly_engine.start()
+    with startup_report.phase("hot_store"):
+        hot_store.start()
+    with startup_report.phase("live_feed"):
+        live_feed.start()
+    with startup_report.phase("insight_scheduler"):
+        insight_scheduler.start()
+    # Optional (WARMUP_ENABLED): pre-open the pool and pre-warm Bedrock before serving
+    await warm_up()
+    startup_report.mark_ready()
+    yield
+    await insight_scheduler.stop()
+    live_feed.stop()
+    hot_store.stop()
+    anomaly_engine.stop()
+    stop_rollup_maintenance()
+    mongo_manager.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # Stages timed while handling the request are reported in its Server-Timing header
+    timings = start_request_timings()
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=getattr(route, "path", "unmatched"),
+                                 status=response.status_code)
+    response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    startup_report.mark_first_response()
+    return response
 
 # Include the insights router
 app.include_router(insights_router, prefix="/api/v1", tags=["insights"])
@@ -17,6 +78,21 @@ app.include_router(insights_router, prefix="/api/v1", tags=["insights"])
 # Include the insights router
 app.include_router(rag_router, prefix="/api/v1", tags=["rag_query"])
 
+# Include the chart data router
+app.include_router(charts_router, prefix="/api/v1", tags=["charts"])
+
+# Include the anomaly detection router
+app.include_router(anomalies_router, prefix="/api/v1", tags=["anomalies"])
+
+# Include the live readings stream router
+app.include_router(live_router, prefix="/api/v1", tags=["live"])
+
+# Include the ingestion router
+app.include_router(ingest_router, prefix="/api/v1", tags=["ingest"])
+
+# Include the system router (pool statistics)
+app.include_router(system_router, prefix="/api/v1", tags=["system"])
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the InsightPulse API"}
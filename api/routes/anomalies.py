@@ -0,0 +1,43 @@
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query, Request
+from pymongo.errors import PyMongoError
+from api.services.anomalies import get_sensor_anomalies, anomaly_engine
+from api.services.concurrency import cancel_on_disconnect, run_stage, StageTimeoutError, ClientDisconnectedError
+
+router = APIRouter()
+
+@router.get("/get_anomalies")
+async def get_anomalies(request: Request, sensor_id: str = None, since: datetime = None, until: datetime = None,
+                        limit: int = Query(None, gt=0)):
+    """Score a window of a sensor's readings and return its anomalies, oldest first.
+
+    `since`/`until` default to the last INSIGHT_WINDOW_DAYS days. Each anomaly has the
+    reading's epoch millisecond timestamp, metric and value, the EWMA it was compared
+    against, its EWMA and rolling-window z-scores, its rate of change per minute and
+    the reasons ("ewma", "window", "rate") it was flagged for.
+    """
+    try:
+        if not sensor_id:
+            raise HTTPException(status_code=400, detail="Sensor ID is required.")
+
+        async def fetch():
+            return await run_stage("sensor_query", get_sensor_anomalies, sensor_id, since=since, until=until,
+                                   limit=limit)
+
+        return await cancel_on_disconnect(request, fetch)
+    except HTTPException:
+        raise
+    except StageTimeoutError as te:
+        raise HTTPException(status_code=504, detail=str(te))
+    except ClientDisconnectedError:
+        raise HTTPException(status_code=499, detail="Client closed request.")
+    except (ConnectionError, PyMongoError):
+        raise HTTPException(status_code=503, detail="Service unavailable. Please try again later.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while detecting anomalies: {e}")
+
+
+@router.get("/recent_anomalies")
+def recent_anomalies(sensor_id: str = None, limit: int = Query(100, gt=0, le=1000)):
+    """Return the latest anomalies detected on ingested readings, newest first, optionally for one sensor."""
+    return {"anomalies": anomaly_engine.recent(sensor_id, limit)}
@@ -0,0 +1,79 @@
+from datetime import datetime
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from pymongo.errors import PyMongoError
+from api.services.columnar import to_columnar, encode_columnar, negotiate_media_type, supported_media_types
+from api.services.concurrency import cancel_on_disconnect, run_stage, StageTimeoutError, ClientDisconnectedError
+from api.services.data_retrieval import get_sensor_columns
+from api.services.metrics import timed
+from api.services.downsampling import get_chart_data, DOWNSAMPLING_METHODS
+
+router = APIRouter()
+
+MAX_CHART_POINTS = 5000
+
+@router.get("/get_chart_data")
+async def get_chart_data_route(request: Request, sensor_id: str = None, start: datetime = None, end: datetime = None,
+                               points: int = Query(500, ge=3, le=MAX_CHART_POINTS), method: str = "bucket"):
+    """Return a sensor's per-metric series downsampled to at most `points` points.
+
+    `method=bucket` aggregates min/avg/max per equal time bucket in MongoDB;
+    `method=lttb` keeps the visually significant raw points of each metric.
+    Timestamps are epoch milliseconds.
+    """
+    try:
+        if not sensor_id:
+            raise HTTPException(status_code=400, detail="Sensor ID is required.")
+        if method not in DOWNSAMPLING_METHODS:
+            raise ValueError(f"method must be one of {', '.join(DOWNSAMPLING_METHODS)}")
+
+        async def fetch():
+            return await run_stage("sensor_query", get_chart_data, sensor_id, start, end, points, method)
+
+        return {"data": await cancel_on_disconnect(request, fetch)}
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {ve}")
+    except StageTimeoutError as te:
+        raise HTTPException(status_code=504, detail=str(te))
+    except ClientDisconnectedError:
+        raise HTTPException(status_code=499, detail="Client closed request.")
+    except (ConnectionError, PyMongoError):
+        raise HTTPException(status_code=503, detail="Service unavailable. Please try again later.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while fetching chart data: {e}")
+
+
+@router.get("/get_sensor_series")
+async def get_sensor_series(request: Request, sensor_id: str = None, since: datetime = None, until: datetime = None,
+                            limit: int = Query(None, gt=0)):
+    """Return a sensor's raw readings as columns: epoch millisecond timestamps and one float array per metric.
+
+    The encoding is negotiated from the Accept header: JSON (default), Arrow IPC
+    stream (application/vnd.apache.arrow.stream) or msgpack (application/x-msgpack).
+    `since`/`until` default to the last INSIGHT_WINDOW_DAYS days; missing values are null/NaN.
+    """
+    try:
+        if not sensor_id:
+            raise HTTPException(status_code=400, detail="Sensor ID is required.")
+        media_type = negotiate_media_type(request.headers.get("accept"))
+        if media_type is None:
+            raise HTTPException(status_code=406, detail=f"Supported media types: {', '.join(supported_media_types())}")
+
+        async def fetch():
+            return await run_stage("sensor_query", get_sensor_columns, sensor_id, since=since, until=until, limit=limit)
+
+        timestamps, columns = await cancel_on_disconnect(request, fetch)
+        with timed("serialization"):
+            body = encode_columnar(to_columnar(sensor_id, timestamps, columns), media_type)
+        return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+    except HTTPException:
+        raise
+    except StageTimeoutError as te:
+        raise HTTPException(status_code=504, detail=str(te))
+    except ClientDisconnectedError:
+        raise HTTPException(status_code=499, detail="Client closed request.")
+    except (ConnectionError, PyMongoError):
+        raise HTTPException(status_code=503, detail="Service unavailable. Please try again later.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while fetching sensor data: {e}")
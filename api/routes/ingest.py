@@ -0,0 +1,85 @@
+import io
+import logging
+import tempfile
+from datetime import datetime
+from typing import List
+from anyio import to_thread
+from fastapi import APIRouter, HTTPException, Query, Request
+from pymongo.errors import PyMongoError
+from api.config import ROLLUPS_ENABLED
+from api.services.ingestion import ingest_stream, PARSERS
+from api.services.reindex import reindex_status
+from api.services.rollups import rebuild_rollups
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Request bodies larger than this are spooled to disk instead of memory
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+@router.post("/ingest")
+async def ingest(request: Request, format: str = "text", embed: bool = True):
+    """Ingest sensor readings sent as the request body.
+
+    The body is either blank-line-separated records in the sensor_data.txt
+    format (`format=text`) or NDJSON (`format=ndjson`). Readings whose ID was
+    already ingested are skipped.
+    """
+    if format not in PARSERS:
+        raise HTTPException(status_code=400, detail=f"Invalid input: format must be one of {', '.join(PARSERS)}")
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as body:
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+
+        try:
+            # Ingestion is long-running blocking I/O, so it runs in a worker thread
+            stream = io.TextIOWrapper(body, encoding="utf-8")
+            stats = await to_thread.run_sync(lambda: ingest_stream(stream, format, embed=embed))
+        except ValueError as ve:
+            raise HTTPException(status_code=400, detail=f"Invalid input: {ve}")
+        except (ConnectionError, PyMongoError):
+            logger.exception("Ingestion failed")
+            raise HTTPException(status_code=503, detail="Service unavailable. Please try again later.")
+        except Exception:
+            logger.exception("Ingestion failed")
+            raise HTTPException(status_code=500, detail="An error occurred while ingesting readings.")
+
+    return {"data": stats.as_dict()}
+
+
+@router.post("/rollups/rebuild")
+async def rebuild_rollups_route(sensor_id: List[str] = Query(None), since: datetime = None, until: datetime = None):
+    """Recompute the hourly and daily rollups from the raw readings.
+
+    `sensor_id` (repeatable) limits the rebuild to those sensors; `since`/`until`
+    limit it to a time range, widened to whole UTC days.
+    """
+    if not ROLLUPS_ENABLED:
+        raise HTTPException(status_code=400, detail="Invalid input: rollups are not enabled (ROLLUPS_ENABLED).")
+    try:
+        stats = await to_thread.run_sync(lambda: rebuild_rollups(sensor_id, since=since, until=until))
+    except (ConnectionError, PyMongoError):
+        logger.exception("Rollup rebuild failed")
+        raise HTTPException(status_code=503, detail="Service unavailable. Please try again later.")
+    except Exception:
+        logger.exception("Rollup rebuild failed")
+        raise HTTPException(status_code=500, detail="An error occurred while rebuilding rollups.")
+
+    return {"data": stats}
+
+
+@router.get("/reindex/status")
+async def reindex_status_route():
+    """Report the progress of re-embedding jobs (python -m api.services.reindex) from their checkpoints."""
+    try:
+        checkpoints = await to_thread.run_sync(reindex_status)
+    except (ConnectionError, PyMongoError):
+        raise HTTPException(status_code=503, detail="Service unavailable. Please try again later.")
+    except Exception as e:
+        logger.error(f"Reading reindex checkpoints failed: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred while reading reindex progress: {e}")
+
+    return {"data": checkpoints}
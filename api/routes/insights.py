@@ -1,20 +1,122 @@
-from fastapi import APIRouter, HTTPException
-from api.services.prompt_handler import generate_insight
+import json
+from datetime import datetime
+from typing import List
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from api.config import BATCH_INSIGHT_MAX_SENSORS, BATCH_INSIGHT_CONCURRENCY, BATCH_INSIGHT_MAX_CONCURRENCY
+from api.services.concurrency import cancel_on_disconnect, StageTimeoutError, ClientDisconnectedError
+from api.services.insight_scheduler import insight_scheduler
+from api.services.metrics import timed
+from api.services.prompt_handler import agenerate_cached_insight, afetch_batch_columns, astream_batch_insights
 
 router = APIRouter()
 
 @router.get("/get_insights")
-async def get_insights(sensor_id: str = None):
-    """Fetch and generate insights based on sensor data."""
+async def get_insights(request: Request, sensor_id: str = None, prompt_mode: str = None,
+                       since: datetime = None, until: datetime = None, limit: int = Query(None, gt=0),
+                       data_format: str = Query("documents", alias="format"), refresh: bool = False,
+                       resolution: str = None):
+    """Fetch and generate insights based on sensor data.
+
+    `prompt_mode` overrides INSIGHT_PROMPT_MODE ("raw" or "digest") for this request.
+    `since`/`until` bound the time window (default: the last INSIGHT_WINDOW_DAYS days)
+    and `limit` keeps only the most recent readings in it.
+    `format=columnar` returns sensor_data as timestamp and per-metric arrays
+    instead of one document per reading.
+    `resolution` ("raw", "hourly", "daily" or "auto", default INSIGHT_RESOLUTION)
+    builds the insight from the rollups; sensor_data then holds the bucket means.
+
+    Insights are cached until the sensor gets newer readings or INSIGHT_CACHE_TTL
+    expires; `refresh=true` regenerates. The X-Cache header reports the outcome
+    and `generated_at` when the insight was generated. Insights of sensors viewed
+    with the default window are kept pre-generated by the insight scheduler.
+    """
     try:
         if not sensor_id:
             raise HTTPException(status_code=400, detail="Sensor ID is required.")
-        insights, sensor_data = generate_insight(sensor_id)
-        response = {"data": {"insights": insights, "sensor_data": sensor_data}}
-        return response
+        insights, sensor_data, generated_at, cache_status = await cancel_on_disconnect(
+            request, agenerate_cached_insight, sensor_id, prompt_mode=prompt_mode, since=since, until=until,
+            limit=limit, data_format=data_format, refresh=refresh, resolution=resolution,
+        )
+        if since is None and until is None and limit is None:
+            insight_scheduler.record_view(sensor_id, prompt_mode=prompt_mode, data_format=data_format,
+                                          resolution=resolution)
+        with timed("serialization"):
+            content = jsonable_encoder({"data": {"insights": insights, "sensor_data": sensor_data,
+                                                 "generated_at": generated_at}})
+        return JSONResponse(content, headers={"X-Cache": cache_status})
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=f"Invalid input: {ve}")
+    except LookupError as le:
+        raise HTTPException(status_code=404, detail=str(le))
+    except StageTimeoutError as te:
+        raise HTTPException(status_code=504, detail=str(te))
+    except ClientDisconnectedError:
+        raise HTTPException(status_code=499, detail="Client closed request.")
+    except ConnectionError:
+        raise HTTPException(status_code=503, detail="Service unavailable. Please try again later.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while generating insights: {e}")
+
+
+def _parse_sensor_ids(sensor_ids):
+    """Accepts repeated sensor_ids parameters and comma-separated lists; drops duplicates, keeping order."""
+    parsed = []
+    for value in sensor_ids or []:
+        parsed.extend(sensor_id.strip() for sensor_id in value.split(",") if sensor_id.strip())
+    return list(dict.fromkeys(parsed))
+
+@router.get("/get_batch_insights")
+async def get_batch_insights(request: Request, sensor_ids: List[str] = Query(None), prompt_mode: str = None,
+                             since: datetime = None, until: datetime = None, limit: int = Query(None, gt=0),
+                             concurrency: int = Query(BATCH_INSIGHT_CONCURRENCY, ge=1, le=BATCH_INSIGHT_MAX_CONCURRENCY),
+                             fleet_summary: bool = False, include_data: bool = False, refresh: bool = False):
+    """Generate insights for several sensors, streamed as newline-delimited JSON.
+
+    `sensor_ids` is repeated or comma-separated. All sensors' readings are read
+    with one query; up to `concurrency` insights are generated at once and each
+    line is written as soon as its sensor finishes: {"type": "sensor", ...} or
+    {"type": "error", ...}. `fleet_summary=true` adds a comparative summary
+    across the sensors and the stream ends with a {"type": "done", ...} line.
+    `include_data=true` adds each sensor's columnar readings.
+    """
+    try:
+        sensor_ids = _parse_sensor_ids(sensor_ids)
+        if not sensor_ids:
+            raise HTTPException(status_code=400, detail="At least one sensor ID is required.")
+        if len(sensor_ids) > BATCH_INSIGHT_MAX_SENSORS:
+            raise HTTPException(status_code=400, detail=f"At most {BATCH_INSIGHT_MAX_SENSORS} sensor IDs are allowed.")
+
+        # Retrieval errors are still reported as HTTP errors, before streaming starts
+        sensor_columns = await cancel_on_disconnect(
+            request, afetch_batch_columns, sensor_ids, since=since, until=until, limit=limit,
+        )
+        results = astream_batch_insights(
+            sensor_ids, sensor_columns, prompt_mode=prompt_mode, since=since, until=until, limit=limit,
+            concurrency=concurrency, fleet_summary=fleet_summary, include_data=include_data, refresh=refresh,
+        )
+    except HTTPException:
+        raise
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=f"Invalid input: {ve}")
+    except StageTimeoutError as te:
+        raise HTTPException(status_code=504, detail=str(te))
+    except ClientDisconnectedError:
+        raise HTTPException(status_code=499, detail="Client closed request.")
     except ConnectionError:
         raise HTTPException(status_code=503, detail="Service unavailable. Please try again later.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred while generating insights: {e}")
+
+    async def lines():
+        try:
+            async for result in results:
+                yield json.dumps(jsonable_encoder(result)) + "\n"
+        finally:
+            await results.aclose()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers=headers)
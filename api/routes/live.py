@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime, timezone
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pymongo.errors import PyMongoError
+from api.config import LIVE_FEED_HEARTBEAT
+from api.services.concurrency import cancel_on_disconnect, run_stage, StageTimeoutError, ClientDisconnectedError
+from api.services.data_retrieval import get_sensor_columns
+from api.services.live_feed import live_feed, encode_batch, batch_after, LiveFeedFullError, RESYNC
+
+router = APIRouter()
+
+# Readings after `since` sent when a stream opens; older ones are left out
+MAX_BACKLOG = 5000
+
+def _readings_event(batch):
+    # The event ID is the latest reading's time, so a reconnecting client resumes after it
+    return f"event: readings\nid: {batch.timestamps[-1]}\ndata: {batch.data}\n\n"
+
+def _since_ms(since, last_event_id):
+    if last_event_id:
+        try:
+            return int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID must be an epoch millisecond timestamp.")
+    if since is None:
+        return None
+    return int(since.replace(tzinfo=since.tzinfo or timezone.utc).timestamp() * 1000)
+
+async def _read_backlog(request, sensor_id, since_ms):
+    """Returns the LiveBatch of the sensor's readings after since_ms, or None when there are none."""
+    if since_ms is None:
+        return None
+
+    async def fetch():
+        since = datetime.fromtimestamp(since_ms / 1000, tz=timezone.utc)
+        return await run_stage("sensor_query", get_sensor_columns, sensor_id, since=since, limit=MAX_BACKLOG)
+
+    timestamps, columns = await cancel_on_disconnect(request, fetch)
+    newer = timestamps > since_ms
+    if not newer.any():
+        return None
+    return encode_batch(sensor_id, timestamps[newer], {field: values[newer] for field, values in columns.items()})
+
+@router.get("/sensor_stream")
+async def sensor_stream(request: Request, sensor_id: str = None, since: datetime = None,
+                        last_event_id: str = Header(None)):
+    """Stream a sensor's new readings as Server-Sent Events.
+
+    Each `readings` event carries a batch of newly inserted readings as a columnar
+    sensor_data payload (epoch millisecond timestamps and one array per metric), with
+    the latest reading's timestamp as its event ID. With `since` (or a Last-Event-ID
+    header when reconnecting), the stream opens with the readings after it, at most
+    MAX_BACKLOG of the latest. A `resync` event means the client fell behind; it should
+    reconnect from its last event ID. Idle streams carry keep-alive comments.
+    """
+    try:
+        if not sensor_id:
+            raise HTTPException(status_code=400, detail="Sensor ID is required.")
+        if not live_feed.running:
+            raise HTTPException(status_code=503, detail="Live streams are not enabled.")
+        since_ms = _since_ms(since, last_event_id)
+        # Subscribe before reading the backlog, so no reading falls between the two
+        subscription = live_feed.subscribe(sensor_id)
+        try:
+            backlog = await _read_backlog(request, sensor_id, since_ms)
+        except BaseException:
+            live_feed.unsubscribe(subscription)
+            raise
+    except HTTPException:
+        raise
+    except LiveFeedFullError as fe:
+        raise HTTPException(status_code=503, detail=str(fe))
+    except StageTimeoutError as te:
+        raise HTTPException(status_code=504, detail=str(te))
+    except ClientDisconnectedError:
+        raise HTTPException(status_code=499, detail="Client closed request.")
+    except (ConnectionError, PyMongoError):
+        raise HTTPException(status_code=503, detail="Service unavailable. Please try again later.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while reading new readings: {e}")
+
+    async def events():
+        latest = since_ms
+        # Batches queued while the backlog was read may repeat some of its readings
+        queued = subscription.queue.qsize()
+        try:
+            if backlog is not None:
+                latest = backlog.timestamps[-1]
+                yield _readings_event(backlog)
+            yield "event: ready\ndata: {}\n\n"
+            while True:
+                try:
+                    batch = await asyncio.wait_for(subscription.queue.get(), LIVE_FEED_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                if batch is RESYNC:
+                    yield "event: resync\ndata: {}\n\n"
+                    break
+                if queued > 0:
+                    queued -= 1
+                    if latest is not None:
+                        batch = batch_after(batch, latest)
+                        if batch is None:
+                            continue
+                yield _readings_event(batch)
+        finally:
+            live_feed.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
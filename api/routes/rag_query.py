@@ -1,6 +1,9 @@
+import json
 import logging
-from fastapi import APIRouter, HTTPException
-from api.services.prompt_handler import generate_rag_query_insight
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from api.services.concurrency import cancel_on_disconnect, StageTimeoutError, ClientDisconnectedError
+from api.services.prompt_handler import agenerate_rag_query_insight, abuild_rag_prompt, astream_rag_answer, alookup_rag_answer, remember_rag_answer
 
 # Set up logging for error tracking
 logging.basicConfig(level=logging.INFO)
@@ -9,24 +12,76 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.get("/get_rag_query")
-async def get_rag_query(query: str = None):
+async def get_rag_query(request: Request, query: str = None):
     """Fetch and generate insights based on sensor data."""
     try:
         if not query:
             raise HTTPException(status_code=400, detail="Query parameter is required.")
         
         # Call the service function to generate insight based on query
-        rag_query = generate_rag_query_insight(query)
+        rag_query = await cancel_on_disconnect(request, agenerate_rag_query_insight, query)
         
         if rag_query is None:
             raise HTTPException(status_code=404, detail="No insights found for the given query.")
         
         return {"answer": rag_query}
 
+    except HTTPException:
+        raise
+
     except ValueError as ve:
         logger.error(f"ValueError: {ve}")
         raise HTTPException(status_code=400, detail=f"Invalid input: {ve}")
 
+    except StageTimeoutError as te:
+        logger.error(f"StageTimeoutError: {te}")
+        raise HTTPException(status_code=504, detail=str(te))
+
+    except ClientDisconnectedError:
+        raise HTTPException(status_code=499, detail="Client closed request.")
+
+    except ConnectionError as ce:
+        logger.error(f"ConnectionError: {ce}")
+        raise HTTPException(status_code=503, detail="Service unavailable. Please try again later.")
+
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        raise HTTPException(status_code=500, detail="An error occurred while generating insights.")
+
+
+def _sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@router.get("/get_rag_query_stream")
+async def get_rag_query_stream(request: Request, query: str = None):
+    """Stream the answer to a query as Server-Sent Events.
+
+    Each `data:` event carries {"token": "..."}; the stream ends with a `done`
+    event, or an `error` event if generation fails after streaming started.
+    A cached answer to an equivalent query is sent as a single token.
+    """
+    try:
+        if not query:
+            raise HTTPException(status_code=400, detail="Query parameter is required.")
+
+        # Retrieval errors are still reported as HTTP errors, before streaming starts
+        lookup = await cancel_on_disconnect(request, alookup_rag_answer, query)
+        prompt = None
+        if lookup.answer is None:
+            prompt = await cancel_on_disconnect(request, abuild_rag_prompt, query,
+                                                  query_embedding=lookup.query_embedding, filters=lookup.filters)
+
+    except HTTPException:
+        raise
+
+    except StageTimeoutError as te:
+        logger.error(f"StageTimeoutError: {te}")
+        raise HTTPException(status_code=504, detail=str(te))
+
+    except ClientDisconnectedError:
+        raise HTTPException(status_code=499, detail="Client closed request.")
+
     except ConnectionError as ce:
         logger.error(f"ConnectionError: {ce}")
         raise HTTPException(status_code=503, detail="Service unavailable. Please try again later.")
@@ -34,3 +89,23 @@ async def get_rag_query(query: str = None):
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         raise HTTPException(status_code=500, detail="An error occurred while generating insights.")
+
+    async def events():
+        if lookup.answer is not None:
+            yield _sse_event({"token": lookup.answer})
+            yield _sse_event({}, event="done")
+            return
+        try:
+            tokens = []
+            async for token in astream_rag_answer(prompt):
+                tokens.append(token)
+                yield _sse_event({"token": token})
+            remember_rag_answer(query, lookup, "".join(tokens))
+            yield _sse_event({}, event="done")
+        except Exception as e:
+            logger.error(f"Streaming error: {e}")
+            yield _sse_event({"detail": "An error occurred while generating the answer."}, event="error")
+
+    # Disable proxy buffering so tokens reach the client as soon as they are generated
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
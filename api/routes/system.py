@@ -0,0 +1,48 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from api.services.anomalies import anomaly_engine
+from api.services.answer_cache import answer_cache
+from api.services.concurrency import limiter_stats
+from api.services.hot_store import hot_store
+from api.services.insight_cache import insight_cache
+from api.services.insight_scheduler import insight_scheduler
+from api.services.live_feed import live_feed
+from api.services.load_rag_data import embedding_cache_stats
+from api.services.metrics import render_metrics
+from api.services.mongo_client import mongo_manager
+from api.services.warmup import startup_report
+
+router = APIRouter()
+
+@router.get("/pool_stats")
+async def get_pool_stats():
+    """Expose MongoDB connection pool and downstream concurrency statistics for sizing."""
+    return {"mongo": mongo_manager.pool_stats(), "downstream_limits": limiter_stats()}
+
+@router.get("/cache_stats")
+async def get_cache_stats():
+    """Expose cache hit/miss counters."""
+    return {"embedding": embedding_cache_stats(), "insights": insight_cache.stats(),
+            "answers": answer_cache.stats(), "insight_scheduler": insight_scheduler.stats(),
+            "anomalies": anomaly_engine.stats(), "hot_store": hot_store.stats()}
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Expose request, stage and token metrics plus pool and cache statistics in the Prometheus text format."""
+    gauges = {
+        "mongo_pool": mongo_manager.pool_stats(),
+        "downstream": limiter_stats(),
+        "embedding_cache": embedding_cache_stats(),
+        "insight_cache": insight_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "insight_scheduler": insight_scheduler.stats(),
+        "anomalies": anomaly_engine.stats(),
+        "hot_store": hot_store.stats(),
+        "live_feed": live_feed.stats(),
+    }
+    return PlainTextResponse(render_metrics(gauges), media_type="text/plain; version=0.0.4")
+
+@router.get("/startup")
+async def get_startup_report():
+    """Expose the durations of the startup phases, the warm-up steps and the time to the first response."""
+    return startup_report.as_dict()
@@ -0,0 +1,429 @@
+# anomalies.py
+"""
+Anomaly detection on sensor readings: EWMA and rolling z-scores and rate-of-change limits per metric.
+
+Each reading is scored against the state built from the sensor's earlier
+readings, then folded into it. AnomalyEngine keeps that state per sensor and
+updates it in O(1) per ingested reading; AnomalyDetector.score_columns scores
+a window of historical readings in one vectorized pass. Both flag the same
+readings.
+"""
+import logging
+import math
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+import numpy as np
+
+from api.config import (
+    ANOMALY_ENABLED, ANOMALY_EWMA_ALPHA, ANOMALY_Z_THRESHOLD, ANOMALY_WINDOW, ANOMALY_MIN_READINGS,
+    ANOMALY_RATE_LIMITS, ANOMALY_RATE_MIN_INTERVAL, ANOMALY_MAX_SENSORS, ANOMALY_MAX_EVENTS,
+)
+from api.services.data_retrieval import get_sensor_columns
+from api.services.ingest_hooks import register_ingest_hook, unregister_ingest_hook
+from api.services.sensor_digest import FIELD_METRICS, UNITS, to_epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+# Readings per block of the vectorized EWMA recurrence; bounds decay**block away from underflow
+FILTER_BLOCK = 64
+
+
+def _rounded(value, digits=3):
+    return None if value is None or math.isnan(value) else round(float(value), digits)
+
+
+class MetricState:
+    """Running statistics of one metric of one sensor."""
+
+    __slots__ = ("count", "mean", "var", "last_value", "last_time", "window", "reference", "window_sum",
+                 "window_sumsq", "updates")
+
+    def __init__(self, window):
+        self.count = 0
+        self.mean = 0.0
+        self.var = 0.0
+        self.last_value = None
+        self.last_time = None
+        self.window = deque(maxlen=window)
+        # Window values are summed relative to the first value seen, which keeps the variance accurate
+        self.reference = None
+        self.window_sum = 0.0
+        self.window_sumsq = 0.0
+        self.updates = 0
+
+    def resum(self):
+        """Recomputes the window sums exactly, dropping the rounding error of the running updates."""
+        shifted = [value - self.reference for value in self.window]
+        self.window_sum = math.fsum(shifted)
+        self.window_sumsq = math.fsum(value * value for value in shifted)
+        self.updates = 0
+
+
+def _linear_filter(inputs, decay, initial):
+    """
+    Returns y[t] = decay * y[t - 1] + inputs[t] for every t, starting from y[-1] = initial.
+
+    Each block is solved in closed form, y[j] = decay**j * (y0 + cumsum(inputs / decay**i)),
+    so the recurrence runs as a few array operations per FILTER_BLOCK readings.
+    """
+    output = np.empty_like(inputs)
+    powers = decay ** np.arange(1, FILTER_BLOCK + 1, dtype=np.float64)
+    value = initial
+    for start in range(0, inputs.size, FILTER_BLOCK):
+        block = inputs[start:start + FILTER_BLOCK]
+        scale = powers[:block.size]
+        output[start:start + block.size] = scale * (value + np.cumsum(block / scale))
+        value = output[start + block.size - 1]
+    return output
+
+
+class AnomalyDetector:
+    """
+    The detection rules and their parameters.
+
+    A metric's value is anomalous when its z-score against the exponentially
+    weighted mean and variance (weight alpha for the newest reading), or
+    against the mean and standard deviation of the previous `window` values,
+    exceeds z_threshold, once min_readings values were seen; or when it changed
+    faster than its rate limit (units per minute, over at least
+    rate_min_interval seconds) since the previous value.
+    """
+
+    def __init__(self, alpha=ANOMALY_EWMA_ALPHA, z_threshold=ANOMALY_Z_THRESHOLD, window=ANOMALY_WINDOW,
+                 min_readings=ANOMALY_MIN_READINGS, rate_limits=ANOMALY_RATE_LIMITS,
+                 rate_min_interval=ANOMALY_RATE_MIN_INTERVAL):
+        if not 0.0 < alpha < 1.0:
+            raise ValueError("alpha must be between 0 and 1")
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.window = window
+        self.min_readings = min_readings
+        self.rate_limits = dict(rate_limits)
+        self.rate_min_minutes = rate_min_interval / 60.0
+
+    def new_state(self):
+        return MetricState(self.window)
+
+    def _anomaly(self, field, timestamp, value, expected, ewma_z, window_z, rate):
+        """Returns the anomaly record of a scored value, or None when no rule is broken."""
+        limit = self.rate_limits.get(field)
+        scores = {
+            "ewma": abs(ewma_z) / self.z_threshold if ewma_z is not None else 0.0,
+            "window": abs(window_z) / self.z_threshold if window_z is not None else 0.0,
+            "rate": abs(rate) / limit if rate is not None and limit else 0.0,
+        }
+        reasons = [rule for rule, score in scores.items() if score > 1.0]
+        if not reasons:
+            return None
+        return {
+            "timestamp": int(timestamp),
+            "metric": field,
+            "value": float(value),
+            "expected": _rounded(expected),
+            "ewma_z": _rounded(ewma_z),
+            "window_z": _rounded(window_z),
+            "rate_per_minute": _rounded(rate),
+            "reasons": reasons,
+            "score": round(max(scores.values()), 3),
+        }
+
+    def observe(self, state, field, timestamp, value):
+        """Scores one value (epoch milliseconds) against the metric's state, then adds it to the state."""
+        expected = ewma_z = window_z = rate = None
+        if state.count:
+            expected = state.mean
+            if state.count >= self.min_readings and state.var > 0:
+                ewma_z = (value - state.mean) / math.sqrt(state.var)
+        size = len(state.window)
+        if size and size >= self.min_readings:
+            mean = state.window_sum / size
+            var = state.window_sumsq / size - mean * mean
+            if var > 0:
+                window_z = (value - state.reference - mean) / math.sqrt(var)
+        if state.last_time is not None:
+            minutes = max((timestamp - state.last_time) / 60000.0, self.rate_min_minutes)
+            rate = (value - state.last_value) / minutes
+        anomaly = self._anomaly(field, timestamp, value, expected, ewma_z, window_z, rate)
+
+        if state.count == 0:
+            state.mean, state.var = value, 0.0
+        else:
+            diff = value - state.mean
+            increment = self.alpha * diff
+            state.mean += increment
+            state.var = (1.0 - self.alpha) * (state.var + diff * increment)
+        state.count += 1
+
+        if state.reference is None:
+            state.reference = value
+        if len(state.window) == state.window.maxlen:
+            dropped = state.window[0] - state.reference
+            state.window_sum -= dropped
+            state.window_sumsq -= dropped * dropped
+        state.window.append(value)
+        shifted = value - state.reference
+        state.window_sum += shifted
+        state.window_sumsq += shifted * shifted
+        state.updates += 1
+        if state.updates >= state.window.maxlen:
+            state.resum()
+
+        state.last_value, state.last_time = value, timestamp
+        return anomaly
+
+    def score_metric(self, field, timestamps, values, state=None):
+        """
+        Scores a chronological series of one metric in one vectorized pass.
+
+        Args:
+            field (str): The reading field, which selects the rate limit.
+            timestamps (np.ndarray): Epoch milliseconds of each value.
+            values (np.ndarray): The values, NaN where the reading has none.
+            state (MetricState, optional): State from earlier readings, updated in place.
+
+        Returns:
+            tuple: (anomalies, state), the anomalies in chronological order.
+        """
+        state = state or self.new_state()
+        valid = ~np.isnan(values)
+        times = np.asarray(timestamps, dtype=np.float64)[valid]
+        x = np.asarray(values, dtype=np.float64)[valid]
+        n = x.size
+        if n == 0:
+            return [], state
+        decay = 1.0 - self.alpha
+        counts_before = state.count + np.arange(n)
+
+        # EWMA mean and variance before each value (NaN before the first value ever seen)
+        prior_mean = np.full(n, np.nan)
+        prior_var = np.full(n, np.nan)
+        offset = 0
+        mean, var = state.mean, state.var
+        if state.count == 0:
+            mean, var, offset = x[0], 0.0, 1
+        if n > offset:
+            means = _linear_filter(self.alpha * x[offset:], decay, mean)
+            prior_mean[offset:] = np.concatenate(([mean], means[:-1]))
+            diffs = x[offset:] - prior_mean[offset:]
+            variances = _linear_filter(decay * self.alpha * diffs * diffs, decay, var)
+            prior_var[offset:] = np.concatenate(([var], variances[:-1]))
+            mean, var = means[-1], variances[-1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ewma_z = np.where((counts_before >= self.min_readings) & (prior_var > 0),
+                              (x - prior_mean) / np.sqrt(prior_var), np.nan)
+
+        # Mean and standard deviation of the previous `window` values
+        reference = state.reference if state.reference is not None else x[0]
+        previous = np.fromiter(state.window, dtype=np.float64, count=len(state.window))
+        history = np.concatenate((previous, x)) - reference
+        sums = np.concatenate(([0.0], np.cumsum(history)))
+        sumsqs = np.concatenate(([0.0], np.cumsum(history * history)))
+        ends = previous.size + np.arange(n)
+        starts = np.maximum(0, ends - self.window)
+        sizes = ends - starts
+        with np.errstate(divide="ignore", invalid="ignore"):
+            window_mean = (sums[ends] - sums[starts]) / sizes
+            window_var = (sumsqs[ends] - sumsqs[starts]) / sizes - window_mean * window_mean
+            window_z = np.where((sizes > 0) & (sizes >= self.min_readings) & (window_var > 0),
+                                (x - reference - window_mean) / np.sqrt(window_var), np.nan)
+
+        # Change per minute since the previous value
+        previous_values = np.concatenate(([np.nan if state.last_value is None else state.last_value], x[:-1]))
+        previous_times = np.concatenate(([np.nan if state.last_time is None else state.last_time], times[:-1]))
+        rate = (x - previous_values) / np.maximum((times - previous_times) / 60000.0, self.rate_min_minutes)
+
+        limit = self.rate_limits.get(field)
+        flagged = (np.abs(np.nan_to_num(ewma_z)) > self.z_threshold) | (np.abs(np.nan_to_num(window_z)) > self.z_threshold)
+        if limit:
+            flagged |= np.abs(np.nan_to_num(rate)) > limit
+        anomalies = []
+        for i in np.flatnonzero(flagged).tolist():
+            anomaly = self._anomaly(
+                field, times[i], x[i], None if np.isnan(prior_mean[i]) else prior_mean[i],
+                None if np.isnan(ewma_z[i]) else ewma_z[i], None if np.isnan(window_z[i]) else window_z[i],
+                None if np.isnan(rate[i]) else rate[i],
+            )
+            if anomaly is not None:
+                anomalies.append(anomaly)
+
+        state.count += n
+        state.mean, state.var = float(mean), float(var)
+        state.window.clear()
+        state.window.extend((history[-self.window:] + reference).tolist())
+        state.reference = float(reference)
+        state.resum()
+        state.last_value, state.last_time = float(x[-1]), float(times[-1])
+        return anomalies, state
+
+    def score_columns(self, timestamps, columns, states=None):
+        """
+        Scores a chronological window of readings, metric by metric.
+
+        Args:
+            timestamps (np.ndarray): Epoch milliseconds of each reading.
+            columns (dict): Maps reading field to an array of values (NaN where missing).
+            states (dict, optional): Field to MetricState from earlier readings, updated in place.
+
+        Returns:
+            tuple: (anomalies ordered by time, states by field)
+        """
+        states = {} if states is None else states
+        anomalies = []
+        for field, values in columns.items():
+            found, states[field] = self.score_metric(field, timestamps, np.asarray(values, dtype=np.float64),
+                                                     states.get(field))
+            anomalies.extend(found)
+        anomalies.sort(key=lambda anomaly: (anomaly["timestamp"], anomaly["metric"]))
+        return anomalies, states
+
+
+detector = AnomalyDetector()
+
+
+def score_sensor_window(sensor_id, timestamps, columns):
+    """Returns the anomalies in a window of a sensor's readings, scored from an empty state."""
+    anomalies, _ = detector.score_columns(timestamps, columns)
+    for anomaly in anomalies:
+        anomaly["sensor_id"] = sensor_id
+    return anomalies
+
+
+def get_sensor_anomalies(sensor_id, since=None, until=None, limit=None):
+    """
+    Reads a window of a sensor's readings (the last INSIGHT_WINDOW_DAYS by default) and scores it.
+
+    Returns:
+        dict: {"sensor_id", "readings", "anomalies"}
+    """
+    timestamps, columns = get_sensor_columns(sensor_id, since=since, until=until, limit=limit)
+    return {"sensor_id": sensor_id, "readings": int(timestamps.size),
+            "anomalies": score_sensor_window(sensor_id, timestamps, columns)}
+
+
+def _format_timestamp(epoch_ms):
+    return datetime.fromtimestamp(epoch_ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+def format_anomaly_facts(anomalies, max_facts):
+    """Lists the highest scoring anomalies as prompt lines, or returns "" when there are none."""
+    if not anomalies or max_facts <= 0:
+        return ""
+    top = sorted(anomalies, key=lambda anomaly: anomaly["score"], reverse=True)[:max_facts]
+    lines = [f"Detected anomalies: {len(anomalies)} (z-score above {detector.z_threshold:g} against the EWMA "
+             f"or the last {detector.window} readings, or change faster than the rate limit); largest:"]
+    for anomaly in sorted(top, key=lambda anomaly: anomaly["timestamp"]):
+        metric = FIELD_METRICS.get(anomaly["metric"], anomaly["metric"])
+        unit = UNITS.get(metric, "")
+        details = []
+        if anomaly["expected"] is not None:
+            details.append(f"EWMA {anomaly['expected']:.1f}")
+        if anomaly["ewma_z"] is not None:
+            details.append(f"z {anomaly['ewma_z']:+.1f}")
+        if anomaly["window_z"] is not None:
+            details.append(f"rolling z {anomaly['window_z']:+.1f}")
+        if "rate" in anomaly["reasons"]:
+            details.append(f"{anomaly['rate_per_minute']:+.1f}{unit}/min")
+        lines.append(f"- {_format_timestamp(anomaly['timestamp'])} {metric} {anomaly['value']:g}{unit} "
+                     f"({', '.join(details)})")
+    return "\n".join(lines)
+
+
+class _SensorState:
+    __slots__ = ("metrics", "last_timestamp")
+
+    def __init__(self):
+        self.metrics = {}
+        self.last_timestamp = None
+
+
+class AnomalyEngine:
+    """
+    Streaming anomaly detection over ingested readings.
+
+    Keeps the MetricState of every metric of up to max_sensors sensors (the
+    least recently updated are forgotten) and the last max_events anomalies.
+    Readings older than a sensor's latest reading are skipped. Thread-safe.
+    """
+
+    def __init__(self, detector=detector, enabled=ANOMALY_ENABLED, max_sensors=ANOMALY_MAX_SENSORS,
+                 max_events=ANOMALY_MAX_EVENTS):
+        self.detector = detector
+        self.enabled = enabled
+        self.max_sensors = max_sensors
+        self._sensors = OrderedDict()
+        self._recent = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self.counts = {"readings": 0, "late_readings": 0, "anomalies": 0}
+
+    def observe(self, sensor_id, timestamp, values):
+        """
+        Scores one reading and adds it to the sensor's state.
+
+        Args:
+            sensor_id (str): The sensor.
+            timestamp (datetime or int): Reading time (naive datetimes are UTC) or epoch milliseconds.
+            values (dict): Reading field to value; missing and None values are skipped.
+
+        Returns:
+            list[dict]: The reading's anomalies.
+        """
+        if not isinstance(timestamp, (int, float)):
+            timestamp = int(to_epoch_seconds(timestamp) * 1000)
+        anomalies = []
+        with self._lock:
+            sensor = self._sensors.get(sensor_id)
+            if sensor is None:
+                sensor = self._sensors[sensor_id] = _SensorState()
+                if len(self._sensors) > self.max_sensors:
+                    self._sensors.popitem(last=False)
+            else:
+                self._sensors.move_to_end(sensor_id)
+            if sensor.last_timestamp is not None and timestamp < sensor.last_timestamp:
+                self.counts["late_readings"] += 1
+                return anomalies
+            sensor.last_timestamp = timestamp
+            self.counts["readings"] += 1
+            for field, value in values.items():
+                if value is None or (isinstance(value, float) and math.isnan(value)):
+                    continue
+                state = sensor.metrics.get(field)
+                if state is None:
+                    state = sensor.metrics[field] = self.detector.new_state()
+                anomaly = self.detector.observe(state, field, timestamp, float(value))
+                if anomaly is not None:
+                    anomaly["sensor_id"] = sensor_id
+                    anomalies.append(anomaly)
+            self._recent.extend(anomalies)
+            self.counts["anomalies"] += len(anomalies)
+        return anomalies
+
+    def observe_readings(self, readings):
+        """Ingest hook: scores newly inserted readings in chronological order per sensor."""
+        for reading in sorted(readings, key=lambda r: (r["sensor_id"], to_epoch_seconds(r["timestamp"]))):
+            self.observe(reading["sensor_id"], reading["timestamp"],
+                         {field: reading.get(field) for field in FIELD_METRICS})
+
+    def recent(self, sensor_id=None, limit=None):
+        """Returns the latest anomalies detected on ingested readings, newest first."""
+        with self._lock:
+            anomalies = [anomaly for anomaly in reversed(self._recent)
+                         if sensor_id is None or anomaly["sensor_id"] == sensor_id]
+        return anomalies[:limit] if limit else anomalies
+
+    def start(self):
+        """Scores readings as they are ingested; a no-op when disabled."""
+        if self.enabled:
+            register_ingest_hook(self.observe_readings)
+
+    def stop(self):
+        unregister_ingest_hook(self.observe_readings)
+
+    def stats(self):
+        with self._lock:
+            return {"enabled": self.enabled, **self.counts, "sensors": len(self._sensors),
+                    "recent": len(self._recent)}
+
+
+anomaly_engine = AnomalyEngine()
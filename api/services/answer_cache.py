@@ -0,0 +1,156 @@
+# answer_cache.py
+"""Semantic cache of RAG answers, matched on query embedding similarity."""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from api.config import ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL, ANSWER_CACHE_THRESHOLD
+
+
+class _Partition:
+    """Cached entries sharing one date filter, with their unit query vectors stacked for scoring."""
+
+    def __init__(self):
+        self.ids = []
+        self.vectors = []
+        self._matrix = None
+
+    def add(self, entry_id, vector):
+        self.ids.append(entry_id)
+        self.vectors.append(vector)
+        self._matrix = None
+
+    def remove(self, entry_id):
+        position = self.ids.index(entry_id)
+        del self.ids[position]
+        del self.vectors[position]
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            self._matrix = np.vstack(self.vectors)
+        return self._matrix
+
+
+class SemanticAnswerCache:
+    """
+    Reuses the answer of an earlier query whose embedding is within a cosine similarity threshold.
+
+    Entries are partitioned by the query's date filter, so "readings on 2024-11-12"
+    never matches "readings on 2024-11-13" however similar their embeddings are.
+    An entry is only reused while the data watermark it was answered at is
+    unchanged and it is younger than ttl seconds. The least recently used entry
+    is evicted beyond max_entries.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL, threshold=ANSWER_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        # entry id -> (partition, query, answer, watermark, created_at)
+        self._entries = OrderedDict()
+        self._partitions = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def reset_stats(self):
+        self.lookups = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidated = 0
+        self.evictions = 0
+        self.similarity_total = 0.0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._partitions.clear()
+
+    def _remove(self, entry_id):
+        partition_key = self._entries.pop(entry_id)[0]
+        partition = self._partitions[partition_key]
+        partition.remove(entry_id)
+        if not partition.ids:
+            del self._partitions[partition_key]
+
+    def lookup(self, partition_key, embedding, watermark):
+        """
+        Returns (answer, similarity) for the most similar cached query in the partition, or None.
+
+        The best match must reach the threshold, be unexpired and have been answered
+        at the current watermark; matches that fail the last two checks are dropped.
+        """
+        if not self.enabled:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+
+        with self._lock:
+            self.lookups += 1
+            partition = self._partitions.get(partition_key)
+            if partition is not None:
+                scores = partition.matrix @ vector
+                best = int(np.argmax(scores))
+                similarity = float(scores[best])
+                if similarity >= self.threshold:
+                    entry_id = partition.ids[best]
+                    _, _, answer, entry_watermark, created_at = self._entries[entry_id]
+                    if time.monotonic() - created_at >= self.ttl:
+                        self.expired += 1
+                        self._remove(entry_id)
+                    elif entry_watermark != watermark:
+                        self.invalidated += 1
+                        self._remove(entry_id)
+                    else:
+                        self._entries.move_to_end(entry_id)
+                        self.hits += 1
+                        self.similarity_total += similarity
+                        return answer, similarity
+            self.misses += 1
+            return None
+
+    def store(self, partition_key, query, embedding, answer, watermark):
+        """Caches the answer to a query under its date partition."""
+        if not self.enabled:
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (partition_key, query, answer, watermark, time.monotonic())
+            self._partitions.setdefault(partition_key, _Partition()).add(entry_id, vector)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "invalidated": self.invalidated,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "avg_hit_similarity": round(self.similarity_total / self.hits, 4) if self.hits else None,
+                "entries": len(self._entries),
+                "partitions": len(self._partitions),
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+            }
+
+
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,104 @@
+# columnar.py
+"""Columnar sensor series payloads and their JSON, Arrow IPC and msgpack encodings."""
+import json
+
+try:
+    import msgpack
+except ImportError:  # msgpack responses are only offered when it is installed
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+
+def supported_media_types():
+    """Returns the encodings available in this environment, preferred first."""
+    media_types = [JSON_MEDIA_TYPE, ARROW_MEDIA_TYPE]
+    if msgpack is not None:
+        media_types.append(MSGPACK_MEDIA_TYPE)
+    return media_types
+
+
+def negotiate_media_type(accept):
+    """
+    Picks the response encoding from an Accept header.
+
+    Returns:
+        str or None: The chosen media type (JSON when the header is missing or
+            accepts anything), or None when nothing acceptable is supported.
+    """
+    supported = supported_media_types()
+    if not accept:
+        return JSON_MEDIA_TYPE
+
+    ranges = []
+    for position, item in enumerate(accept.split(",")):
+        media_range, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            ranges.append((-quality, position, media_range.lower()))
+
+    for _, _, media_range in sorted(ranges):
+        if media_range in ("*/*", "application/*"):
+            return JSON_MEDIA_TYPE
+        if media_range in supported:
+            return media_range
+    return None
+
+
+def to_columnar(sensor_id, timestamps, columns):
+    """
+    Builds the columnar payload for a sensor's readings.
+
+    Args:
+        sensor_id (str): The sensor ID.
+        timestamps (np.ndarray): int64 epoch milliseconds.
+        columns (dict): Metric name to float64 array aligned with timestamps.
+
+    Returns:
+        dict: {"sensor_id", "timestamps", "metrics"} holding NumPy arrays.
+    """
+    return {"sensor_id": sensor_id, "timestamps": timestamps, "metrics": columns}
+
+
+def _json_values(values):
+    # JSON has no NaN, so missing values become null
+    return [None if value != value else value for value in values.tolist()]
+
+
+def columnar_to_json_dict(payload):
+    """Converts a columnar payload's arrays into JSON-serializable lists."""
+    return {
+        "sensor_id": payload["sensor_id"],
+        "timestamps": payload["timestamps"].tolist(),
+        "metrics": {metric: _json_values(values) for metric, values in payload["metrics"].items()},
+    }
+
+
+def encode_columnar(payload, media_type):
+    """Encodes a columnar payload as bytes in the given media type."""
+    if media_type == ARROW_MEDIA_TYPE:
+        # pyarrow is imported on the first Arrow response, keeping it out of the API's startup
+        import pyarrow as pa
+
+        arrays = [pa.array(payload["timestamps"], type=pa.timestamp("ms", tz="UTC"))]
+        names = ["timestamp"]
+        for metric, values in payload["metrics"].items():
+            arrays.append(pa.array(values, type=pa.float64(), from_pandas=True))
+            names.append(metric)
+        table = pa.Table.from_arrays(arrays, names=names, metadata={"sensor_id": payload["sensor_id"]})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(columnar_to_json_dict(payload))
+    return json.dumps(columnar_to_json_dict(payload), separators=(",", ":")).encode("utf-8")
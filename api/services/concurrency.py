@@ -0,0 +1,160 @@
+# concurrency.py
+"""Runs blocking Mongo and Bedrock calls off the event loop with bounded concurrency and timeouts."""
+import asyncio
+import functools
+import logging
+import time
+
+import anyio
+from anyio import to_thread
+
+from api.config import (
+    MONGO_MAX_CONCURRENCY, BEDROCK_MAX_CONCURRENCY,
+    MONGO_STAGE_TIMEOUT, EMBEDDING_STAGE_TIMEOUT, LLM_STAGE_TIMEOUT,
+)
+from api.services.metrics import record_stage
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of in-flight calls per downstream service
+DOWNSTREAM_LIMITS = {
+    "mongo": MONGO_MAX_CONCURRENCY,
+    "bedrock": BEDROCK_MAX_CONCURRENCY,
+}
+
+# Each request stage maps to the downstream it calls and its timeout in seconds
+STAGES = {
+    "sensor_query": ("mongo", MONGO_STAGE_TIMEOUT),
+    "vector_search": ("mongo", MONGO_STAGE_TIMEOUT),
+    "embedding": ("bedrock", EMBEDDING_STAGE_TIMEOUT),
+    "llm": ("bedrock", LLM_STAGE_TIMEOUT),
+}
+
+DISCONNECT_POLL_INTERVAL = 0.5
+
+_limiters = {}
+
+
+class StageTimeoutError(TimeoutError):
+    """Raised when a request stage does not finish within its timeout."""
+
+    def __init__(self, stage, timeout):
+        super().__init__(f"Stage '{stage}' timed out after {timeout:g}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+class ClientDisconnectedError(Exception):
+    """Raised when the HTTP client goes away before the response is ready."""
+
+
+def get_limiter(downstream):
+    """Returns the capacity limiter for a downstream (created inside the running event loop)."""
+    limiter = _limiters.get(downstream)
+    if limiter is None:
+        limiter = _limiters[downstream] = anyio.CapacityLimiter(DOWNSTREAM_LIMITS[downstream])
+    return limiter
+
+
+def limiter_stats():
+    """Returns in-flight and waiting call counts per downstream."""
+    return {
+        name: {
+            "limit": DOWNSTREAM_LIMITS[name],
+            "in_flight": limiter.borrowed_tokens,
+            "waiting": limiter.statistics().tasks_waiting,
+        }
+        for name, limiter in _limiters.items()
+    }
+
+
+async def run_stage(stage, func, *args, **kwargs):
+    """
+    Runs a blocking call for a request stage in a worker thread.
+
+    The call waits for a free slot on its downstream's limiter and is abandoned
+    (the awaiting request is released) if the stage timeout expires or the
+    request is cancelled. The worker thread itself cannot be interrupted and is
+    left to finish in the background.
+
+    Args:
+        stage (str): A key of STAGES, e.g. "sensor_query" or "llm".
+        func (callable): The blocking function to run.
+
+    Returns:
+        The return value of func.
+
+    Raises:
+        StageTimeoutError: If the stage does not finish in time.
+    """
+    downstream, timeout = STAGES[stage]
+    call = functools.partial(func, *args, **kwargs)
+    started = time.perf_counter()
+    try:
+        with anyio.fail_after(timeout):
+            return await to_thread.run_sync(call, limiter=get_limiter(downstream), abandon_on_cancel=True)
+    except TimeoutError:
+        logger.warning("Stage %s timed out after %ss", stage, timeout)
+        raise StageTimeoutError(stage, timeout) from None
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+async def iterate_stage(stage, func, *args, **kwargs):
+    """
+    Iterates a blocking generator for a request stage without blocking the event loop.
+
+    func(*args, **kwargs) is called in a worker thread and so is every next() on
+    the iterator it returns. One slot of the stage's downstream limiter is held
+    for the whole iteration and the stage timeout applies to each item, so it
+    bounds the time to first item and the gaps between items.
+
+    Yields:
+        The items produced by the iterator.
+
+    Raises:
+        StageTimeoutError: If an item does not arrive in time.
+    """
+    downstream, timeout = STAGES[stage]
+    done = object()
+    started = time.perf_counter()
+    first_item = True
+    async with get_limiter(downstream):
+        try:
+            with anyio.fail_after(timeout):
+                iterator = await to_thread.run_sync(functools.partial(func, *args, **kwargs), abandon_on_cancel=True)
+            while True:
+                with anyio.fail_after(timeout):
+                    item = await to_thread.run_sync(next, iterator, done, abandon_on_cancel=True)
+                if item is done:
+                    return
+                if first_item:
+                    record_stage(f"{stage}_first_item", time.perf_counter() - started)
+                    first_item = False
+                yield item
+        except TimeoutError:
+            logger.warning("Stage %s timed out after %ss", stage, timeout)
+            raise StageTimeoutError(stage, timeout) from None
+        finally:
+            record_stage(stage, time.perf_counter() - started)
+
+
+async def cancel_on_disconnect(request, func, *args, **kwargs):
+    """
+    Awaits func(*args, **kwargs), cancelling it if the client disconnects first.
+
+    Raises:
+        ClientDisconnectedError: If the client disconnected before func finished.
+    """
+    work = asyncio.ensure_future(func(*args, **kwargs))
+    try:
+        while True:
+            done, _ = await asyncio.wait({work}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return work.result()
+            if await request.is_disconnected():
+                logger.info("Client disconnected, cancelling %s", getattr(func, "__name__", func))
+                raise ClientDisconnectedError("Client disconnected before the response was ready")
+    finally:
+        if not work.done():
+            work.cancel()
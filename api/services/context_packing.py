@@ -0,0 +1,232 @@
+# context_packing.py
+"""Packs retrieved readings into a compact, token-budgeted context for the RAG prompt."""
+import bisect
+import logging
+import math
+from dataclasses import dataclass, asdict, field
+from datetime import datetime, timezone
+
+import numpy as np
+
+from api.config import CONTEXT_TOKEN_BUDGET, CONTEXT_RECENCY_WEIGHT
+from api.services.metrics import CONTEXT_TOKENS
+from api.services.sensor_digest import to_epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+# Reading fields rendered as table columns, with their header labels
+COLUMNS = (("temperature", "temp °C"), ("humidity", "humidity %"), ("AQI", "AQI"), ("CO2_level", "CO2 ppm"))
+
+# Rough characters per token of English and numeric text for Claude's tokenizer;
+# the budget is an estimate, not an exact token count
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+@dataclass
+class PackedContext:
+    text: str = ""
+    budget: int = 0
+    candidates: int = 0
+    duplicates: int = 0
+    packed_readings: int = 0
+    dropped_readings: int = 0
+    packed_tokens: int = 0
+    dropped_tokens: int = 0
+    # Tokens of the retrieved texts joined as-is, for comparison
+    unpacked_tokens: int = 0
+    sensors: list = field(default_factory=list)
+
+    def stats(self):
+        stats = asdict(self)
+        del stats["text"]
+        return stats
+
+
+def _format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+def _format_time(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+def _epoch_seconds(doc):
+    try:
+        return to_epoch_seconds(doc["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _dedupe(docs):
+    """Drops repeated readings (same ID, or same sensor, time and values when there is no ID)."""
+    seen = set()
+    unique = []
+    for doc in docs:
+        key = doc.get("id") or (doc.get("sensor_id"), str(doc.get("timestamp")),
+                                *(doc.get(name) for name, _ in COLUMNS), doc.get("text"))
+        if key not in seen:
+            seen.add(key)
+            unique.append(doc)
+    return unique
+
+
+def _rank(docs, recency_weight):
+    """Orders readings by a blend of min-max scaled relevance score and recency."""
+    def scaled(values):
+        values = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        if np.all(np.isnan(values)):
+            return np.zeros(len(values))
+        lo, hi = np.nanmin(values), np.nanmax(values)
+        values = np.nan_to_num(values, nan=lo)
+        return (values - lo) / (hi - lo) if hi > lo else np.ones(len(values))
+
+    relevance = scaled([doc.get("score") for doc in docs])
+    recency = scaled([_epoch_seconds(doc) for doc in docs])
+    ranking = (1.0 - recency_weight) * relevance + recency_weight * recency
+    return [docs[i] for i in np.argsort(-ranking, kind="stable")]
+
+
+def _row_values(doc):
+    return tuple(_format_value(doc.get(name)) for name, _ in COLUMNS)
+
+
+def _sensor_header(sensor_id):
+    return f"Sensor {sensor_id} (time UTC | {' | '.join(label for _, label in COLUMNS)}):"
+
+
+def _run_line(members, values):
+    """Renders a run of identical readings, given its (sort key, epoch seconds) members, as one table row."""
+    start, end = members[0][1], members[-1][1]
+    times = _format_time(start) if start is not None else "unknown"
+    if len(members) > 1:
+        times += f" to {_format_time(end)[11:]} (x{len(members)})"
+    return f"{times} | {' | '.join(values)}"
+
+
+def _runs(entries):
+    """Groups chronologically ordered (sort key, epoch seconds, row values) entries into runs of identical readings."""
+    runs = []
+    for key, seconds, values in entries:
+        run = runs[-1] if runs else None
+        if run is not None and values == run[2] and seconds is not None and run[1][0][1] is not None:
+            run[1].append((key, seconds))
+        else:
+            runs.append([key, [(key, seconds)], values])
+    for run in runs:
+        run.append(_run_line(run[1], run[2]))
+    return runs
+
+
+class _SensorTable:
+    """
+    One sensor's readings as chronological table rows, collapsing consecutive identical readings.
+
+    Rows are kept as runs ([first sort key, members, values, line]) with the
+    length of the rendered table, so a reading is costed and added by
+    re-rendering only the runs around it rather than the whole table.
+    """
+
+    def __init__(self, sensor_id):
+        self.header = _sensor_header(sensor_id)
+        self.runs = []
+        self.starts = []
+        self.readings = 0
+        # Length of the table rendered as lines each ending in a newline
+        self.chars = len(self.header) + 1
+
+    @property
+    def tokens(self):
+        return math.ceil(self.chars / CHARS_PER_TOKEN)
+
+    def plan(self, doc):
+        """Returns (table length with the reading added, change to apply with add)."""
+        seconds, values = _epoch_seconds(doc), _row_values(doc)
+        key = seconds or 0.0
+        # Runs starting at or before the reading's time; it is placed after readings at the same time
+        position = bisect.bisect_right(self.starts, key)
+        lo, hi = max(position - 1, 0), min(position + 1, len(self.runs))
+        entries = [(member_key, member_seconds, run[2]) for run in self.runs[lo:hi] for member_key, member_seconds in run[1]]
+        index = bisect.bisect_right([entry[0] for entry in entries], key)
+        entries.insert(index, (key, seconds, values))
+        replacement = _runs(entries)
+        chars = (self.chars - sum(len(run[3]) + 1 for run in self.runs[lo:hi])
+                 + sum(len(run[3]) + 1 for run in replacement))
+        return chars, (lo, hi, replacement, chars)
+
+    def add(self, change):
+        lo, hi, replacement, chars = change
+        self.runs[lo:hi] = replacement
+        self.starts[lo:hi] = [run[0] for run in replacement]
+        self.readings += 1
+        self.chars = chars
+
+    def lines(self):
+        return [self.header] + [run[3] for run in self.runs]
+
+
+def pack_context(docs, budget=CONTEXT_TOKEN_BUDGET, recency_weight=CONTEXT_RECENCY_WEIGHT):
+    """
+    Packs retrieved readings into per-sensor tables within an estimated token budget.
+
+    Readings are deduplicated, ranked by relevance score (when the search returns
+    one) blended with recency, and taken in rank order until the next one would
+    exceed the budget. The chosen readings are grouped per sensor and rendered
+    chronologically, one compact row per reading or run of identical readings.
+    Retrieved documents without a sensor ID are packed as their raw text.
+
+    Args:
+        docs (list[dict]): Vector search results.
+        budget (int): Estimated tokens available for the context.
+        recency_weight (float): Weight of recency against relevance, from 0 to 1.
+
+    Returns:
+        PackedContext: The context text and packing statistics.
+    """
+    packed = PackedContext(budget=budget, candidates=len(docs))
+    packed.unpacked_tokens = estimate_tokens(" ".join(str(doc.get("text", "")) for doc in docs))
+    unique = _dedupe(docs)
+    packed.duplicates = len(docs) - len(unique)
+
+    tables, loose = {}, []
+    used = 0
+    for doc in _rank(unique, recency_weight):
+        sensor_id = doc.get("sensor_id")
+        if sensor_id is None:
+            cost = estimate_tokens(f"{doc.get('text', '')}\n")
+        else:
+            # The reading may extend a run instead of adding a row, so its cost is the table's change
+            table = tables.get(sensor_id) or _SensorTable(sensor_id)
+            chars, change = table.plan(doc)
+            cost = math.ceil(chars / CHARS_PER_TOKEN) - (table.tokens if sensor_id in tables else 0)
+        if used + cost > budget:
+            packed.dropped_readings += 1
+            packed.dropped_tokens += cost
+            continue
+        used += cost
+        if sensor_id is None:
+            loose.append(doc)
+        else:
+            table.add(change)
+            tables[sensor_id] = table
+
+    lines = []
+    for table in tables.values():
+        lines.extend(table.lines())
+    lines.extend(str(doc.get("text", "")) for doc in loose)
+
+    packed.text = "\n".join(lines)
+    packed.packed_readings = sum(table.readings for table in tables.values()) + len(loose)
+    packed.packed_tokens = estimate_tokens(packed.text)
+    packed.sensors = list(tables)
+    CONTEXT_TOKENS.inc(packed.packed_tokens, kind="packed")
+    CONTEXT_TOKENS.inc(packed.dropped_tokens, kind="dropped")
+    logger.debug("Packed RAG context: %s", packed.stats())
+    return packed
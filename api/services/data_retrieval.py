@@ -1,92 +1,351 @@
 # data_retrieval.py
-import certifi
-from api.config import MONGO_URI, DB_NAME, COLLECTION_NAME, VECTOR_DB_NAME, VECTOR_COLLECTION_NAME
+from api.config import DB_NAME, COLLECTION_NAME, MONGO_BATCH_SIZE, MONGO_TIMESERIES, INSIGHT_WINDOW_DAYS, LOG_PAYLOADS
 
-from langchain.schema import Document
-from pymongo import MongoClient
+import logging
+
+import threading
+import numpy as np
+from pymongo import ASCENDING, DESCENDING
 from datetime import datetime, timedelta, timezone
-from typing import List
+from typing import TYPE_CHECKING, List
 from api.services.load_rag_data import generate_embedding
+from api.services.mongo_client import mongo_manager
+
+if TYPE_CHECKING:
+    from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+METRIC_FIELDS = ("temperature", "humidity", "AQI", "CO2_level")
+
+# Only the fields needed to build reading documents are read from MongoDB
+METRIC_PROJECTION = {"_id": 0, "sensor_id": 1, "timestamp": 1, **{field: 1 for field in METRIC_FIELDS}}
+
+def _time_range(since=None, until=None):
+    time_range = {}
+    if since is not None:
+        time_range["$gte"] = since
+    if until is not None:
+        time_range["$lte"] = until
+    return time_range
+
+def _epoch_ms(timestamp):
+    # pymongo returns naive datetimes in UTC
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() * 1000)
+
+def _as_float(value):
+    return np.nan if value is None else float(value)
+
+def ensure_readings_collection(db, collection_name):
+    """
+    Creates the (sensor_id, timestamp) index the retriever queries rely on.
+
+    With MONGO_TIMESERIES enabled, a missing readings collection is first created
+    as a MongoDB time-series collection with sensor_id as its meta field.
+    """
+    if MONGO_TIMESERIES and collection_name not in db.list_collection_names():
+        db.create_collection(collection_name, timeseries={"timeField": "timestamp", "metaField": "sensor_id", "granularity": "seconds"})
+    db[collection_name].create_index([("sensor_id", ASCENDING), ("timestamp", ASCENDING)], name="sensor_id_timestamp")
 
 class MongoDBRetriever:
-    def __init__(self, connection_string, database_name, collection_name):
-        ca = certifi.where()
-        self.client = MongoClient(connection_string, tlsCAFile=ca)
+    # Collections whose indexes were already ensured by this process
+    _ensured_collections = set()
+    _ensure_lock = threading.Lock()
+
+    def __init__(self, database_name=DB_NAME, collection_name=COLLECTION_NAME, manager=mongo_manager, batch_size=MONGO_BATCH_SIZE):
+        # Collections come from the shared pooled client, so a retriever is cheap to create
+        self.client = manager.client
         self.db = self.client[database_name]
         self.collection = self.db[collection_name]
+        self.batch_size = batch_size
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        key = (self.db.name, self.collection.name)
+        if key in self._ensured_collections:
+            return
+        with self._ensure_lock:
+            if key not in self._ensured_collections:
+                ensure_readings_collection(self.db, self.collection.name)
+                self._ensured_collections.add(key)
+
+    @staticmethod
+    def _to_documents(results) -> List["Document"]:
+        # Format data for LangChain (imported here, as it is slow to import and only needed for documents)
+        from langchain.schema import Document
 
-    def retrieve_data(self, start_date: datetime, end_date: datetime) -> List[Document]:
+        return [
+            Document(page_content=f"Temperature: {doc['temperature']}, Humidity: {doc['humidity']}, AQI: {doc['AQI']}, CO2_level: {doc['CO2_level']}", metadata={"timestamp": doc["timestamp"], "sensor": doc["sensor_id"]})
+            for doc in results
+        ]
+
+    def retrieve_data(self, start_date: datetime, end_date: datetime) -> List["Document"]:
         try:
             query = {
-                "timestamp": {"$gte": start_date, "$lte": end_date}
+                "timestamp": _time_range(start_date, end_date)
             }
-            results = self.collection.find(query)
-            
-            # Format data for LangChain
-            documents = [
-                Document(page_content=f"Temperature: {doc['temperature']}, Humidity: {doc['humidity']}, AQI: {doc['AQI']}, CO2_level: {doc['CO2_level']}", metadata={"timestamp": doc["timestamp"], "sensor": doc["sensor_id"]})
-                for doc in results
-            ]
-            return documents
+            results = self.collection.find(query, METRIC_PROJECTION, batch_size=self.batch_size).sort("timestamp", ASCENDING)
+            return self._to_documents(results)
         except Exception as e:
             return {str(e)}
     
     def retrieve_data_for_kb(self, start_date: datetime, end_date: datetime):
         try:
             query = {
-                "timestamp": {"$gte": start_date, "$lte": end_date}
+                "timestamp": _time_range(start_date, end_date)
             }
-            # results = self.collection.find(query)
-            results = self.collection.find()
+            results = self.collection.find(query, batch_size=self.batch_size)
             
             return results
         except Exception as e:
             return {str(e)}
     
-    def retrieve_data_by_id(self, sensor_id: str) -> List[Document]:
+    def retrieve_data_by_id(self, sensor_id: str, since: datetime = None, until: datetime = None, limit: int = None) -> List["Document"]:
+        """
+        Retrieves one sensor's readings in chronological order.
+
+        The exact-match, time-bounded query is served by the (sensor_id, timestamp)
+        index and only reads the metric fields. With a limit, the most recent
+        `limit` readings in the window are returned.
+        """
         try:
-            query = {
-                "sensor_id": {"$gte": sensor_id}
-            }
-            results = self.collection.find(query)
+            query = {"sensor_id": sensor_id}
+            time_range = _time_range(since, until)
+            if time_range:
+                query["timestamp"] = time_range
 
-            if not results:
-                return f"No data found for sensor_id: {sensor_id}"
-            
-            # Format data for LangChain
-            documents = [
-                Document(page_content=f"Temperature: {doc['temperature']}, Humidity: {doc['humidity']}, AQI: {doc['AQI']}, CO2_level: {doc['CO2_level']}", metadata={"timestamp": doc["timestamp"], "sensor": doc["sensor_id"]})
-                for doc in results
-            ]
-            return documents
+            cursor = self.collection.find(query, METRIC_PROJECTION, batch_size=self.batch_size)
+            if limit:
+                documents = self._to_documents(cursor.sort("timestamp", DESCENDING).limit(limit))
+                documents.reverse()
+                return documents
+            return self._to_documents(cursor.sort("timestamp", ASCENDING))
         except Exception as e:
             return {str(e)}
 
+    def latest_timestamp(self, sensor_id: str, since: datetime = None, until: datetime = None):
+        """Returns the timestamp of the sensor's latest reading in the window (an index-only lookup), or None."""
+        query = {"sensor_id": sensor_id}
+        time_range = _time_range(since, until)
+        if time_range:
+            query["timestamp"] = time_range
+        latest = next(self.collection.find(query, {"_id": 0, "timestamp": 1}).sort("timestamp", DESCENDING).limit(1), None)
+        return latest["timestamp"] if latest else None
+
+    def latest_timestamps(self, since: datetime):
+        """
+        Returns {sensor_id: timestamp of the latest reading} for the sensors with readings since `since`.
+
+        A match on timestamp alone cannot use the (sensor_id, timestamp) index, so the
+        sensors are listed with an index-backed distinct and each one's latest reading
+        is found with an index-only lookup.
+        """
+        latest = {}
+        for sensor_id in self.collection.distinct("sensor_id"):
+            timestamp = self.latest_timestamp(sensor_id, since=since)
+            if timestamp is not None:
+                latest[sensor_id] = timestamp
+        return latest
+
+    def retrieve_columns(self, sensor_id: str, since: datetime = None, until: datetime = None, limit: int = None):
+        """
+        Retrieves one sensor's readings as columnar NumPy arrays, without building documents.
+
+        Returns:
+            tuple: (timestamps, columns) where timestamps is an int64 array of epoch
+                milliseconds in chronological order and columns maps each of
+                METRIC_FIELDS to a float64 array (NaN for missing values).
+        """
+        query = {"sensor_id": sensor_id}
+        time_range = _time_range(since, until)
+        if time_range:
+            query["timestamp"] = time_range
+        projection = {"_id": 0, "timestamp": 1, **{field: 1 for field in METRIC_FIELDS}}
+
+        cursor = self.collection.find(query, projection, batch_size=self.batch_size)
+        if limit:
+            cursor = cursor.sort("timestamp", DESCENDING).limit(limit)
+        else:
+            cursor = cursor.sort("timestamp", ASCENDING)
 
-def get_sensor_data(sensor_id=None, for_rag=False):
-    """Retrieve sensor data from MongoDB."""
+        # Rows are consumed as the cursor streams them, so no per-row dicts are kept
+        timestamps = []
+        values = {field: [] for field in METRIC_FIELDS}
+        for row in cursor:
+            timestamps.append(_epoch_ms(row["timestamp"]))
+            for field in METRIC_FIELDS:
+                values[field].append(_as_float(row.get(field)))
+
+        order = slice(None, None, -1) if limit else slice(None)
+        columns = {field: np.array(column, dtype=np.float64)[order] for field, column in values.items()}
+        return np.array(timestamps, dtype=np.int64)[order], columns
+
+    def retrieve_columns_many(self, sensor_ids: List[str], since: datetime = None, until: datetime = None, limit: int = None):
+        """
+        Retrieves several sensors' readings with one `$in` query, split into per-sensor columns.
+
+        Sorting on (sensor_id, timestamp) follows the compound index, so each
+        sensor's readings arrive contiguously and in chronological order. With a
+        limit, each sensor's most recent `limit` readings are instead read with
+        its own sorted, limited query (as retrieve_columns does), so the window's
+        older readings are never fetched.
+
+        Returns:
+            dict: Sensor ID to (timestamps, columns) as returned by retrieve_columns,
+                for the sensors that have readings in the window.
+        """
+        if limit:
+            results = {}
+            for sensor_id in dict.fromkeys(sensor_ids):
+                timestamps, columns = self.retrieve_columns(sensor_id, since=since, until=until, limit=limit)
+                if timestamps.size:
+                    results[sensor_id] = (timestamps, columns)
+            return results
+
+        query = {"sensor_id": {"$in": list(sensor_ids)}}
+        time_range = _time_range(since, until)
+        if time_range:
+            query["timestamp"] = time_range
+        projection = {"_id": 0, "sensor_id": 1, "timestamp": 1, **{field: 1 for field in METRIC_FIELDS}}
+        cursor = self.collection.find(query, projection, batch_size=self.batch_size).sort(
+            [("sensor_id", ASCENDING), ("timestamp", ASCENDING)]
+        )
+
+        results = {}
+
+        def finish(sensor_id, timestamps, values):
+            results[sensor_id] = (
+                np.array(timestamps, dtype=np.int64),
+                {field: np.array(column, dtype=np.float64) for field, column in values.items()},
+            )
+
+        current, timestamps, values = None, [], {}
+        for row in cursor:
+            if row["sensor_id"] != current:
+                if current is not None:
+                    finish(current, timestamps, values)
+                current, timestamps, values = row["sensor_id"], [], {field: [] for field in METRIC_FIELDS}
+            timestamps.append(_epoch_ms(row["timestamp"]))
+            for field in METRIC_FIELDS:
+                values[field].append(_as_float(row.get(field)))
+        if current is not None:
+            finish(current, timestamps, values)
+        return results
+
+
+def default_since(since=None):
+    """Returns `since`, or the start of the default INSIGHT_WINDOW_DAYS window when it is not given."""
+    if since is None and INSIGHT_WINDOW_DAYS > 0:
+        since = datetime.now(timezone.utc) - timedelta(days=INSIGHT_WINDOW_DAYS)
+    return since
+
+def _hot_store():
+    # Imported here, as the store loads its windows through this module
+    from api.services.hot_store import hot_store
+
+    return hot_store
+
+def _reading_value(value):
+    # Held values are floats; whole numbers are shown like the integers most sensors report
+    if value != value:
+        return None
+    return int(value) if value.is_integer() else value
+
+def columns_to_documents(sensor_id, timestamps, columns) -> List["Document"]:
+    """Builds the documents MongoDBRetriever.retrieve_data_by_id returns from columnar readings."""
+    from langchain.schema import Document
+
+    values = zip(*(columns[field].tolist() for field in METRIC_FIELDS))
+    return [
+        Document(page_content="Temperature: {}, Humidity: {}, AQI: {}, CO2_level: {}".format(*map(_reading_value, row)),
+                 metadata={"timestamp": datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc).replace(tzinfo=None),
+                           "sensor": sensor_id})
+        for timestamp, row in zip(timestamps.tolist(), values)
+    ]
+
+def get_sensor_data(sensor_id=None, for_rag=False, since=None, until=None, limit=None):
+    """Retrieve sensor data from MongoDB.
+
+    For a sensor, the window defaults to the last INSIGHT_WINDOW_DAYS days when
+    `since` is not given (0 disables the bound), and is read from the hot window
+    store when it holds it.
+    """
     try:
-        retriever = MongoDBRetriever(MONGO_URI, DB_NAME, COLLECTION_NAME)
+        retriever = MongoDBRetriever(DB_NAME, COLLECTION_NAME)
         if sensor_id:
-            print("Retrieving by id")
-            documents = retriever.retrieve_data_by_id(sensor_id=sensor_id)
+            logger.debug("Retrieving readings of sensor %s", sensor_id)
+            since = default_since(since)
+            held = _hot_store().get(sensor_id, since, until, limit)
+            if held is not None:
+                documents = columns_to_documents(sensor_id, *held)
+            else:
+                documents = retriever.retrieve_data_by_id(sensor_id=sensor_id, since=since, until=until, limit=limit)
         elif for_rag:
-            print("Retrieving yesterday data")
+            logger.debug("Retrieving yesterday's readings")
             yesterday = datetime.now() - timedelta(days=1)
             yesterday_start = datetime(yesterday.year, yesterday.month, yesterday.day)  # Midnight at the start of yesterday
             yesterday_end = yesterday_start + timedelta(days=1)  # Midnight at the start of today
             documents = retriever.retrieve_data(start_date=yesterday_start, end_date=yesterday_end)
         else:
-            print("Retrieving all")
+            logger.debug("Retrieving the last week's readings")
             one_week_ago = datetime.now(timezone.utc) - timedelta(weeks=1)
             documents = retriever.retrieve_data(start_date=one_week_ago, end_date=datetime.now(timezone.utc))
         doc_list = list(documents)
-        print(doc_list)
+        if LOG_PAYLOADS:
+            logger.info("Retrieved documents: %s", doc_list)
 
         return doc_list
     except Exception as e:
         return {str(e)}
 
+def get_sensor_columns(sensor_id, since=None, until=None, limit=None):
+    """Retrieve a sensor's readings as columnar arrays (see MongoDBRetriever.retrieve_columns).
+
+    The window is read from the hot window store when it holds it.
+    """
+    since = default_since(since)
+    held = _hot_store().get(sensor_id, since, until, limit)
+    if held is not None:
+        return held
+    retriever = MongoDBRetriever(DB_NAME, COLLECTION_NAME)
+    return retriever.retrieve_columns(sensor_id, since=since, until=until, limit=limit)
+
+def get_sensors_columns(sensor_ids, since=None, until=None, limit=None):
+    """Retrieve several sensors' readings as columnar arrays (see MongoDBRetriever.retrieve_columns_many).
+
+    Sensors held by the hot window store are read from it, the rest with one
+    query (which does not load them into the store).
+    """
+    since = default_since(since)
+    results, missing = {}, []
+    for sensor_id in sensor_ids:
+        held = _hot_store().get(sensor_id, since, until, limit, load=False)
+        if held is None:
+            missing.append(sensor_id)
+        elif held[0].size:
+            results[sensor_id] = held
+    if missing:
+        retriever = MongoDBRetriever(DB_NAME, COLLECTION_NAME)
+        results.update(retriever.retrieve_columns_many(missing, since=since, until=until, limit=limit))
+    return results
+
+def get_sensor_watermark(sensor_id, since=None, until=None):
+    """Returns the epoch milliseconds of the sensor's latest reading in the window, or None when it has none."""
+    since = default_since(since)
+    held = _hot_store().get(sensor_id, since, until, limit=1)
+    if held is not None:
+        return int(held[0][-1]) if held[0].size else None
+    retriever = MongoDBRetriever(DB_NAME, COLLECTION_NAME)
+    latest = retriever.latest_timestamp(sensor_id, since=since, until=until)
+    return _epoch_ms(latest) if latest is not None else None
+
+def get_active_sensor_watermarks(since):
+    """Returns {sensor_id: epoch milliseconds of its latest reading} for the sensors with readings since `since`."""
+    retriever = MongoDBRetriever(DB_NAME, COLLECTION_NAME)
+    return {sensor_id: _epoch_ms(latest) for sensor_id, latest in retriever.latest_timestamps(since).items()}
+
 # update_knowledge_base()
 # get_sensor_data()
 
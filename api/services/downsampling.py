@@ -0,0 +1,198 @@
+# downsampling.py
+"""Server-side downsampling of sensor series for charts: Mongo time buckets and LTTB."""
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from api.config import DB_NAME, COLLECTION_NAME, INSIGHT_WINDOW_DAYS, ROLLUPS_ENABLED
+from api.services.data_retrieval import MongoDBRetriever, METRIC_FIELDS
+from api.services.rollups import RESOLUTIONS, window_aggregates, coarsen
+
+DOWNSAMPLING_METHODS = ("bucket", "lttb")
+
+
+def _as_utc(value):
+    # Datetimes without an offset (e.g. ?start=2024-11-10T00:00:00) are UTC, like the stored readings
+    return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+
+
+def default_time_range(start=None, end=None):
+    """Fills in a missing end (now) and start (INSIGHT_WINDOW_DAYS before end); naive datetimes are taken as UTC."""
+    start, end = _as_utc(start), _as_utc(end)
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=INSIGHT_WINDOW_DAYS or 7)
+    return start, end
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Selects the indices of a Largest-Triangle-Three-Buckets reduction of a series.
+
+    The first and last points are always kept. Bucket averages are computed with
+    cumulative sums and each bucket's triangle areas in one vectorized step, so
+    the Python-level loop runs once per output point, not per input point.
+
+    Args:
+        x (np.ndarray): Monotonically increasing x values (e.g. epoch milliseconds).
+        y (np.ndarray): Series values, without NaNs.
+        threshold (int): Number of points to keep.
+
+    Returns:
+        np.ndarray: Sorted indices into x and y.
+    """
+    count = len(x)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Bucket edges for the count - 2 interior points, split into threshold - 2 buckets
+    edges = np.floor(np.linspace(1, count - 1, threshold - 1)).astype(np.int64)
+    x_sums = np.concatenate([[0.0], np.cumsum(x)])
+    y_sums = np.concatenate([[0.0], np.cumsum(y)])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = count - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket (the last point for the final bucket)
+        if bucket + 2 < len(edges):
+            next_lo, next_hi = edges[bucket + 1], edges[bucket + 2]
+            avg_x = (x_sums[next_hi] - x_sums[next_lo]) / (next_hi - next_lo)
+            avg_y = (y_sums[next_hi] - y_sums[next_lo]) / (next_hi - next_lo)
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[lo:hi] - y[previous]) - (x[previous] - x[lo:hi]) * (avg_y - y[previous])
+        )
+        previous = lo + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def lttb_series(sensor_id, start, end, points, retriever=None):
+    """
+    Returns each metric reduced to at most `points` points with LTTB.
+
+    Returns:
+        dict: {"method": "lttb", "metrics": {metric: {"timestamps": [...], "values": [...]}}}
+            where timestamps are epoch milliseconds.
+    """
+    retriever = retriever or MongoDBRetriever(DB_NAME, COLLECTION_NAME)
+    timestamps, columns = retriever.retrieve_columns(sensor_id, since=start, until=end)
+    metrics = {}
+    for metric, values in columns.items():
+        valid = ~np.isnan(values)
+        x, y = timestamps[valid], values[valid]
+        keep = lttb_indices(x, y, points)
+        metrics[metric] = {"timestamps": x[keep].tolist(), "values": y[keep].tolist()}
+    return {"method": "lttb", "points": int(timestamps.size), "metrics": metrics}
+
+
+def bucket_pipeline(sensor_id, start, end, points):
+    """Builds the aggregation that groups a sensor's readings into `points` equal time buckets."""
+    # Compared with the stored timestamps, which are naive UTC
+    start, end = (value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value for value in (start, end))
+    width_ms = max(1, int((end - start).total_seconds() * 1000 / points))
+    group = {
+        "_id": {"$floor": {"$divide": [{"$subtract": ["$timestamp", start]}, width_ms]}},
+        "count": {"$sum": 1},
+    }
+    for metric in METRIC_FIELDS:
+        group[f"{metric}_min"] = {"$min": f"${metric}"}
+        group[f"{metric}_avg"] = {"$avg": f"${metric}"}
+        group[f"{metric}_max"] = {"$max": f"${metric}"}
+    return [
+        {"$match": {"sensor_id": sensor_id, "timestamp": {"$gte": start, "$lte": end}}},
+        {"$group": group},
+        {"$sort": {"_id": 1}},
+    ], width_ms
+
+
+def rollup_resolution(width_ms):
+    """Returns the coarsest rollup resolution that fits in a chart bucket of width_ms, or None."""
+    if not ROLLUPS_ENABLED:
+        return None
+    fitting = [name for name, resolution_ms in RESOLUTIONS.items() if resolution_ms <= width_ms]
+    return fitting[-1] if fitting else None
+
+
+def _nullable(values):
+    return [None if np.isnan(value) else value for value in values.tolist()]
+
+
+def rollup_bucket_series(sensor_id, start, end, width_ms, resolution, retriever=None):
+    """
+    Returns the bucket_series result computed from the rollups.
+
+    Chart buckets are widened to a multiple of the rollup resolution and aligned
+    to it, so each one is an exact union of rollup buckets.
+    """
+    resolution_ms = RESOLUTIONS[resolution]
+    width_ms = -(-width_ms // resolution_ms) * resolution_ms
+    aggregates = window_aggregates(sensor_id, start, end, resolution, retriever=retriever)
+    buckets = coarsen(aggregates, width_ms)
+    means = buckets.means()
+    return {
+        "method": "bucket",
+        "source": resolution,
+        "bucket_ms": width_ms,
+        "timestamps": buckets.buckets.tolist(),
+        "count": buckets.count.tolist(),
+        "metrics": {
+            metric: {
+                "min": _nullable(buckets.metrics[metric]["min"]),
+                "avg": _nullable(means[metric]),
+                "max": _nullable(buckets.metrics[metric]["max"]),
+            }
+            for metric in METRIC_FIELDS
+        },
+    }
+
+
+def bucket_series(sensor_id, start, end, points, retriever=None):
+    """
+    Returns min/avg/max per metric for `points` equal time buckets, aggregated in MongoDB.
+
+    When ROLLUPS_ENABLED and the buckets are at least an hour wide, they are
+    computed from the hourly or daily rollups instead of the raw readings.
+
+    Returns:
+        dict: {"method": "bucket", "source": "raw", "hourly" or "daily", "bucket_ms": ...,
+            "timestamps": [...], "count": [...], "metrics": {metric: {"min": [...], "avg": [...], "max": [...]}}}
+            where timestamps are the bucket starts in epoch milliseconds. Empty buckets are omitted.
+    """
+    retriever = retriever or MongoDBRetriever(DB_NAME, COLLECTION_NAME)
+    pipeline, width_ms = bucket_pipeline(sensor_id, start, end, points)
+    resolution = rollup_resolution(width_ms)
+    if resolution is not None:
+        return rollup_bucket_series(sensor_id, start, end, width_ms, resolution, retriever=retriever)
+    buckets = list(retriever.collection.aggregate(pipeline))
+
+    start_ms = int(start.replace(tzinfo=start.tzinfo or timezone.utc).timestamp() * 1000)
+    return {
+        "method": "bucket",
+        "source": "raw",
+        "bucket_ms": width_ms,
+        "timestamps": [start_ms + int(bucket["_id"]) * width_ms for bucket in buckets],
+        "count": [bucket["count"] for bucket in buckets],
+        "metrics": {
+            metric: {stat: [bucket.get(f"{metric}_{stat}") for bucket in buckets] for stat in ("min", "avg", "max")}
+            for metric in METRIC_FIELDS
+        },
+    }
+
+
+def get_chart_data(sensor_id, start=None, end=None, points=500, method="bucket"):
+    """Returns a sensor's downsampled chart series using the requested method."""
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError(f"method must be one of {', '.join(DOWNSAMPLING_METHODS)}")
+    start, end = default_time_range(start, end)
+    if start >= end:
+        raise ValueError("start must be before end")
+    series = bucket_series if method == "bucket" else lttb_series
+    data = series(sensor_id, start, end, points)
+    data.update({"sensor_id": sensor_id, "start": start, "end": end})
+    return data
@@ -0,0 +1,254 @@
+# embedding_cache.py
+"""Two-tier content-addressed cache for text embeddings."""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+from pymongo import UpdateOne
+
+from api.config import (
+    VECTOR_DB_NAME, EMBEDDING_CACHE_BACKEND, EMBEDDING_CACHE_COLLECTION, EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_TTL, EMBEDDING_BATCH_WORKERS,
+)
+from api.services.mongo_client import mongo_manager
+
+logger = logging.getLogger(__name__)
+
+
+def embedding_key(model_id, text):
+    """Returns the content address of an embedding: a SHA-256 of the model ID and the text."""
+    return hashlib.sha256(f"{model_id}\0{text}".encode("utf-8")).hexdigest()
+
+
+class LRUTTLCache:
+    """Thread-safe in-process LRU cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MongoEmbeddingStore:
+    """Persistent tier backed by a MongoDB collection keyed by the content address."""
+
+    def __init__(self, collection_name=EMBEDDING_CACHE_COLLECTION, database_name=VECTOR_DB_NAME):
+        self.collection_name = collection_name
+        self.database_name = database_name
+
+    @property
+    def collection(self):
+        return mongo_manager.get_collection(self.collection_name, self.database_name)
+
+    def get_many(self, keys):
+        cursor = self.collection.find({"_id": {"$in": list(keys)}}, {"embedding": 1})
+        return {doc["_id"]: doc["embedding"] for doc in cursor}
+
+    def put_many(self, model_id, items):
+        now = datetime.now(timezone.utc)
+        operations = [
+            UpdateOne({"_id": key}, {"$setOnInsert": {"model_id": model_id, "embedding": embedding, "created_at": now}},
+                      upsert=True)
+            for key, embedding in items.items()
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+
+class DiskEmbeddingStore:
+    """Persistent tier backed by a local SQLite file, storing vectors as float32 blobs."""
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model_id TEXT, vector BLOB)"
+        )
+        self._connection.commit()
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's limit on bound parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                )
+                found.update((key, np.frombuffer(vector, dtype=np.float32).tolist()) for key, vector in rows)
+        return found
+
+    def put_many(self, model_id, items):
+        rows = [(key, model_id, np.asarray(embedding, dtype=np.float32).tobytes()) for key, embedding in items.items()]
+        with self._lock:
+            self._connection.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._connection.commit()
+
+
+def _create_store(backend):
+    if backend == "mongo":
+        return MongoEmbeddingStore()
+    if backend == "disk":
+        return DiskEmbeddingStore()
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown EMBEDDING_CACHE_BACKEND: {backend}")
+
+
+class EmbeddingCache:
+    """
+    Caches embeddings in an in-process LRU (tier 1) in front of a persistent store (tier 2).
+
+    Only cache misses reach the embedding model. Failures of the persistent tier
+    are logged and counted but never fail the embedding itself.
+    """
+
+    def __init__(self, model_id, store=None, max_entries=EMBEDDING_CACHE_MAX_ENTRIES, ttl=EMBEDDING_CACHE_TTL,
+                 max_workers=EMBEDDING_BATCH_WORKERS):
+        self.model_id = model_id
+        self.store = store
+        self.memory = LRUTTLCache(max_entries, ttl)
+        self.max_workers = max_workers
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.requests = 0
+            self.memory_hits = 0
+            self.store_hits = 0
+            self.misses = 0
+            self.store_errors = 0
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def _lookup_store(self, keys):
+        if self.store is None or not keys:
+            return {}
+        try:
+            return self.store.get_many(keys)
+        except Exception as e:
+            self._count(store_errors=1)
+            logger.warning("Embedding cache store lookup failed: %s", e)
+            return {}
+
+    def _save_store(self, items):
+        if self.store is None or not items:
+            return
+        try:
+            self.store.put_many(self.model_id, items)
+        except Exception as e:
+            self._count(store_errors=1)
+            logger.warning("Embedding cache store write failed: %s", e)
+
+    def get_many(self, texts, compute):
+        """
+        Returns embeddings for texts, calling compute(text) only for cache misses.
+
+        Duplicate texts are embedded once and misses are computed concurrently on
+        up to max_workers threads.
+
+        Args:
+            texts (list[str]): Texts to embed.
+            compute (callable): Returns the embedding (list of floats) for one text.
+
+        Returns:
+            list[list[float]]: Embeddings in the order of texts.
+        """
+        keys = [embedding_key(self.model_id, text) for text in texts]
+        unique = dict(zip(keys, texts))
+        found = {}
+
+        for key in unique:
+            vector = self.memory.get(key)
+            if vector is not None:
+                found[key] = vector
+        memory_hits = len(found)
+
+        missing = [key for key in unique if key not in found]
+        stored = self._lookup_store(missing)
+        for key, embedding in stored.items():
+            vector = np.asarray(embedding, dtype=np.float32)
+            self.memory.put(key, vector)
+            found[key] = vector
+
+        missing = [key for key in missing if key not in stored]
+        computed = {}
+        if missing:
+            if len(missing) == 1 or self.max_workers <= 1:
+                results = [compute(unique[key]) for key in missing]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as pool:
+                    results = list(pool.map(compute, [unique[key] for key in missing]))
+            for key, embedding in zip(missing, results):
+                computed[key] = embedding
+                vector = np.asarray(embedding, dtype=np.float32)
+                self.memory.put(key, vector)
+                found[key] = vector
+            self._save_store(computed)
+
+        self._count(requests=len(texts), memory_hits=memory_hits, store_hits=len(stored), misses=len(computed))
+        return [found[key].tolist() for key in keys]
+
+    def get(self, text, compute):
+        """Returns the embedding for one text, calling compute(text) only on a cache miss."""
+        return self.get_many([text], compute)[0]
+
+    def stats(self):
+        with self._stats_lock:
+            unique_lookups = self.memory_hits + self.store_hits + self.misses
+            return {
+                "model_id": self.model_id,
+                "backend": type(self.store).__name__ if self.store is not None else None,
+                "requests": self.requests,
+                "memory_hits": self.memory_hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "store_errors": self.store_errors,
+                "hit_rate": round((self.memory_hits + self.store_hits) / unique_lookups, 4) if unique_lookups else 0.0,
+                "model_calls_saved": self.requests - self.misses,
+                "memory_entries": len(self.memory),
+            }
+
+
+def create_embedding_cache(model_id, backend=EMBEDDING_CACHE_BACKEND):
+    """Creates the embedding cache for a model with the configured persistent backend."""
+    return EmbeddingCache(model_id, store=_create_store(backend))
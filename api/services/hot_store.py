@@ -0,0 +1,348 @@
+# hot_store.py
+"""In-memory ring buffers of the sensors' recent readings, served instead of MongoDB when they cover a window."""
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+from pymongo.errors import PyMongoError
+
+from api.config import (
+    DB_NAME, COLLECTION_NAME, HOT_STORE_ENABLED, HOT_STORE_WINDOW_HOURS, HOT_STORE_MAX_MB, HOT_STORE_SOURCE,
+)
+from api.services.data_retrieval import MongoDBRetriever, METRIC_FIELDS, _epoch_ms, _as_float
+from api.services.ingest_hooks import register_ingest_hook, unregister_ingest_hook, ReadingsTailer
+
+logger = logging.getLogger(__name__)
+
+# Readings a sensor's buffer holds when first allocated; full buffers double
+MIN_CAPACITY = 1024
+
+# Readings are kept this long past the window, so reads of a default window computed
+# a moment earlier (e.g. INSIGHT_WINDOW_DAYS with an equal window) are still covered
+MARGIN_MS = 60 * 1000
+
+
+def _now_ms():
+    return _epoch_ms(datetime.now(timezone.utc))
+
+
+def _to_datetime(epoch_ms):
+    return datetime.fromtimestamp(epoch_ms / 1000, tz=timezone.utc)
+
+
+def _widen(values):
+    """
+    Converts float32 values to float64 rounded to the 6 significant digits float32 keeps.
+
+    Readings with up to 6 significant digits read back exactly as ingested
+    (23.45 rather than 23.450000762939453).
+    """
+    wide = values.astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        digits = np.clip(np.nan_to_num(5 - np.floor(np.log10(np.abs(wide))), nan=0.0), -300, 300)
+    up, down = 10.0 ** np.maximum(digits, 0), 10.0 ** np.maximum(-digits, 0)
+    return np.round(wide * up / down) * down / up
+
+
+class SensorWindow:
+    """
+    Ring buffer of one sensor's readings in chronological order.
+
+    timestamps holds epoch milliseconds (int64) and each row of values one
+    metric (float32, NaN where missing). The buffer holds every reading of the
+    sensor at or after covered_since (epoch milliseconds).
+    """
+
+    __slots__ = ("timestamps", "values", "start", "size", "covered_since")
+
+    def __init__(self, fields, covered_since, capacity=MIN_CAPACITY):
+        self.timestamps = np.empty(capacity, dtype=np.int64)
+        self.values = np.empty((fields, capacity), dtype=np.float32)
+        self.start = 0
+        self.size = 0
+        self.covered_since = covered_since
+
+    @property
+    def capacity(self):
+        return self.timestamps.size
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes
+
+    def _segments(self):
+        """Physical slices holding the readings, oldest first."""
+        end = self.start + self.size
+        if end <= self.capacity:
+            return [slice(self.start, end)]
+        return [slice(self.start, self.capacity), slice(0, end - self.capacity)]
+
+    def position(self, timestamp, side="left"):
+        """Returns the logical index of timestamp in the readings, as np.searchsorted would."""
+        offset = 0
+        for segment in self._segments():
+            part = self.timestamps[segment]
+            index = int(np.searchsorted(part, timestamp, side))
+            if index < part.size:
+                return offset + index
+            offset += part.size
+        return offset
+
+    def copy(self, lo, hi):
+        """Copies the readings at logical indexes lo:hi as (timestamps, values)."""
+        count = max(0, hi - lo)
+        first = (self.start + lo) % self.capacity
+        if first + count <= self.capacity:
+            return self.timestamps[first:first + count].copy(), self.values[:, first:first + count].copy()
+        wrapped = count - (self.capacity - first)
+        return (np.concatenate((self.timestamps[first:], self.timestamps[:wrapped])),
+                np.concatenate((self.values[:, first:], self.values[:, :wrapped]), axis=1))
+
+    def fill(self, timestamps, values, capacity=None):
+        """Replaces the readings with chronologically ordered arrays, reallocating to capacity."""
+        capacity = max(capacity or self.capacity, timestamps.size, 1)
+        if capacity != self.capacity:
+            self.timestamps = np.empty(capacity, dtype=np.int64)
+            self.values = np.empty((self.values.shape[0], capacity), dtype=np.float32)
+        self.timestamps[:timestamps.size] = timestamps
+        self.values[:, :timestamps.size] = values
+        self.start, self.size = 0, int(timestamps.size)
+
+    def drop_before(self, cutoff):
+        """Drops the readings older than cutoff; the buffer then covers from cutoff."""
+        if cutoff <= self.covered_since:
+            return
+        dropped = self.position(cutoff)
+        self.start = (self.start + dropped) % self.capacity
+        self.size -= dropped
+        self.covered_since = cutoff
+
+    def contains(self, timestamp, row):
+        """Whether a reading with this timestamp and these values is held."""
+        lo, hi = self.position(timestamp), self.position(timestamp, "right")
+        if lo == hi:
+            return False
+        _, values = self.copy(lo, hi)
+        row = np.asarray(row, dtype=np.float32)[:, None]
+        return bool(np.any(np.all((values == row) | (np.isnan(values) & np.isnan(row)), axis=0)))
+
+    def insert(self, timestamp, row):
+        """Adds a reading, doubling the buffer when it is full; O(1) unless older than the latest reading."""
+        if self.size == self.capacity:
+            self.fill(*self.copy(0, self.size), capacity=self.capacity * 2)
+        position = self.position(timestamp, "right")
+        if position < self.size:
+            # Out-of-order reading: rewrite the buffer with it in place
+            timestamps, values = self.copy(0, self.size)
+            self.fill(np.insert(timestamps, position, timestamp), np.insert(values, position, row, axis=1))
+            return
+        index = (self.start + self.size) % self.capacity
+        self.timestamps[index] = timestamp
+        self.values[:, index] = row
+        self.size += 1
+
+
+class HotWindowStore:
+    """
+    Keeps the recent readings of the sensors being read in memory.
+
+    The first read of a sensor that starts within the last window_hours loads
+    that window from MongoDB into a SensorWindow; later readings are added as
+    they are ingested (source "ingest") or found by tailing the readings
+    collection (source "change_stream", which also sees other processes'
+    inserts). Reads within a held window are then answered without a query;
+    other reads return None and go to MongoDB. When the buffers exceed
+    max_mb, the least recently read sensors are evicted. Thread-safe.
+
+    With source "change_stream" the store is disabled if the stream cannot
+    be opened, as the ingest hooks would miss other processes' readings. When
+    the stream may have missed readings, the windows are cleared, and reads
+    go to MongoDB until it is open again.
+    """
+
+    def __init__(self, enabled=HOT_STORE_ENABLED, window_hours=HOT_STORE_WINDOW_HOURS, max_mb=HOT_STORE_MAX_MB,
+                 source=HOT_STORE_SOURCE, fields=METRIC_FIELDS):
+        self.enabled = enabled
+        self.window_ms = int(window_hours * 3600 * 1000)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.source = source
+        self.fields = tuple(fields)
+        # Least recently read first
+        self._windows = OrderedDict()
+        # sensor_id -> readings ingested while its window is being loaded
+        self._loading = {}
+        self._bytes = 0
+        # Incremented by clear(), so windows loaded from before it are discarded
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._tailer = None
+        self._active_source = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.counts = {"hits": 0, "misses": 0, "loads": 0, "load_failures": 0, "evictions": 0, "readings": 0,
+                       "late_readings": 0}
+
+    def get(self, sensor_id, since, until=None, limit=None, load=True):
+        """
+        Returns a sensor's readings in the window like MongoDBRetriever.retrieve_columns, or None.
+
+        None means the window is not held: the store is disabled, since is None
+        or older than the hot window, the sensor is not held and load is false
+        or it is being loaded by another request, or loading it failed.
+        """
+        if not self.enabled or since is None:
+            return None
+        if self._tailer is not None and not self._tailer.healthy:
+            # The windows cannot be kept current while the change stream is down
+            return None
+        since_ms = _epoch_ms(since)
+        until_ms = None if until is None else _epoch_ms(until)
+        with self._lock:
+            window = self._windows.get(sensor_id)
+            if window is not None and since_ms >= window.covered_since:
+                self._windows.move_to_end(sensor_id)
+                self.counts["hits"] += 1
+                return self._read(window, since_ms, until_ms, limit)
+            self.counts["misses"] += 1
+            if (not load or window is not None or sensor_id in self._loading
+                    or since_ms < self._cutoff()):
+                return None
+            self._loading[sensor_id] = []
+            generation = self._generation
+        window = self._load(sensor_id, generation)
+        if window is None:
+            return None
+        with self._lock:
+            return self._read(window, since_ms, until_ms, limit)
+
+    def _cutoff(self):
+        """Start of the hot window (epoch milliseconds)."""
+        return _now_ms() - self.window_ms - MARGIN_MS
+
+    def _read(self, window, since_ms, until_ms, limit):
+        lo = window.position(since_ms)
+        hi = window.size if until_ms is None else window.position(until_ms, "right")
+        if limit:
+            lo = max(lo, hi - limit)
+        timestamps, values = window.copy(lo, hi)
+        return timestamps, {field: _widen(values[i]) for i, field in enumerate(self.fields)}
+
+    def _load(self, sensor_id, generation):
+        """Reads a sensor's hot window from MongoDB, then adds the readings ingested meanwhile."""
+        try:
+            cutoff = self._cutoff()
+            timestamps, columns = MongoDBRetriever(DB_NAME, COLLECTION_NAME).retrieve_columns(
+                sensor_id, since=_to_datetime(cutoff))
+            window = SensorWindow(len(self.fields), cutoff, max(MIN_CAPACITY, timestamps.size * 5 // 4))
+            window.fill(timestamps, np.array([columns[field] for field in self.fields], dtype=np.float32))
+        except (PyMongoError, ConnectionError) as e:
+            logger.warning("Loading the hot window of %s failed: %s", sensor_id, e)
+            window = None
+
+        with self._lock:
+            pending = self._loading.pop(sensor_id, [])
+            if window is None:
+                self.counts["load_failures"] += 1
+                return None
+            if generation != self._generation:
+                # Cleared while loading: readings may have been missed since the query ran
+                return None
+            for timestamp, row in pending:
+                # Readings inserted before the query ran are already held
+                if timestamp >= window.covered_since and not window.contains(timestamp, row):
+                    window.insert(timestamp, row)
+            self._windows[sensor_id] = window
+            self._bytes += window.nbytes
+            self.counts["loads"] += 1
+            self._evict()
+        return window
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._windows:
+            _, window = self._windows.popitem(last=False)
+            self._bytes -= window.nbytes
+            self.counts["evictions"] += 1
+
+    def apply_readings(self, readings):
+        """Ingest hook: adds newly inserted readings to the windows held or being loaded."""
+        cutoff = self._cutoff()
+        with self._lock:
+            for reading in readings:
+                sensor_id = reading.get("sensor_id")
+                window, pending = self._windows.get(sensor_id), self._loading.get(sensor_id)
+                if window is None and pending is None:
+                    continue
+                timestamp = _epoch_ms(reading["timestamp"])
+                row = [_as_float(reading.get(field)) for field in self.fields]
+                if pending is not None:
+                    pending.append((timestamp, row))
+                    continue
+                size = window.nbytes
+                window.drop_before(cutoff)
+                if timestamp < window.covered_since:
+                    self.counts["late_readings"] += 1
+                    continue
+                window.insert(timestamp, row)
+                self._bytes += window.nbytes - size
+                self.counts["readings"] += 1
+            self._evict()
+
+    def start(self, tail=True):
+        """
+        Keeps the held windows current from HOT_STORE_SOURCE; a no-op when disabled.
+
+        Returns:
+            str: The active source ("change_stream" or "ingest"), or None when
+                the store is disabled, including because the change stream
+                could not be opened.
+        """
+        if not self.enabled:
+            return None
+        if self.source == "change_stream" and tail:
+            tailer = ReadingsTailer(self.apply_readings, name="hot-store-tailer", flush_seconds=0.2,
+                                    on_gap=self.clear)
+            try:
+                tailer.start()
+                self._tailer, self._active_source = tailer, "change_stream"
+                return self._active_source
+            except (PyMongoError, NotImplementedError) as e:
+                # The ingest hooks would miss other processes' readings, leaving the windows stale
+                logger.warning("Change streams unavailable, disabling the hot window store: %s", e)
+                self.enabled = False
+                self.clear()
+                return None
+        register_ingest_hook(self.apply_readings)
+        self._active_source = "ingest"
+        return self._active_source
+
+    def stop(self):
+        if self._tailer is not None:
+            self._tailer.stop()
+            self._tailer = None
+        unregister_ingest_hook(self.apply_readings)
+        self._active_source = None
+
+    def clear(self):
+        """Drops the held windows, including those being loaded."""
+        with self._lock:
+            self._windows.clear()
+            self._bytes = 0
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "source": self._active_source,
+                **self.counts,
+                "sensors": len(self._windows),
+                "readings_held": sum(window.size for window in self._windows.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+hot_store = HotWindowStore()
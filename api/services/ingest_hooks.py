@@ -0,0 +1,168 @@
+# ingest_hooks.py
+"""Callbacks run on every batch of readings newly inserted by the ingestion pipeline, or found by tailing."""
+import logging
+import threading
+import time
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from api.services.mongo_client import get_readings_collection
+
+logger = logging.getLogger(__name__)
+
+# Server error codes of a change stream that cannot resume: the resume token fell out of the oplog
+# (ChangeStreamHistoryLost) or the stream was invalidated (ChangeStreamFatalError)
+HISTORY_LOST_CODES = (286, 280)
+
+# Seconds between attempts to reopen a failed change stream
+REOPEN_DELAY = 1.0
+
+
+def _history_lost(error):
+    return isinstance(error, OperationFailure) and error.code in HISTORY_LOST_CODES
+
+_hooks = []
+_lock = threading.Lock()
+
+
+def register_ingest_hook(hook):
+    """
+    Registers a callable that receives each list of newly inserted readings.
+
+    Hooks run on the ingesting thread after the batch is written; duplicates
+    skipped by the insert are not passed on. Registering a hook twice is a no-op.
+    """
+    with _lock:
+        if hook not in _hooks:
+            _hooks.append(hook)
+
+
+def unregister_ingest_hook(hook):
+    with _lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def run_ingest_hooks(readings):
+    """Passes inserted readings to every registered hook; a failing hook does not fail the ingest."""
+    if not readings:
+        return
+    with _lock:
+        hooks = list(_hooks)
+    for hook in hooks:
+        try:
+            hook(readings)
+        except Exception:
+            logger.exception("Ingest hook %s failed", getattr(hook, "__name__", hook))
+
+
+class ReadingsTailer:
+    """
+    Passes readings inserted into the readings collection to apply by tailing its change stream.
+
+    Unlike the ingest hooks, this also sees readings inserted by other processes.
+    Inserts are applied in batches of up to batch_size, or after flush_seconds.
+    After a stream error the stream is reopened from the last resume token.
+
+    With on_gap, a consumer that cannot tolerate missed readings is told when
+    some may have been: when reopening the stream failed (healthy stays false
+    until it reopens) or its history was lost. Missed readings are then not
+    replayed; the stream restarts from the current time once on_gap returns.
+    Without on_gap, a stream whose history was lost also restarts from the
+    current time, with a logged error.
+    """
+
+    PIPELINE = [{"$match": {"operationType": "insert"}}]
+
+    def __init__(self, apply, name="readings-tailer", collection=None, batch_size=500, flush_seconds=1.0,
+                 on_gap=None):
+        self.apply = apply
+        self.on_gap = on_gap
+        self.healthy = False
+        self.name = name
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._resume_token = None
+        self._stream = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _open(self):
+        return self.collection.watch(self.PIPELINE, resume_after=self._resume_token, max_await_time_ms=1000)
+
+    def start(self):
+        """Opens the change stream and starts tailing it; raises if change streams are unavailable."""
+        self.collection = self.collection if self.collection is not None else get_readings_collection()
+        self._stream = self._open()
+        self.healthy = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _flush(self, pending):
+        try:
+            self.apply(pending)
+        except Exception:
+            logger.exception("%s failed to apply %d readings", self.name, len(pending))
+
+    def _gap(self, reason):
+        """Records that readings may have been missed; the stream is reopened without resuming."""
+        self._resume_token = None
+        if self.on_gap is None:
+            logger.error("%s missed readings: %s", self.name, reason)
+            return
+        logger.warning("%s may have missed readings: %s", self.name, reason)
+        self.healthy = False
+        try:
+            self.on_gap()
+        except Exception:
+            logger.exception("%s gap handler failed", self.name)
+
+    def _reopen(self, error):
+        """
+        Reopens the stream after error, retrying every second until it opens or the tailer stops.
+
+        The first attempt resumes where the stream stopped. Lost history, or with
+        on_gap a failed attempt, means readings may have been missed.
+        """
+        failed = False
+        while not self._stop.wait(REOPEN_DELAY):
+            if _history_lost(error) or (failed and self.healthy and self.on_gap is not None):
+                self._gap(error)
+            try:
+                self._stream = self._open()
+                self.healthy = True
+                return
+            except PyMongoError as e:
+                logger.warning("%s failed to reopen its change stream: %s", self.name, e)
+                error, failed = e, True
+
+    def _run(self):
+        pending = []
+        last_flush = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                change = self._stream.try_next()
+            except PyMongoError as e:
+                logger.warning("%s change stream failed, reopening: %s", self.name, e)
+                self._reopen(e)
+                continue
+            if change is not None:
+                pending.append(change["fullDocument"])
+                self._resume_token = change["_id"]
+            if pending and (len(pending) >= self.batch_size or time.monotonic() - last_flush >= self.flush_seconds):
+                self._flush(pending)
+                pending = []
+            if not pending:
+                last_flush = time.monotonic()
+        if pending:
+            self._flush(pending)
+        self._stream.close()
+        self.healthy = False
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,343 @@
+# ingestion.py
+"""Streaming bulk ingestion of sensor readings into the readings and vector collections."""
+import argparse
+import io
+import itertools
+import json
+import logging
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from api.config import (
+    MONGO_TIMESERIES, VECTOR_SEARCH_BACKEND, INGEST_BATCH_SIZE, INGEST_EMBED_BATCH_SIZE, INGEST_EMBED_CONCURRENCY,
+)
+from api.services.data_retrieval import ensure_readings_collection
+from api.services.ingest_hooks import run_ingest_hooks
+from api.services.load_rag_data import generate_embeddings
+from api.services.mongo_client import get_readings_collection, get_vector_collection
+from api.services.vector_index import get_local_vector_index
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Maps the labels used in sensor_data.txt and NDJSON keys to reading fields
+FIELD_ALIASES = {
+    "sensor id": "sensor_id",
+    "sensor_id": "sensor_id",
+    "timestamp": "timestamp",
+    "temperature": "temperature",
+    "humidity": "humidity",
+    "aqi": "AQI",
+    "co2 level": "CO2_level",
+    "co2_level": "CO2_level",
+    "id": "id",
+}
+
+NUMERIC_FIELDS = ("temperature", "humidity", "AQI", "CO2_level")
+
+PROGRESS_INTERVAL = 5.0
+
+
+def _parse_number(value):
+    if isinstance(value, (int, float)):
+        return value
+    # Values in sensor_data.txt carry units, e.g. "25.04 °C" or "4713 ppm"
+    number = value.split()[0]
+    return float(number) if "." in number else int(number)
+
+
+def _parse_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def normalize_record(fields):
+    """
+    Converts a raw record into a reading document for the readings collection.
+
+    Args:
+        fields (dict): Field labels (as in sensor_data.txt or NDJSON keys) to values.
+
+    Returns:
+        dict: The reading with sensor_id, timestamp, temperature, humidity, AQI, CO2_level and id.
+
+    Raises:
+        ValueError: If the record has no ID, sensor ID or timestamp.
+    """
+    reading = {}
+    for label, value in fields.items():
+        field = FIELD_ALIASES.get(label.strip().lower())
+        if field is not None:
+            reading[field] = value
+    for field in ("id", "sensor_id", "timestamp"):
+        if not reading.get(field):
+            raise ValueError(f"Record is missing '{field}': {fields}")
+    reading["timestamp"] = _parse_timestamp(reading["timestamp"])
+    for field in NUMERIC_FIELDS:
+        if reading.get(field) is not None:
+            reading[field] = _parse_number(reading[field])
+    return reading
+
+
+def parse_text_records(lines):
+    """Yields readings from blank-line-separated "Label: value" records, one line at a time."""
+    fields = {}
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if fields:
+                yield normalize_record(fields)
+                fields = {}
+            continue
+        label, _, value = line.partition(":")
+        fields[label] = value.strip()
+    if fields:
+        yield normalize_record(fields)
+
+
+def parse_ndjson_records(lines):
+    """Yields readings from newline-delimited JSON objects."""
+    for line in lines:
+        line = line.strip()
+        if line:
+            yield normalize_record(json.loads(line))
+
+
+PARSERS = {"text": parse_text_records, "ndjson": parse_ndjson_records}
+
+
+def reading_text(reading):
+    """Renders a reading as the text that is embedded for vector search."""
+    return (
+        f"Sensor ID: {reading['sensor_id']}, Timestamp: {reading['timestamp']:%Y-%m-%d %H:%M:%S}, "
+        f"Temperature: {reading.get('temperature')} °C, Humidity: {reading.get('humidity')} %, "
+        f"AQI: {reading.get('AQI')}, CO2 Level: {reading.get('CO2_level')} ppm"
+    )
+
+
+@dataclass
+class IngestStats:
+    records_read: int = 0
+    inserted: int = 0
+    duplicates: int = 0
+    embedded: int = 0
+    embed_failures: int = 0
+    elapsed_seconds: float = 0.0
+
+    @property
+    def records_per_second(self):
+        return self.records_read / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def as_dict(self):
+        stats = asdict(self)
+        stats["records_per_second"] = round(self.records_per_second, 1)
+        stats["elapsed_seconds"] = round(self.elapsed_seconds, 3)
+        return stats
+
+
+def ensure_vector_indexes(collection):
+    """Creates the unique reading ID index and the updated_at index get_rag_data_watermark reads."""
+    collection.create_index([("id", ASCENDING)], name="id_unique", unique=True,
+                            partialFilterExpression={"id": {"$exists": True}})
+    collection.create_index([("updated_at", DESCENDING)], name="updated_at")
+
+
+def ensure_ingest_indexes():
+    """
+    Creates the readings collection indexes and the unique indexes on the reading ID.
+
+    Time-series collections do not support unique indexes, so with MONGO_TIMESERIES
+    the readings collection gets a plain ID index and insert_readings skips
+    existing IDs with a lookup instead.
+    """
+    readings = get_readings_collection()
+    ensure_readings_collection(readings.database, readings.name)
+    unique_id = {"unique": True, "partialFilterExpression": {"id": {"$exists": True}}}
+    if MONGO_TIMESERIES:
+        readings.create_index([("id", ASCENDING)], name="id")
+    else:
+        readings.create_index([("id", ASCENDING)], name="id_unique", **unique_id)
+    ensure_vector_indexes(get_vector_collection())
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def insert_readings(readings):
+    """
+    Inserts readings with an unordered insert_many, skipping IDs that already exist.
+
+    The readings that were actually inserted are passed to the registered ingest
+    hooks (see api/services/ingest_hooks.py).
+
+    Returns:
+        tuple: (inserted, duplicates) counts.
+    """
+    collection = get_readings_collection()
+    duplicates = 0
+    if MONGO_TIMESERIES:
+        existing = {doc["id"] for doc in collection.find({"id": {"$in": [r["id"] for r in readings]}}, {"_id": 0, "id": 1})}
+        duplicates = len(readings)
+        readings = [reading for reading in readings if reading["id"] not in existing]
+        duplicates -= len(readings)
+        if not readings:
+            return 0, duplicates
+    inserted = readings
+    try:
+        result = collection.insert_many(readings, ordered=False)
+        return len(result.inserted_ids), duplicates
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        failed = {error.get("index") for error in errors}
+        inserted = [reading for i, reading in enumerate(readings) if i not in failed]
+        other = [error for error in errors if error.get("code") != DUPLICATE_KEY_ERROR]
+        if other:
+            raise
+        return e.details.get("nInserted", 0), len(errors)
+    finally:
+        # insert_many adds ObjectIds in place; they must not leak into the vector documents
+        for reading in readings:
+            reading.pop("_id", None)
+        run_ingest_hooks(inserted)
+
+
+def vector_upserts(readings, texts, embeddings):
+    """
+    Returns the bulk_write operations upserting readings with their texts and embeddings by reading ID.
+
+    Each document gets the current time as updated_at, so re-embedded readings
+    change the RAG data watermark even when the document count does not.
+    """
+    updated_at = datetime.now(timezone.utc)
+    return [
+        UpdateOne({"id": reading["id"]},
+                  {"$set": {**reading, "text": text, "embedding": embedding, "updated_at": updated_at}}, upsert=True)
+        for reading, text, embedding in zip(readings, texts, embeddings)
+    ]
+
+
+def embed_and_upsert(readings):
+    """
+    Embeds readings and upserts them into the vector collection by reading ID.
+
+    Newly created vector documents are also appended to the local vector index
+    when it is the configured search backend.
+
+    Returns:
+        int: The number of readings embedded.
+    """
+    texts = [reading_text(reading) for reading in readings]
+    embeddings = generate_embeddings(texts)
+    result = get_vector_collection().bulk_write(vector_upserts(readings, texts, embeddings), ordered=False)
+
+    if VECTOR_SEARCH_BACKEND == "local" and result.upserted_ids:
+        new_rows = sorted(result.upserted_ids)
+        get_local_vector_index().append(
+            [embeddings[i] for i in new_rows],
+            [{**readings[i], "text": texts[i]} for i in new_rows],
+        )
+    return len(readings)
+
+
+def ingest_records(records, batch_size=INGEST_BATCH_SIZE, embed=True,
+                   embed_batch_size=INGEST_EMBED_BATCH_SIZE, embed_concurrency=INGEST_EMBED_CONCURRENCY):
+    """
+    Ingests an iterable of readings in constant memory.
+
+    Readings are written to the readings collection in unordered insert_many
+    batches. Embedding and the vector upsert run as a pipelined stage on
+    embed_concurrency worker threads, with at most twice that many batches in
+    flight, so parsing and inserting continue while embeddings are computed.
+    Re-ingesting the same records is a no-op apart from the vector upsert.
+
+    Args:
+        records (iterable[dict]): Normalized readings, e.g. from parse_text_records.
+        batch_size (int): Readings per insert_many call.
+        embed (bool): Whether to embed readings into the vector collection.
+        embed_batch_size (int): Readings per embedding and vector upsert batch.
+        embed_concurrency (int): Concurrent embedding batches.
+
+    Returns:
+        IngestStats: Counters and throughput for the run.
+    """
+    stats = IngestStats()
+    started = last_report = time.perf_counter()
+    ensure_ingest_indexes()
+
+    pending = deque()
+    max_pending = max(1, embed_concurrency * 2)
+
+    def collect(future):
+        try:
+            stats.embedded += future.result()
+        except Exception as e:
+            stats.embed_failures += future.batch_size
+            logger.error("Embedding batch failed: %s", e)
+
+    with ThreadPoolExecutor(max_workers=max(1, embed_concurrency), thread_name_prefix="ingest-embed") as pool:
+        for batch in _batches(records, batch_size):
+            stats.records_read += len(batch)
+            inserted, duplicates = insert_readings(batch)
+            stats.inserted += inserted
+            stats.duplicates += duplicates
+
+            if embed:
+                for embed_batch in _batches(batch, embed_batch_size):
+                    while len(pending) >= max_pending:
+                        collect(pending.popleft())
+                    future = pool.submit(embed_and_upsert, embed_batch)
+                    future.batch_size = len(embed_batch)
+                    pending.append(future)
+
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                stats.elapsed_seconds = now - started
+                logger.info("Ingest progress: %s", stats.as_dict())
+                last_report = now
+
+        while pending:
+            collect(pending.popleft())
+
+    stats.elapsed_seconds = time.perf_counter() - started
+    logger.info("Ingest finished: %s", stats.as_dict())
+    return stats
+
+
+def ingest_stream(stream, record_format="text", **options):
+    """Parses and ingests a text stream of records in the given format ("text" or "ndjson")."""
+    if record_format not in PARSERS:
+        raise ValueError(f"format must be one of {', '.join(PARSERS)}")
+    return ingest_records(PARSERS[record_format](stream), **options)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk ingest sensor readings into MongoDB.")
+    parser.add_argument("path", help="Records file, or - for stdin")
+    parser.add_argument("--format", choices=sorted(PARSERS), default="text")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--embed-batch-size", type=int, default=INGEST_EMBED_BATCH_SIZE)
+    parser.add_argument("--embed-concurrency", type=int, default=INGEST_EMBED_CONCURRENCY)
+    parser.add_argument("--no-embed", action="store_true", help="Only write the readings collection")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # Keeps rollups current for readings ingested outside the API process
+    from api.services.rollups import start_rollup_maintenance
+    start_rollup_maintenance(tail=False)
+    source = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8") if args.path == "-" else open(args.path, encoding="utf-8")
+    with source:
+        result = ingest_stream(source, args.format, batch_size=args.batch_size, embed=not args.no_embed,
+                               embed_batch_size=args.embed_batch_size, embed_concurrency=args.embed_concurrency)
+    print(json.dumps(result.as_dict()))
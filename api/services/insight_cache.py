@@ -0,0 +1,146 @@
+# insight_cache.py
+"""In-process insight result cache with data-watermark invalidation, single-flight and stale-while-revalidate."""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from api.config import INSIGHT_CACHE_MAX_ENTRIES, INSIGHT_CACHE_TTL, INSIGHT_CACHE_STALE_TTL
+
+logger = logging.getLogger(__name__)
+
+HIT = "hit"
+MISS = "miss"
+STALE = "stale"
+COALESCED = "coalesced"
+BYPASS = "bypass"
+
+
+class InsightCache:
+    """
+    Caches generated insights per request key, valid while the data watermark is unchanged.
+
+    The watermark is the timestamp of the latest reading in the requested window,
+    so an entry is fresh as long as no newer reading has arrived and it is younger
+    than ttl seconds. Concurrent requests for the same key and watermark share one
+    generation (single-flight). With stale_ttl, a stale entry younger than
+    ttl + stale_ttl is returned immediately while a background generation
+    refreshes it. Failed generations are never cached.
+
+    All methods must be called from the event loop thread.
+    """
+
+    def __init__(self, max_entries=INSIGHT_CACHE_MAX_ENTRIES, ttl=INSIGHT_CACHE_TTL, stale_ttl=INSIGHT_CACHE_STALE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # key -> (value, watermark, created_at)
+        self._entries = OrderedDict()
+        # (key, watermark) -> generation task
+        self._inflight = {}
+        self.reset_stats()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def reset_stats(self):
+        self.counts = {HIT: 0, MISS: 0, STALE: 0, COALESCED: 0, BYPASS: 0}
+        self.evictions = 0
+        self.generation_failures = 0
+
+    def clear(self):
+        self._entries.clear()
+
+    def needs_refresh(self, key, watermark, lead_seconds=0.0):
+        """Whether key has no entry at the watermark that stays fresh for another lead_seconds."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return True
+        _, cached_watermark, created_at = entry
+        return cached_watermark != watermark or time.monotonic() - created_at >= self.ttl - lead_seconds
+
+    def _put(self, key, watermark, value):
+        self._entries[key] = (value, watermark, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _on_done(self, flight, task):
+        self._inflight.pop(flight, None)
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieving the exception here also keeps unawaited background refreshes quiet
+            self.generation_failures += 1
+            logger.warning("Insight generation for %s failed: %s", flight[0], task.exception())
+
+    def _generate(self, key, watermark, generate):
+        """Returns the in-flight generation for (key, watermark), starting one if there is none."""
+        flight = (key, watermark)
+        task = self._inflight.get(flight)
+        if task is not None:
+            return task, True
+
+        async def run():
+            value = await generate()
+            self._put(key, watermark, value)
+            return value
+
+        task = asyncio.ensure_future(run())
+        task.add_done_callback(lambda t: self._on_done(flight, t))
+        self._inflight[flight] = task
+        return task, False
+
+    async def get_or_generate(self, key, watermark, generate, refresh=False):
+        """
+        Returns the cached value for key at the watermark, or awaits generate() for it.
+
+        Args:
+            key (hashable): The request key (sensor and generation parameters).
+            watermark: The current data watermark for the key.
+            generate (callable): Coroutine function producing the value.
+            refresh (bool): Skip the cached entry and regenerate.
+
+        Returns:
+            tuple: (value, status) where status is "hit", "stale", "coalesced", "miss" or "bypass".
+        """
+        if not self.enabled:
+            self.counts[BYPASS] += 1
+            return await generate(), BYPASS
+
+        entry = None if refresh else self._entries.get(key)
+        if entry is not None:
+            value, cached_watermark, created_at = entry
+            age = time.monotonic() - created_at
+            if cached_watermark == watermark and age < self.ttl:
+                self._entries.move_to_end(key)
+                self.counts[HIT] += 1
+                return value, HIT
+            if self.stale_ttl > 0 and age < self.ttl + self.stale_ttl:
+                self._generate(key, watermark, generate)
+                self.counts[STALE] += 1
+                return value, STALE
+
+        task, coalesced = self._generate(key, watermark, generate)
+        status = COALESCED if coalesced else MISS
+        self.counts[status] += 1
+        # Shielded so a disconnecting client does not cancel a generation other requests wait on
+        return await asyncio.shield(task), status
+
+    def stats(self):
+        lookups = sum(self.counts.values()) - self.counts[BYPASS]
+        served_without_generation = self.counts[HIT] + self.counts[STALE] + self.counts[COALESCED]
+        return {
+            "enabled": self.enabled,
+            **self.counts,
+            "evictions": self.evictions,
+            "generation_failures": self.generation_failures,
+            "hit_rate": round(served_without_generation / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "in_flight": len(self._inflight),
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+        }
+
+
+insight_cache = InsightCache()
@@ -0,0 +1,199 @@
+# insight_scheduler.py
+"""Background pre-generation of insights for active sensors into the insight cache."""
+import asyncio
+import itertools
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from api.config import (
+    INSIGHT_PREGEN_ENABLED, INSIGHT_PREGEN_INTERVAL, INSIGHT_PREGEN_CONCURRENCY, INSIGHT_PREGEN_ACTIVE_SECONDS,
+    INSIGHT_PREGEN_VIEW_TTL, INSIGHT_PREGEN_VIEW_HALF_LIFE, INSIGHT_PREGEN_MAX_SENSORS, INSIGHT_PREGEN_MIN_INTERVAL,
+    INSIGHT_PREGEN_JITTER, INSIGHT_PREGEN_MAX_BACKOFF, INSIGHT_PREGEN_FORMAT,
+)
+from api.services.concurrency import run_stage
+from api.services.data_retrieval import get_active_sensor_watermarks, get_sensor_watermark
+from api.services.insight_cache import insight_cache
+from api.services.prompt_handler import insight_view_key, aprecompute_insight
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the number of viewed sensors remembered; the least viewed are forgotten first
+MAX_TRACKED_VIEWS = 10000
+
+
+class InsightScheduler:
+    """
+    Keeps the insights of active sensors pre-generated in the insight cache.
+
+    A sensor is active when it received readings in the last active_seconds or
+    was viewed through /get_insights in the last view_ttl seconds. Every
+    interval seconds the scheduler looks up the active sensors' latest readings
+    and queues those whose cached insight is missing, was generated before the
+    latest reading or expires before the next check. The queue is ordered by
+    view count (decaying with view_half_life), then by the latest reading, and
+    drained by `concurrency` workers, each sleeping a random jitter before a
+    generation. A sensor is generated at most every min_interval seconds and
+    backs off exponentially after failures.
+
+    Viewed sensors are generated with the parameters of their last view, other
+    sensors in INSIGHT_PREGEN_FORMAT with the default prompt mode and resolution.
+    All methods must be called from the event loop thread.
+    """
+
+    def __init__(self, enabled=INSIGHT_PREGEN_ENABLED, interval=INSIGHT_PREGEN_INTERVAL,
+                 concurrency=INSIGHT_PREGEN_CONCURRENCY, active_seconds=INSIGHT_PREGEN_ACTIVE_SECONDS,
+                 view_ttl=INSIGHT_PREGEN_VIEW_TTL, view_half_life=INSIGHT_PREGEN_VIEW_HALF_LIFE,
+                 max_sensors=INSIGHT_PREGEN_MAX_SENSORS, min_interval=INSIGHT_PREGEN_MIN_INTERVAL,
+                 jitter=INSIGHT_PREGEN_JITTER, max_backoff=INSIGHT_PREGEN_MAX_BACKOFF,
+                 default_format=INSIGHT_PREGEN_FORMAT):
+        self.enabled = enabled
+        self.interval = interval
+        self.concurrency = concurrency
+        self.active_seconds = active_seconds
+        self.view_ttl = view_ttl
+        self.view_half_life = view_half_life
+        self.max_sensors = max_sensors
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.default_params = {"data_format": default_format}
+        # sensor_id -> [score, last view (monotonic), generation parameters]
+        self._views = {}
+        # sensor_id -> monotonic time before which it is not scheduled again
+        self._not_before = {}
+        self._failures = {}
+        self._queued = set()
+        self._queue = None
+        self._tasks = []
+        self._sequence = itertools.count()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.counts = {"checks": 0, "check_failures": 0, "scheduled": 0, "generated": 0, "failed": 0}
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def _decayed(self, score, since, now):
+        if self.view_half_life <= 0:
+            return score
+        return score * 0.5 ** ((now - since) / self.view_half_life)
+
+    def record_view(self, sensor_id, prompt_mode=None, data_format=None, resolution=None):
+        """Counts a default-window /get_insights request and remembers its parameters for pre-generation."""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        params = {"prompt_mode": prompt_mode, "data_format": data_format, "resolution": resolution}
+        view = self._views.get(sensor_id)
+        score = 1.0 if view is None else self._decayed(view[0], view[1], now) + 1.0
+        self._views[sensor_id] = [score, now, params]
+        if len(self._views) > MAX_TRACKED_VIEWS:
+            least = min(self._views, key=lambda sensor: self._decayed(*self._views[sensor][:2], now))
+            del self._views[least]
+
+    def _view_score(self, sensor_id, now):
+        view = self._views.get(sensor_id)
+        return 0.0 if view is None else self._decayed(view[0], view[1], now)
+
+    def start(self):
+        """Starts the checker and the workers; a no-op when disabled or without the insight cache."""
+        if not self.enabled or not insight_cache.enabled or self.running:
+            return False
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.ensure_future(self._check_loop())]
+        self._tasks.extend(asyncio.ensure_future(self._worker()) for _ in range(max(1, self.concurrency)))
+        logger.info("Insight scheduler started (interval=%ss, concurrency=%d)", self.interval, self.concurrency)
+        return True
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._queued.clear()
+
+    async def _check_loop(self):
+        while True:
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counts["check_failures"] += 1
+                logger.warning("Insight scheduler check failed: %s", e)
+            await asyncio.sleep(self.interval * random.uniform(0.9, 1.1))
+
+    async def _watermarks(self, now):
+        """Returns {sensor_id: latest reading in epoch ms} for the active sensors."""
+        watermarks = {}
+        if self.active_seconds > 0:
+            since = datetime.now(timezone.utc) - timedelta(seconds=self.active_seconds)
+            watermarks.update(await run_stage("sensor_query", get_active_sensor_watermarks, since))
+        for sensor_id, (_, viewed_at, _) in list(self._views.items()):
+            if now - viewed_at > self.view_ttl:
+                del self._views[sensor_id]
+            elif sensor_id not in watermarks:
+                watermark = await run_stage("sensor_query", get_sensor_watermark, sensor_id)
+                if watermark is not None:
+                    watermarks[sensor_id] = watermark
+        return watermarks
+
+    async def check(self):
+        """Queues the active sensors whose cached insight is missing, outdated or about to expire."""
+        self.counts["checks"] += 1
+        now = time.monotonic()
+        self._not_before = {sensor_id: until for sensor_id, until in self._not_before.items() if until > now}
+        candidates = []
+        for sensor_id, watermark in (await self._watermarks(now)).items():
+            if sensor_id in self._queued or now < self._not_before.get(sensor_id, 0.0):
+                continue
+            params = self._views[sensor_id][2] if sensor_id in self._views else self.default_params
+            key = insight_view_key(sensor_id, **params)
+            if insight_cache.needs_refresh(key, watermark, lead_seconds=self.interval * 1.1 + self.jitter):
+                candidates.append(((-self._view_score(sensor_id, now), -watermark), sensor_id, params, watermark))
+
+        candidates.sort(key=lambda candidate: candidate[0])
+        for priority, sensor_id, params, watermark in candidates[:self.max_sensors]:
+            self._queued.add(sensor_id)
+            self._queue.put_nowait((priority, next(self._sequence), sensor_id, params, watermark))
+            self.counts["scheduled"] += 1
+
+    async def _worker(self):
+        while True:
+            _, _, sensor_id, params, watermark = await self._queue.get()
+            try:
+                await asyncio.sleep(random.uniform(0, self.jitter))
+                await aprecompute_insight(sensor_id, watermark, **params)
+                self.counts["generated"] += 1
+                self._failures.pop(sensor_id, None)
+                self._not_before[sensor_id] = time.monotonic() + self.min_interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counts["failed"] += 1
+                failures = self._failures[sensor_id] = self._failures.get(sensor_id, 0) + 1
+                backoff = max(self.min_interval, min(self.max_backoff, self.interval * 2 ** failures)
+                              * random.uniform(0.5, 1.0))
+                self._not_before[sensor_id] = time.monotonic() + backoff
+                logger.warning("Pre-generating the insight for %s failed (attempt %d, retry in %.0fs): %s",
+                               sensor_id, failures, backoff, e)
+            finally:
+                self._queued.discard(sensor_id)
+                self._queue.task_done()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "running": self.running,
+            **self.counts,
+            "viewed_sensors": len(self._views),
+            "queued": len(self._queued),
+            "backing_off": len(self._failures),
+        }
+
+
+insight_scheduler = InsightScheduler()
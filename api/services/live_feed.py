@@ -0,0 +1,182 @@
+# live_feed.py
+"""Fan-out of newly inserted readings to the clients following a sensor."""
+import asyncio
+import json
+import logging
+from collections import defaultdict, namedtuple
+
+import numpy as np
+from pymongo.errors import PyMongoError
+
+from api.config import LIVE_FEED_ENABLED, LIVE_FEED_SOURCE, LIVE_FEED_QUEUE_SIZE, LIVE_FEED_MAX_SUBSCRIBERS
+from api.services.columnar import to_columnar, columnar_to_json_dict
+from api.services.data_retrieval import METRIC_FIELDS, _epoch_ms, _as_float
+from api.services.ingest_hooks import register_ingest_hook, unregister_ingest_hook, ReadingsTailer
+
+logger = logging.getLogger(__name__)
+
+# A batch of one sensor's new readings: its epoch millisecond timestamps and columns, and its payload,
+# encoded once for all subscribers as the JSON of a columnar sensor_data payload
+LiveBatch = namedtuple("LiveBatch", ["sensor_id", "timestamps", "columns", "data"])
+
+# Queued instead of a batch when a subscriber fell behind; its stream ends and the client reconnects
+RESYNC = object()
+
+
+class LiveFeedFullError(Exception):
+    """Raised when LIVE_FEED_MAX_SUBSCRIBERS subscribers are already connected."""
+
+
+def encode_batch(sensor_id, timestamps, columns):
+    """Builds the LiveBatch of a sensor's readings (int64 epoch milliseconds and float64 columns)."""
+    return LiveBatch(sensor_id, timestamps.tolist(), columns,
+                     json.dumps(columnar_to_json_dict(to_columnar(sensor_id, timestamps, columns))))
+
+
+def batch_after(batch, after_ms):
+    """Returns the LiveBatch of the batch's readings after after_ms, re-encoded if some are dropped, or None."""
+    if batch.timestamps[0] > after_ms:
+        return batch
+    timestamps = np.array(batch.timestamps, dtype=np.int64)
+    newer = timestamps > after_ms
+    if not newer.any():
+        return None
+    return encode_batch(batch.sensor_id, timestamps[newer], {field: values[newer] for field, values in batch.columns.items()})
+
+
+class Subscription:
+    """A client's queue of LiveBatch (or RESYNC) for one sensor."""
+
+    __slots__ = ("sensor_id", "queue")
+
+    def __init__(self, sensor_id, queue_size):
+        self.sensor_id = sensor_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+
+class LiveFeedBroker:
+    """
+    Passes each sensor's new readings to every client following it.
+
+    One upstream feed (the ingest hook, or a change-stream tailer with source
+    "change_stream") serves all subscribers: each batch of a followed sensor's
+    readings is encoded once and queued for each of its subscribers. A
+    subscriber whose queue is full gets RESYNC instead and should reconnect
+    from its last reading. Subscriptions must be made from the event loop
+    thread; readings may be published from any thread.
+    """
+
+    def __init__(self, enabled=LIVE_FEED_ENABLED, source=LIVE_FEED_SOURCE, queue_size=LIVE_FEED_QUEUE_SIZE,
+                 max_subscribers=LIVE_FEED_MAX_SUBSCRIBERS):
+        self.enabled = enabled
+        self.source = source
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscriptions = defaultdict(set)
+        self._count = 0
+        self._loop = None
+        self._tailer = None
+        self._active_source = None
+        self.counts = {"batches": 0, "readings": 0, "deliveries": 0, "resyncs": 0}
+
+    @property
+    def running(self):
+        return self._loop is not None
+
+    def start(self, tail=True):
+        """Follows new readings from LIVE_FEED_SOURCE; call from the event loop. A no-op when disabled."""
+        if not self.enabled or self.running:
+            return None
+        self._loop = asyncio.get_running_loop()
+        if self.source == "change_stream" and tail:
+            tailer = ReadingsTailer(self.publish_readings, name="live-feed-tailer", flush_seconds=0.2)
+            try:
+                tailer.start()
+                self._tailer, self._active_source = tailer, "change_stream"
+                return self._active_source
+            except (PyMongoError, NotImplementedError) as e:
+                logger.warning("Change streams unavailable, feeding live streams from ingestion: %s", e)
+        register_ingest_hook(self.publish_readings)
+        self._active_source = "ingest"
+        return self._active_source
+
+    def stop(self):
+        if self._tailer is not None:
+            self._tailer.stop()
+            self._tailer = None
+        unregister_ingest_hook(self.publish_readings)
+        self._loop = None
+        self._active_source = None
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                self._offer(subscription, RESYNC)
+
+    def subscribe(self, sensor_id):
+        """Returns a new Subscription to the sensor's readings; raises LiveFeedFullError at the limit."""
+        if self._count >= self.max_subscribers:
+            raise LiveFeedFullError(f"{self._count} live subscribers are connected")
+        subscription = Subscription(sensor_id, self.queue_size)
+        self._subscriptions[sensor_id].add(subscription)
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.sensor_id)
+        if subscriptions is not None and subscription in subscriptions:
+            subscriptions.discard(subscription)
+            self._count -= 1
+            if not subscriptions:
+                del self._subscriptions[subscription.sensor_id]
+
+    def publish_readings(self, readings):
+        """Ingest hook: encodes the new readings of followed sensors and hands them to the event loop."""
+        loop = self._loop
+        if loop is None:
+            return
+        by_sensor = defaultdict(list)
+        for reading in readings:
+            # A membership test is safe from any thread; readings of unfollowed sensors are skipped
+            if reading.get("sensor_id") in self._subscriptions:
+                by_sensor[reading["sensor_id"]].append(reading)
+        for sensor_id, sensor_readings in by_sensor.items():
+            timestamps = np.array([_epoch_ms(reading["timestamp"]) for reading in sensor_readings], dtype=np.int64)
+            order = np.argsort(timestamps, kind="stable")
+            columns = {field: np.array([_as_float(reading.get(field)) for reading in sensor_readings])[order]
+                       for field in METRIC_FIELDS}
+            batch = encode_batch(sensor_id, timestamps[order], columns)
+            try:
+                loop.call_soon_threadsafe(self._fan_out, sensor_id, batch)
+            except RuntimeError:
+                # The loop closed during shutdown
+                return
+
+    def _offer(self, subscription, item):
+        try:
+            subscription.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            # Drop the backlog, so the client hears about the gap right away and reconnects
+            while not subscription.queue.empty():
+                subscription.queue.get_nowait()
+            subscription.queue.put_nowait(RESYNC)
+            self.counts["resyncs"] += 1
+            return False
+
+    def _fan_out(self, sensor_id, batch):
+        self.counts["batches"] += 1
+        self.counts["readings"] += len(batch.timestamps)
+        for subscription in list(self._subscriptions.get(sensor_id, ())):
+            if self._offer(subscription, batch):
+                self.counts["deliveries"] += 1
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "source": self._active_source,
+            **self.counts,
+            "subscribers": self._count,
+            "followed_sensors": len(self._subscriptions),
+        }
+
+
+live_feed = LiveFeedBroker()
@@ -1,47 +1,107 @@
 import json
-import boto3
-import os
-import certifi
-from pymongo.mongo_client import MongoClient
-from dotenv import load_dotenv
-import re
-from datetime import datetime
-
-# Initialize the Bedrock client (ensure your AWS credentials are properly set up)
-bedrock_client = boto3.client('bedrock-runtime', region_name='us-east-1')
-
-load_dotenv()
-
-# MongoDB configuration
-MONGO_URI = os.getenv("MONGO_URI")
-DB_NAME = os.getenv("VECTOR_DB_NAME")
-COLLECTION_NAME = os.getenv("VECTOR_COLLECTION_NAME")
-
-# MongoDB client setup
-ca = certifi.where()
-client = MongoClient(MONGO_URI, tlsCAFile=ca)
-db = client[DB_NAME]
-collection = db[COLLECTION_NAME]
+import logging
+import math
+import threading
+import time
+from collections import namedtuple
+from api.config import (
+    EMBEDDING_MODEL_ID, VECTOR_SEARCH_BACKEND, VECTOR_SEARCH_K, VECTOR_SEARCH_LIMIT, VECTOR_SEARCH_PREFILTER,
+    VECTOR_SEARCH_FILTERED_OVERFETCH, CONTEXT_TOKEN_BUDGET, LOG_PAYLOADS,
+)
+from api.services.context_packing import pack_context
+from api.services.embedding_cache import create_embedding_cache
+from api.services.metrics import VECTOR_SEARCH_CANDIDATES, record_tokens
+from api.services.mongo_client import get_readings_collection, get_vector_collection
+from api.services.query_understanding import parse_query_filters
+from api.services.sensor_digest import to_epoch_seconds
+from api.services.vector_index import get_local_vector_index
+
+# The Bedrock client is created on first use (ensure your AWS credentials are properly set up)
+bedrock_client = None
+_bedrock_client_lock = threading.Lock()
+
+# The embedding cache is created on first use too, as its store may open a SQLite file or MongoDB collection
+embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+# Name of the Atlas Search index on the vector collection
+VECTOR_SEARCH_INDEX_NAME = "vector_search_index"
+
+def get_bedrock_client():
+    """Returns the shared bedrock-runtime client, creating it (and importing boto3) on first use."""
+    global bedrock_client
+    if bedrock_client is None:
+        with _bedrock_client_lock:
+            if bedrock_client is None:
+                import boto3
+                bedrock_client = boto3.client('bedrock-runtime', region_name='us-east-1')
+    return bedrock_client
+
+def get_embedding_cache():
+    """Returns the shared embedding cache of EMBEDDING_MODEL_ID, creating its store on first use."""
+    global embedding_cache
+    if embedding_cache is None:
+        with _embedding_cache_lock:
+            if embedding_cache is None:
+                embedding_cache = create_embedding_cache(EMBEDDING_MODEL_ID)
+    return embedding_cache
+
+def embedding_cache_stats():
+    """Returns the embedding cache's counters, or {} before its first use (without creating its store)."""
+    cache = embedding_cache
+    return cache.stats() if cache is not None else {}
+
+def _invoke_embedding_model(text):
+    """Calls the Titan embedding model on Bedrock for a single text."""
+    native_request = {"inputText": text}
+    request = json.dumps(native_request)
+
+    response = get_bedrock_client().invoke_model(
+        modelId=EMBEDDING_MODEL_ID,  # Titan embed text model ID
+        body=request,  # Input text for embedding generation
+        contentType='application/json',  # Content type for the request
+        accept='application/json'  # Expected response format
+    )
+    
+    # Parse the response to get the embedding vector
+    return json.loads(response['body'].read().decode('utf-8'))['embedding']
+
+def warm_up_bedrock(send_request=True):
+    """Creates the Bedrock client and, optionally, opens its connection with one uncached embedding request."""
+    get_bedrock_client()
+    if send_request:
+        _invoke_embedding_model("warm-up")
 
 # Function to generate embedding using Amazon Titan model
 def generate_embedding(text):
     try:
-        native_request = {"inputText": text}
-        request = json.dumps(native_request)
-
-        response = bedrock_client.invoke_model(
-            modelId='amazon.titan-embed-text-v1',  # Titan embed text model ID
-            body=request,  # Input text for embedding generation
-            contentType='application/json',  # Content type for the request
-            accept='application/json'  # Expected response format
-        )
-        
-        # Parse the response to get the embedding vector
-        embedding = json.loads(response['body'].read().decode('utf-8'))['embedding']
-        return embedding
+        return get_embedding_cache().get(text, _invoke_embedding_model)
     except Exception as e:
         return {str(e)}
 
+def generate_embeddings(texts):
+    """
+    Generates embeddings for many texts, calling Bedrock only for cache misses.
+
+    Args:
+        texts (list[str]): Texts to embed.
+
+    Returns:
+        list[list[float]]: Embeddings in the same order as texts.
+    """
+    return get_embedding_cache().get_many(texts, _invoke_embedding_model)
+
+CLAUDE_MODEL_ID = "anthropic.claude-instant-v1"
+
+def _claude_request_body(prompt):
+    return json.dumps({
+        "prompt": f"\n\nHuman: {prompt}\n\nAssistant:",
+        "max_tokens_to_sample": 1500,
+        "temperature": 0.7
+    })
+
 def generate_answer_with_claude(prompt):
     """
     Sends the prompt to Claude Sonnet on AWS Bedrock and returns the response.
@@ -54,16 +114,10 @@ def generate_answer_with_claude(prompt):
     """
     # Prepare request payload
     try:
-        request_payload = {
-            "prompt": f"\n\nHuman: {prompt}\n\nAssistant:",
-            "max_tokens_to_sample": 1500,
-            "temperature": 0.7
-        }
-
         # Invoke Claude Sonnet model through Bedrock
-        response = bedrock_client.invoke_model(
-            modelId="anthropic.claude-instant-v1",  # Specify Claude's model ID
-            body=json.dumps(request_payload),
+        response = get_bedrock_client().invoke_model(
+            modelId=CLAUDE_MODEL_ID,  # Specify Claude's model ID
+            body=_claude_request_body(prompt),
             contentType="application/json",
             accept="application/json"
         )
@@ -72,117 +126,272 @@ def generate_answer_with_claude(prompt):
         response_body = json.loads(response['body'].read().decode('utf-8'))
         answer = response_body.get("completion", "").strip()
 
-        print(answer)
+        # Bedrock reports token usage in response headers
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        record_tokens("rag", headers.get("x-amzn-bedrock-input-token-count"),
+                      headers.get("x-amzn-bedrock-output-token-count"))
+        if LOG_PAYLOADS:
+            logger.info("Claude answer: %s", answer)
 
         return answer
     except Exception as e:
         return {str(e)}
 
-def get_query_results(query):
-    try:
-        print(f"Received query: {query}")
-        
-        query_embedding = generate_embedding(query)
-        print(f"Generated embedding for query")
-        
-        extracted_date = extract_date_from_query(query)
-        print(f"Extracted Date: {extracted_date}")
-        
-        pipeline = [
-            {
-                "$search": {
-                    "index": "vector_search_index",  # Use the name of the search index we created
-                    "knnBeta": {
-                        "vector": query_embedding,
-                        "path": "embedding",
-                        "k": 1000
-                    }
-                }
-            }
-        ]
-        
-        if extracted_date:
-            pipeline.append({
-                "$match": {"timestamp": {"$gte": extracted_date}}
-            })
-        
-        pipeline.extend([
-            {"$sort": {"timestamp": -1}},
-            {"$limit": 100},
-            {
-                "$project": {
-                    "_id": 0,
-                    "sensor_id": 1,
-                    "timestamp": 1,
-                    "temperature": 1,
-                    "humidity": 1,
-                    "AQI": 1,
-                    "CO2_level": 1,
-                    "id": 1,
-                    "text": 1
-                }
+def stream_answer_with_claude(prompt):
+    """
+    Streams Claude's answer from Bedrock's response-stream API.
+
+    Args:
+        prompt (str): The prompt text for Claude to process.
+
+    Yields:
+        str: Completion text fragments as they are generated.
+    """
+    response = get_bedrock_client().invoke_model_with_response_stream(
+        modelId=CLAUDE_MODEL_ID,
+        body=_claude_request_body(prompt),
+        contentType="application/json",
+        accept="application/json"
+    )
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if chunk is None:
+            continue
+        payload = json.loads(chunk['bytes'].decode('utf-8'))
+        # The last chunk carries the invocation's token usage
+        usage = payload.get("amazon-bedrock-invocationMetrics")
+        if usage:
+            record_tokens("rag", usage.get("inputTokenCount"), usage.get("outputTokenCount"))
+        completion = payload.get("completion", "")
+        if completion:
+            yield completion
+
+# Fields returned for each retrieved reading
+RESULT_PROJECTION = {
+    "_id": 0,
+    "sensor_id": 1,
+    "timestamp": 1,
+    "temperature": 1,
+    "humidity": 1,
+    "AQI": 1,
+    "CO2_level": 1,
+    "id": 1,
+    "text": 1,
+    # Relevance, used to rank readings when the context is packed
+    "score": {"$meta": "searchScore"}
+}
+
+# Seconds the sensor IDs that questions are matched against are reused (Atlas backend)
+KNOWN_SENSORS_TTL = 300
+
+_known_sensors = (None, ())
+_known_sensors_lock = threading.Lock()
+
+def known_sensor_ids():
+    """Returns the IDs of the sensors with readings, which parse_filters looks for in questions."""
+    global _known_sensors
+    if VECTOR_SEARCH_BACKEND == "local":
+        return get_local_vector_index().sensor_ids()
+    with _known_sensors_lock:
+        loaded_at, sensor_ids = _known_sensors
+        if loaded_at is not None and time.monotonic() - loaded_at < KNOWN_SENSORS_TTL:
+            return sensor_ids
+        try:
+            # Answered from the sensor_id/timestamp index
+            sensor_ids = tuple(s for s in get_readings_collection().distinct("sensor_id") if s)
+        except Exception as e:
+            # Keep the previous list; explicit "sensor <id>" mentions are still recognized without one
+            logger.warning("Could not load the sensor IDs for query parsing: %s", e)
+        _known_sensors = (time.monotonic(), sensor_ids)
+        return sensor_ids
+
+def parse_filters(query):
+    """Parses the period and the sensors a question is about (see query_understanding)."""
+    return parse_query_filters(query, known_sensor_ids())
+
+def adaptive_k(filters):
+    """
+    Returns the number of nearest neighbours to fetch for a question.
+
+    Unfiltered questions rank the VECTOR_SEARCH_K most similar readings by
+    recency. When the filters are applied inside the search every candidate is
+    in scope, so a small multiple of VECTOR_SEARCH_LIMIT is enough.
+    """
+    if not filters:
+        return VECTOR_SEARCH_K
+    return min(VECTOR_SEARCH_K, max(VECTOR_SEARCH_LIMIT, math.ceil(VECTOR_SEARCH_LIMIT * VECTOR_SEARCH_FILTERED_OVERFETCH)))
+
+def _atlas_search_filter(filters):
+    """Translates filters into an Atlas Search operator for knnBeta's filter option."""
+    clauses = []
+    if filters.since is not None or filters.until is not None:
+        bounds = {"gte": filters.since, "lte": filters.until}
+        clauses.append({"range": {"path": "timestamp", **{op: value for op, value in bounds.items() if value is not None}}})
+    if filters.sensor_ids:
+        clauses.append({"in": {"path": "sensor_id", "value": list(filters.sensor_ids)}})
+    return {"compound": {"filter": clauses}}
+
+def _match_filter(filters):
+    """Translates filters into a $match query, for post-filtering."""
+    match = {}
+    if filters.since is not None or filters.until is not None:
+        bounds = {"$gte": filters.since, "$lte": filters.until}
+        match["timestamp"] = {op: value for op, value in bounds.items() if value is not None}
+    if filters.sensor_ids:
+        match["sensor_id"] = {"$in": list(filters.sensor_ids)}
+    return match
+
+def _matches_filters(doc, filters):
+    if filters.sensor_ids and doc.get("sensor_id") not in filters.sensor_ids:
+        return False
+    if filters.since is None and filters.until is None:
+        return True
+    if not doc.get("timestamp"):
+        return False
+    seconds = to_epoch_seconds(doc["timestamp"])
+    return ((filters.since is None or seconds >= to_epoch_seconds(filters.since))
+            and (filters.until is None or seconds <= to_epoch_seconds(filters.until)))
+
+def _atlas_vector_search(query_embedding, filters, prefilter):
+    """Retrieves readings with Atlas $search knnBeta; returns (results, k, candidates)."""
+    knn = {
+        "vector": query_embedding,
+        "path": "embedding",
+        "k": adaptive_k(filters) if prefilter else VECTOR_SEARCH_K
+    }
+    if prefilter and filters:
+        knn["filter"] = _atlas_search_filter(filters)
+    pipeline = [
+        {
+            "$search": {
+                "index": VECTOR_SEARCH_INDEX_NAME,  # Use the name of the search index we created
+                "knnBeta": knn
             }
-        ])
-        
-        results = collection.aggregate(pipeline)
-        
-        array_of_results = list(results)
+        }
+    ]
+    
+    if filters and not prefilter:
+        pipeline.append({"$match": _match_filter(filters)})
+    
+    pipeline.extend([
+        {"$sort": {"timestamp": -1}},
+        {"$limit": VECTOR_SEARCH_LIMIT},
+        {"$project": RESULT_PROJECTION}
+    ])
+    
+    # Atlas does not report how many candidates matched, so k is the upper bound
+    return list(get_vector_collection().aggregate(pipeline)), knn["k"], knn["k"]
+
+def _local_vector_search(query_embedding, filters, prefilter):
+    """Retrieves readings from the in-process vector index; returns (results, k, candidates)."""
+    index = get_local_vector_index()
+    if prefilter:
+        k = adaptive_k(filters)
+        hits = index.search(query_embedding, k, sensor_ids=filters.sensor_ids, since=filters.since,
+                            until=filters.until)[0]
+    else:
+        k = VECTOR_SEARCH_K
+        hits = index.search(query_embedding, k)[0]
+    results = [{**index.get_record(row), "score": score} for row, score in hits]
+    if filters and not prefilter:
+        results = [doc for doc in results if _matches_filters(doc, filters)]
+    results.sort(key=lambda doc: to_epoch_seconds(doc["timestamp"]) if doc.get("timestamp") else 0, reverse=True)
+    projected = [{field: doc.get(field) for field in RESULT_PROJECTION if field != "_id"} for doc in results[:VECTOR_SEARCH_LIMIT]]
+    return projected, k, len(hits)
+
+Retrieval = namedtuple("Retrieval", ["documents", "filters", "k", "candidates"])
+
+def retrieve_context(query, query_embedding, prefilter=VECTOR_SEARCH_PREFILTER, filters=None):
+    """
+    Runs the vector search for a question, scoped by the filters parsed from it.
+
+    Args:
+        query (str): The user's question.
+        query_embedding (list[float]): Its embedding.
+        prefilter (bool, optional): Apply the filters inside the search with an
+            adaptive k instead of to VECTOR_SEARCH_K unfiltered candidates.
+        filters (QueryFilters, optional): The question's filters, when already
+            parsed; otherwise they are parsed here.
+
+    Returns:
+        Retrieval: The projected readings, the filters, the k searched with and
+            the number of candidates the search fetched.
+    """
+    if filters is None:
+        filters = parse_filters(query)
+    logger.debug("Vector search for %r (filters: %s)", query, filters)
+
+    if VECTOR_SEARCH_BACKEND == "local":
+        documents, k, candidates = _local_vector_search(query_embedding, filters, prefilter)
+    else:
+        documents, k, candidates = _atlas_vector_search(query_embedding, filters, prefilter)
+    VECTOR_SEARCH_CANDIDATES.observe(candidates, filtered=str(bool(filters)).lower())
+    return Retrieval(documents, filters, k, candidates)
+
+def get_query_results(query, query_embedding=None, filters=None):
+    try:
+        if query_embedding is None:
+            query_embedding = generate_embedding(query)
         
-        print(f"Total results retrieved: {len(array_of_results)}")
+        array_of_results = retrieve_context(query, query_embedding, filters=filters).documents
         
-        if array_of_results:
-            print(f"Oldest result timestamp: {array_of_results[-1]['timestamp']}")
-            print(f"Newest result timestamp: {array_of_results[0]['timestamp']}")
-        else:
-            print("No results retrieved")
+        logger.debug("Vector search returned %d results", len(array_of_results))
+        if LOG_PAYLOADS:
+            logger.info("Vector search results: %s", array_of_results)
         
         return array_of_results
     
     except Exception as e:
-        print(f"Error in get_query_results: {str(e)}")
+        logger.error("Error in get_query_results: %s", e)
         return {"error": str(e)}
 
-# Helper function to extract date/time or period from the query
-def extract_date_from_query(query):
-    """Extracts date from the user's query if any"""
-    # Regular expression patterns for matching dates and times in the query (basic examples)
-    date_patterns = [
-        r'\b(\d{4}-\d{2}-\d{2})\b',  # YYYY-MM-DD format
-        r'\b(\d{2}/\d{2}/\d{4})\b',  # MM/DD/YYYY format
-        r'\b(on\s+\d{4}-\d{2}-\d{2})\b',  # "on YYYY-MM-DD"
-        r'\b(at\s+\d{2}:\d{2}(:\d{2})?\s*(AM|PM)?)\b'  # Time format like 14:00 or 2:00 PM
-    ]
-    
-    for pattern in date_patterns:
-        match = re.search(pattern, query)
-        if match:
-            return match.group(0)  # Return the matched date/time/period
-    
-    return None  # No date/time found
+def get_rag_data_watermark():
+    """
+    Returns a value that changes whenever readings are added to or re-embedded in the vector search backend.
+
+    For the Mongo vector collection this is its document count and latest
+    updated_at (set by every vector upsert, including re-embedding and the
+    collection a reindex swaps in); for the local index its row count and
+    generation, which changes when it is rebuilt.
+    """
+    if VECTOR_SEARCH_BACKEND == "local":
+        index = get_local_vector_index()
+        return index.generation, len(index)
+    collection = get_vector_collection()
+    # Collection metadata and one updated_at index entry, so this does not scan the collection
+    latest = next(collection.find({}, {"_id": 0, "updated_at": 1}).sort("updated_at", -1).limit(1), None)
+    return collection.estimated_document_count(), (latest or {}).get("updated_at")
 
-def construct_prompt(user_query):
+def construct_prompt(user_query, context_docs=None, token_budget=CONTEXT_TOKEN_BUDGET, filters=None):
     """
     Constructs a prompt for Claude based on sensor data and user query.
     
     Args:
         user_query (str): The user's question or query regarding the sensor data.
+        context_docs (list, optional): Already retrieved vector search results.
+            When omitted they are retrieved with get_query_results.
+        token_budget (int, optional): Estimated tokens for the retrieved readings,
+            which are packed into per-sensor tables (see context_packing.pack_context).
+        filters (QueryFilters, optional): The question's filters, when already
+            parsed (parsing may query MongoDB for the known sensor IDs).
     
     Returns:
         str: The formatted prompt for Claude.
     """
     try:
-        # Extract the relevant date from the user query if any
-        extracted_date = extract_date_from_query(user_query)
+        # Extract the period the user query is about, if any
+        if filters is None:
+            filters = parse_filters(user_query)
 
         # Get the context data using the user query
-        context_docs = get_query_results(user_query)
-        print(context_docs)
-        context_string = " ".join([doc["text"] for doc in context_docs])
+        if context_docs is None:
+            context_docs = get_query_results(user_query, filters=filters)
+        context_string = pack_context(context_docs, budget=token_budget).text
 
-        # If a date is found, adjust the context accordingly
-        if extracted_date:
+        # If a period is found, adjust the context accordingly
+        if filters.since is not None or filters.until is not None:
             prompt = f"""Use the following pieces of context to answer the question at the end.
-                        The question specifies a date/time, so refer to the relevant context from {extracted_date}:
+                        The question specifies a date/time, so refer to the relevant context from {filters.describe()}:
                         {context_string}
                         Question: {user_query}
                     """
@@ -0,0 +1,194 @@
+# metrics.py
+"""Process-wide latency and token metrics, exported in the Prometheus text format and as Server-Timing."""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_PREFIX = "insightpulse"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _format_number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations per label set."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # label values -> [bucket counts..., sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = dict(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_number(bound)})} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_number(series[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    f"{METRIC_PREFIX}_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status"),
+)
+STAGE_SECONDS = Histogram(
+    f"{METRIC_PREFIX}_stage_duration_seconds",
+    "Latency of request stages: Mongo query, embedding, vector search, prompt build, LLM call and serialization.",
+    ("stage",),
+)
+LLM_TOKENS = Counter(
+    f"{METRIC_PREFIX}_llm_tokens_total", "Prompt (input) and response (output) tokens reported by the LLM.",
+    ("operation", "kind"),
+)
+CONTEXT_TOKENS = Counter(
+    f"{METRIC_PREFIX}_rag_context_tokens_total", "Estimated RAG context tokens packed into prompts and dropped.",
+    ("kind",),
+)
+
+VECTOR_SEARCH_CANDIDATES = Histogram(
+    f"{METRIC_PREFIX}_vector_search_candidates",
+    "Nearest-neighbour candidates fetched per RAG vector search, by whether the question had filters.",
+    ("filtered",), buckets=(10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+
+REGISTRY = (HTTP_REQUEST_SECONDS, STAGE_SECONDS, LLM_TOKENS, CONTEXT_TOKENS, VECTOR_SEARCH_CANDIDATES)
+
+# (stage, seconds) pairs of the current request, reported in its Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request_timings():
+    """Starts collecting stage timings for the current request and returns the list they are added to."""
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def record_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage):
+    """Records the duration of the enclosed block as a stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def record_tokens(operation, input_tokens=None, output_tokens=None):
+    if input_tokens is not None:
+        LLM_TOKENS.inc(int(input_tokens), operation=operation, kind="input")
+    if output_tokens is not None:
+        LLM_TOKENS.inc(int(output_tokens), operation=operation, kind="output")
+
+
+def server_timing_header(timings, total_seconds=None):
+    """Formats stage timings as a Server-Timing header value; repeated stages are summed."""
+    durations = {}
+    for stage, seconds in timings:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations.items()]
+    if total_seconds is not None:
+        entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _gauge_lines(name, stats):
+    """Renders a dict of numeric stats as gauges; nested dicts become series labelled by their key."""
+    series = {}
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            for stat, stat_value in value.items():
+                if _is_number(stat_value):
+                    series.setdefault(stat, []).append(({"name": key}, stat_value))
+        elif _is_number(value):
+            series.setdefault(key, []).append(({}, value))
+
+    lines = []
+    for stat, samples in series.items():
+        metric = f"{METRIC_PREFIX}_{name}_{stat}"
+        lines.append(f"# TYPE {metric} gauge")
+        lines.extend(f"{metric}{_format_labels(labels)} {_format_number(value)}" for labels, value in samples)
+    return lines
+
+
+def render_metrics(gauges=None):
+    """
+    Renders all metrics in the Prometheus text exposition format.
+
+    Args:
+        gauges (dict, optional): Name to a dict of numeric stats (e.g. pool_stats()),
+            exported as one gauge per stat.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, stats in (gauges or {}).items():
+        lines.extend(_gauge_lines(name, stats))
+    return "\n".join(lines) + "\n"
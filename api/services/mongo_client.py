@@ -0,0 +1,188 @@
+# mongo_client.py
+"""Process-wide pooled MongoDB client shared by all services."""
+import logging
+import threading
+
+import certifi
+from pymongo import MongoClient, monitoring
+
+from api.config import (
+    MONGO_URI, DB_NAME, COLLECTION_NAME, VECTOR_DB_NAME, VECTOR_COLLECTION_NAME,
+    MONGO_TLS, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS, MONGO_CONNECT_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS, MONGO_READ_PREFERENCE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Collects connection pool counters from pymongo's CMAP events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections_created = 0
+            self.connections_closed = 0
+            self.checked_out = 0
+            self.waiting = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+            self.pools_cleared = 0
+
+    def _record_wait(self, event):
+        duration = getattr(event, "duration", None) or 0.0
+        self.wait_seconds_total += duration
+        self.wait_seconds_max = max(self.wait_seconds_max, duration)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pools_cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+            self._record_wait(event)
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+            self.checkouts += 1
+            self._record_wait(event)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def snapshot(self):
+        with self._lock:
+            attempts = self.checkouts + self.checkout_failures
+            return {
+                "open_connections": self.connections_created - self.connections_closed,
+                "connections_created": self.connections_created,
+                "connections_closed": self.connections_closed,
+                "checked_out": self.checked_out,
+                "waiting_for_checkout": self.waiting,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / attempts, 6) if attempts else 0.0,
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "pools_cleared": self.pools_cleared,
+            }
+
+
+class MongoClientManager:
+    """
+    Owns the single MongoClient used by the API process.
+
+    The client is opened on FastAPI startup (or on first use outside the app) and
+    closed on shutdown. All services get databases and collections from here so
+    they share one TLS handshake and one connection pool per server.
+    """
+
+    def __init__(self, uri=MONGO_URI):
+        self.uri = uri
+        self.pool_listener = PoolStatsListener()
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client_options(self):
+        options = {
+            "maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "minPoolSize": MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+            "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+            "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+            "readPreference": MONGO_READ_PREFERENCE,
+            "appname": "insightpulse-api",
+        }
+        if MONGO_TLS:
+            options["tlsCAFile"] = certifi.where()
+        # pymongo treats None as "no limit" for these, but rejects None for others
+        return {key: value for key, value in options.items() if value is not None}
+
+    def open(self):
+        """Creates the shared client if it does not exist yet and returns it."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    logger.info("Opening MongoDB client (maxPoolSize=%s, readPreference=%s)",
+                                MONGO_MAX_POOL_SIZE, MONGO_READ_PREFERENCE)
+                    self._client = MongoClient(self.uri, event_listeners=[self.pool_listener],
+                                               **self.client_options())
+        return self._client
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                logger.info("Closing MongoDB client")
+                self._client.close()
+                self._client = None
+                self.pool_listener.reset()
+
+    @property
+    def client(self):
+        return self.open()
+
+    def get_database(self, database_name=DB_NAME):
+        return self.client[database_name]
+
+    def get_collection(self, collection_name=COLLECTION_NAME, database_name=DB_NAME):
+        return self.client[database_name][collection_name]
+
+    def pool_stats(self):
+        stats = self.pool_listener.snapshot()
+        stats.update({
+            "connected": self._client is not None,
+            "max_pool_size": MONGO_MAX_POOL_SIZE,
+            "min_pool_size": MONGO_MIN_POOL_SIZE,
+            "read_preference": MONGO_READ_PREFERENCE,
+        })
+        return stats
+
+
+mongo_manager = MongoClientManager()
+
+
+def get_readings_collection():
+    """Returns the raw sensor readings collection."""
+    return mongo_manager.get_collection(COLLECTION_NAME, DB_NAME)
+
+
+def get_vector_collection():
+    """Returns the collection holding reading embeddings for vector search."""
+    return mongo_manager.get_collection(VECTOR_COLLECTION_NAME, VECTOR_DB_NAME)
@@ -1,16 +1,191 @@
 # prompt_handler.py
-from api.config import MODEL_NAME, AWS_REGION, AWS_SECRET_ACCESS_KEY, AWS_ACCESS_KEY_ID
+from api.config import MODEL_NAME, AWS_REGION, AWS_SECRET_ACCESS_KEY, AWS_ACCESS_KEY_ID, INSIGHT_PROMPT_MODE, LOG_PAYLOADS, BATCH_INSIGHT_CONCURRENCY, INSIGHT_RESOLUTION, ROLLUPS_ENABLED, ANOMALY_ENABLED, ANOMALY_MAX_INSIGHT_FACTS
 
-from langchain_aws import ChatBedrock
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain  # Ensure you have the right imports based on LangChain setup
-from api.services.data_retrieval import get_sensor_data
-from api.services.load_rag_data import rag_query_pipeline
+from api.services.data_retrieval import get_sensor_data, get_sensor_columns, get_sensors_columns, get_sensor_watermark, METRIC_FIELDS
+from api.services.load_rag_data import rag_query_pipeline, generate_embedding, get_query_results, construct_prompt, generate_answer_with_claude, stream_answer_with_claude, get_rag_data_watermark, parse_filters
+from api.services.answer_cache import answer_cache
+from api.services.metrics import timed, record_tokens
+from api.services.concurrency import run_stage, iterate_stage, StageTimeoutError
+from api.services.sensor_digest import summarize_documents, summarize_columns, summarize_fleet, summarize_aggregates, documents_to_columns, FIELD_METRICS
+from api.services.anomalies import detector as anomaly_detector, format_anomaly_facts
+from api.services.insight_cache import insight_cache, BYPASS
+from api.services.columnar import to_columnar, columnar_to_json_dict
+from api.services.rollups import get_sensor_rollups
+from pymongo.errors import PyMongoError
+import asyncio
+import logging
 import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+import numpy as np
 
-def generate_insight(sensor_id=None):
+logger = logging.getLogger(__name__)
+
+PROMPT_MODES = ("raw", "digest")
+
+# How sensor_data is returned with an insight: LangChain documents, or columnar arrays
+DATA_FORMATS = ("documents", "columnar")
+
+# Data behind an insight: raw readings, or hourly/daily rollups ("auto" picks, see _resolve_resolution)
+RESOLUTIONS = ("raw", "hourly", "daily", "auto")
+
+RAW_TEMPLATE = """
+        Given the following environmental data over the past week:
+        {data}
+
+        Please summarize the key trends and provide insights.
+        """
+
+DIGEST_TEMPLATE = """
+        Given the following statistical summary of environmental data over the past week
+        (per-metric statistics, trends per hour, threshold exceedances, time-bucketed means
+        and any detected anomalies):
+        {data}
+
+        Please summarize the key trends and provide insights.
+        """
+
+FLEET_TEMPLATE = """
+        Given the following per-sensor summary of environmental data over the past week
+        (one row per sensor: reading count, latest reading, per-metric mean/max and threshold exceedances):
+        {data}
+
+        Please compare the sensors, point out the ones that stand out and summarize the fleet-wide trends.
+        """
+
+def _with_anomaly_facts(data_str, timestamps, columns):
+    """Appends the anomalies detected in the readings (epoch ms, columns by field) to a digest."""
+    if not ANOMALY_ENABLED or not timestamps.size:
+        return data_str
+    order = np.argsort(timestamps, kind="stable")
+    anomalies, _ = anomaly_detector.score_columns(
+        timestamps[order], {field: values[order] for field, values in columns.items()})
+    facts = format_anomaly_facts(anomalies, ANOMALY_MAX_INSIGHT_FACTS)
+    return f"{data_str}\n{facts}" if facts else data_str
+
+def build_insight_data(documents, prompt_mode=INSIGHT_PROMPT_MODE):
+    """Returns the prompt template and data string for the requested prompt mode."""
+    if prompt_mode == "digest":
+        timestamps, columns = documents_to_columns(documents)
+        field_columns = {field: columns[metric] for field, metric in FIELD_METRICS.items()}
+        return DIGEST_TEMPLATE, _with_anomaly_facts(summarize_documents(documents),
+                                                    np.round(timestamps * 1000).astype(np.int64), field_columns)
+    return RAW_TEMPLATE, "\n".join([doc.page_content for doc in documents])
+
+def build_columnar_insight_data(timestamps, columns, prompt_mode=INSIGHT_PROMPT_MODE):
+    """Returns the prompt template and data string for columnar readings, without building documents."""
+    if prompt_mode == "digest":
+        return DIGEST_TEMPLATE, _with_anomaly_facts(summarize_columns(timestamps, columns), timestamps, columns)
+    rows = zip(*(columns[field].tolist() for field in METRIC_FIELDS))
+    return RAW_TEMPLATE, "\n".join(
+        f"Temperature: {t}, Humidity: {h}, AQI: {a}, CO2_level: {c}" for t, h, a, c in rows
+    )
+
+def build_rollup_insight_data(aggregates, prompt_mode=INSIGHT_PROMPT_MODE):
+    """Returns the prompt template and data string for rollup aggregates; "raw" lists the bucket means."""
+    if prompt_mode == "digest":
+        return DIGEST_TEMPLATE, summarize_aggregates(aggregates)
+    means = aggregates.means()
+    lines = []
+    for i, bucket in enumerate(aggregates.buckets.tolist()):
+        values = ", ".join(f"{FIELD_METRICS[field]}: {means[field][i]:.2f}" for field in METRIC_FIELDS)
+        lines.append(f"{_bucket_label(bucket)} (mean of {aggregates.count[i]} readings): {values}")
+    return RAW_TEMPLATE, "\n".join(lines)
+
+def _bucket_label(epoch_ms):
+    return datetime.fromtimestamp(epoch_ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+def _rollup_sensor_data(sensor_id, aggregates, data_format):
+    """Returns the bucket means as sensor_data, as columnar arrays or one document per bucket."""
+    means = aggregates.means()
+    if data_format == "columnar":
+        return columnar_to_json_dict(to_columnar(sensor_id, aggregates.buckets, means))
+    from langchain.schema import Document
+
+    return [
+        Document(
+            page_content=", ".join(f"{field}: {None if np.isnan(means[field][i]) else round(float(means[field][i]), 2)}"
+                                   for field in METRIC_FIELDS),
+            metadata={"timestamp": _bucket_label(bucket), "sensor": sensor_id, "readings": int(aggregates.count[i])},
+        )
+        for i, bucket in enumerate(aggregates.buckets.tolist())
+    ]
+
+def _prepare_insight_prompt(documents, prompt_mode):
+    """Builds the prompt template and its data string for the retrieved documents."""
+    template, data_str = build_insight_data(documents, prompt_mode)
+    return _to_prompt(template, data_str)
+
+def _to_prompt(template, data_str):
+    from langchain.prompts import PromptTemplate
+
+    prompt_template = PromptTemplate(input_variables=["data"], template=template)
+    return prompt_template, data_str
+
+def _validate_prompt_mode(prompt_mode):
+    prompt_mode = prompt_mode or INSIGHT_PROMPT_MODE
+    if prompt_mode not in PROMPT_MODES:
+        raise ValueError(f"prompt_mode must be one of {', '.join(PROMPT_MODES)}")
+    return prompt_mode
+
+def _validate_data_format(data_format):
+    data_format = data_format or "documents"
+    if data_format not in DATA_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(DATA_FORMATS)}")
+    return data_format
+
+def _resolve_resolution(resolution, prompt_mode, limit):
+    """Returns "raw", "hourly" or "daily"; "auto" reads hourly rollups for digests of a whole window."""
+    resolution = resolution or INSIGHT_RESOLUTION
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+    if resolution == "auto":
+        return "hourly" if ROLLUPS_ENABLED and prompt_mode == "digest" and not limit else "raw"
+    if resolution != "raw":
+        if not ROLLUPS_ENABLED:
+            raise ValueError(f"resolution={resolution} requires ROLLUPS_ENABLED")
+        if limit:
+            raise ValueError("limit is only supported with resolution=raw")
+    return resolution
+
+_llm = None
+_llm_lock = threading.Lock()
+
+def _get_llm():
+    """Returns the shared Bedrock chat model, importing langchain_aws and creating it on first use."""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                from langchain_aws import ChatBedrock
+
+                # Configure Amazon Bedrock LLM
+                _llm = ChatBedrock(model=MODEL_NAME, region=AWS_REGION, aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+    return _llm
+
+def prepare_llm():
+    """Imports the LangChain modules used by insights and creates the chat model ahead of the first request."""
+    from langchain.prompts import PromptTemplate
+    from langchain.schema import Document
+
+    _get_llm()
+
+def _log_insight_usage(response, prompt_mode, readings, prompt_chars, llm_seconds):
+    usage = getattr(response, "usage_metadata", None) or {}
+    record_tokens("insight", usage.get("input_tokens"), usage.get("output_tokens"))
+    logger.info(
+        "insight prompt_mode=%s readings=%d prompt_chars=%d input_tokens=%s output_tokens=%s llm_seconds=%.3f",
+        prompt_mode, readings, prompt_chars, usage.get("input_tokens"), usage.get("output_tokens"),
+        llm_seconds,
+    )
+
+def generate_insight(sensor_id=None, prompt_mode=None):
     """Generates insights using data retrieved from MongoDB and LangChain for analysis."""
     try:
+        prompt_mode = _validate_prompt_mode(prompt_mode)
+
         # Retrieve sensor data
         documents = get_sensor_data(sensor_id=sensor_id)
 
@@ -18,34 +193,285 @@ def generate_insight(sensor_id=None):
             return "No data available for the specified sensor."
         
         # Construct the input prompt for LangChain
-        template = """
-        Given the following environmental data over the past week:
-        {data}
-
-        Please summarize the key trends and provide insights.
-        """
-
-        data_str = "\n".join([doc.page_content for doc in documents])
-
-        prompt_template = PromptTemplate(input_variables=["data"], template=template)
+        prompt_template, data_str = _prepare_insight_prompt(documents, prompt_mode)
 
         prompt = prompt_template.format(data=data_str)
+        if LOG_PAYLOADS:
+            logger.info("Insight prompt for %s: %s", sensor_id, prompt)
 
-        print(prompt)
+        llm = _get_llm()
 
-        # Configure Amazon Bedrock LLM
-        llm = ChatBedrock(model=MODEL_NAME, region=AWS_REGION, aws_access_key_id=AWS_ACCESS_KEY_ID, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-
-        print("Got here...")
         # Use the `|` operator to chain the formatted prompt to the llm
+        started = time.perf_counter()
         response = (prompt_template | llm).invoke({"data": data_str})
-        print(response)
-        print(documents)
-        
+        _log_insight_usage(response, prompt_mode, len(documents), len(prompt), time.perf_counter() - started)
+        if LOG_PAYLOADS:
+            logger.info("Insight response for %s: %s", sensor_id, response)
+
         return response, documents
+    except ValueError:
+        raise
     except Exception as e:
         return {str(e)}
 
+async def _fetch_insight_data(sensor_id, prompt_mode, data_format, since, until, limit, resolution="raw"):
+    """Retrieves the readings and returns (prompt template, data string, reading count, sensor_data)."""
+    if resolution != "raw":
+        try:
+            aggregates = await run_stage("sensor_query", get_sensor_rollups, sensor_id,
+                                         since=since, until=until, resolution=resolution)
+        except PyMongoError as e:
+            raise ConnectionError(f"Failed to retrieve sensor data: {e}")
+        if aggregates.readings == 0:
+            raise LookupError("No data available for the specified sensor.")
+        with timed("prompt_build"):
+            prompt_template, data_str = _to_prompt(*build_rollup_insight_data(aggregates, prompt_mode))
+        return prompt_template, data_str, aggregates.readings, _rollup_sensor_data(sensor_id, aggregates, data_format)
+
+    if data_format == "columnar":
+        try:
+            timestamps, columns = await run_stage("sensor_query", get_sensor_columns, sensor_id,
+                                                  since=since, until=until, limit=limit)
+        except PyMongoError as e:
+            raise ConnectionError(f"Failed to retrieve sensor data: {e}")
+        if timestamps.size == 0:
+            raise LookupError("No data available for the specified sensor.")
+        with timed("prompt_build"):
+            prompt_template, data_str = _to_prompt(*build_columnar_insight_data(timestamps, columns, prompt_mode))
+        return prompt_template, data_str, int(timestamps.size), columnar_to_json_dict(to_columnar(sensor_id, timestamps, columns))
+
+    documents = await run_stage("sensor_query", get_sensor_data, sensor_id=sensor_id, since=since, until=until, limit=limit)
+    if isinstance(documents, set):
+        # get_sensor_data reports failures as a set holding the error message
+        raise ConnectionError(f"Failed to retrieve sensor data: {next(iter(documents), '')}")
+    if not documents:
+        raise LookupError("No data available for the specified sensor.")
+    with timed("prompt_build"):
+        prompt_template, data_str = _prepare_insight_prompt(documents, prompt_mode)
+    return prompt_template, data_str, len(documents), documents
+
+async def agenerate_insight(sensor_id=None, prompt_mode=None, since=None, until=None, limit=None, data_format=None,
+                            resolution=None):
+    """
+    Async version of generate_insight for the API routes.
+
+    The Mongo query and the Bedrock call run in worker threads bounded per
+    downstream, so a slow generation does not block the event loop. `since`,
+    `until` and `limit` bound the window of readings that is retrieved.
+
+    With data_format="columnar" the readings are read straight into arrays and
+    returned as {"sensor_id", "timestamps", "metrics"} instead of documents.
+
+    With an "hourly" or "daily" resolution (INSIGHT_RESOLUTION by default) the
+    prompt is built from the rollups and sensor_data holds the bucket means.
+
+    Raises:
+        ValueError: If prompt_mode, data_format or resolution is not supported.
+        LookupError: If there is no data for the sensor.
+        StageTimeoutError: If a stage exceeds its timeout.
+    """
+    prompt_mode = _validate_prompt_mode(prompt_mode)
+    data_format = _validate_data_format(data_format)
+    resolution = _resolve_resolution(resolution, prompt_mode, limit)
+
+    prompt_template, data_str, readings, sensor_data = await _fetch_insight_data(
+        sensor_id, prompt_mode, data_format, since, until, limit, resolution
+    )
+    response = await _ainvoke_insight_llm(sensor_id, prompt_template, data_str, prompt_mode, readings)
+    return response, sensor_data
+
+def _invoke_insight_chain(prompt_template, data_str):
+    # Runs as the llm stage, as the first call imports langchain_aws and creates the chat model
+    return (prompt_template | _get_llm()).invoke({"data": data_str})
+
+async def _ainvoke_insight_llm(sensor_id, prompt_template, data_str, prompt_mode, readings):
+    started = time.perf_counter()
+    response = await run_stage("llm", _invoke_insight_chain, prompt_template, data_str)
+    prompt = prompt_template.format(data=data_str)
+    _log_insight_usage(response, prompt_mode, readings, len(prompt), time.perf_counter() - started)
+    if LOG_PAYLOADS:
+        logger.info("Insight prompt for %s: %s\nResponse: %s", sensor_id, prompt, response)
+    return response
+
+def _insight_cache_key(sensor_id, prompt_mode, data_format, since, until, limit, resolution):
+    return (sensor_id, prompt_mode, data_format, since and since.isoformat(), until and until.isoformat(), limit,
+            resolution)
+
+async def _generated_now(generation):
+    """Awaits an (insights, sensor_data) generation and adds the time it finished."""
+    insights, sensor_data = await generation
+    return insights, sensor_data, datetime.now(timezone.utc)
+
+async def agenerate_cached_insight(sensor_id=None, prompt_mode=None, since=None, until=None, limit=None,
+                                   data_format=None, refresh=False, resolution=None):
+    """
+    agenerate_insight behind the insight cache.
+
+    The cache key is the sensor and every generation parameter; the watermark is
+    the sensor's latest reading in the window, so an insight is regenerated only
+    when new readings arrive or its TTL expires. Identical concurrent requests
+    share one LLM call, and insights pre-generated by the insight scheduler are
+    served from the cache.
+
+    Returns:
+        tuple: (insights, sensor_data, generated_at, cache_status)
+    """
+    prompt_mode = _validate_prompt_mode(prompt_mode)
+    data_format = _validate_data_format(data_format)
+    resolution = _resolve_resolution(resolution, prompt_mode, limit)
+
+    def generate():
+        return _generated_now(agenerate_insight(sensor_id, prompt_mode=prompt_mode, since=since, until=until,
+                                                limit=limit, data_format=data_format, resolution=resolution))
+
+    if not insight_cache.enabled:
+        insights, sensor_data, generated_at = await generate()
+        return insights, sensor_data, generated_at, BYPASS
+
+    try:
+        watermark = await run_stage("sensor_query", get_sensor_watermark, sensor_id, since=since, until=until)
+    except PyMongoError as e:
+        raise ConnectionError(f"Failed to retrieve sensor data: {e}")
+    if watermark is None:
+        raise LookupError("No data available for the specified sensor.")
+
+    key = _insight_cache_key(sensor_id, prompt_mode, data_format, since, until, limit, resolution)
+    (insights, sensor_data, generated_at), status = await insight_cache.get_or_generate(
+        key, watermark, generate, refresh=refresh
+    )
+    return insights, sensor_data, generated_at, status
+
+def insight_view_key(sensor_id, prompt_mode=None, data_format=None, resolution=None):
+    """Returns the insight cache key of a /get_insights request for the default window."""
+    prompt_mode = _validate_prompt_mode(prompt_mode)
+    resolution = _resolve_resolution(resolution, prompt_mode, None)
+    return _insight_cache_key(sensor_id, prompt_mode, _validate_data_format(data_format), None, None, None, resolution)
+
+async def aprecompute_insight(sensor_id, watermark, prompt_mode=None, data_format=None, resolution=None):
+    """
+    Generates the insight of a default-window /get_insights request into the insight cache.
+
+    Used by the insight scheduler; a generation already in flight for the same
+    key and watermark is joined instead of repeated.
+
+    Returns:
+        str: The cache status of the generation ("miss" or "coalesced").
+    """
+    prompt_mode = _validate_prompt_mode(prompt_mode)
+    data_format = _validate_data_format(data_format)
+    resolution = _resolve_resolution(resolution, prompt_mode, None)
+
+    def generate():
+        return _generated_now(agenerate_insight(sensor_id, prompt_mode=prompt_mode, data_format=data_format,
+                                                resolution=resolution))
+
+    key = _insight_cache_key(sensor_id, prompt_mode, data_format, None, None, None, resolution)
+    _, status = await insight_cache.get_or_generate(key, watermark, generate, refresh=True)
+    return status
+
+async def afetch_batch_columns(sensor_ids, since=None, until=None, limit=None):
+    """
+    Retrieves the readings of several sensors with one query, for astream_batch_insights.
+
+    Raises:
+        ConnectionError: If MongoDB cannot be queried.
+        StageTimeoutError: If the query exceeds its timeout.
+    """
+    try:
+        return await run_stage("sensor_query", get_sensors_columns, sensor_ids, since=since, until=until, limit=limit)
+    except PyMongoError as e:
+        raise ConnectionError(f"Failed to retrieve sensor data: {e}")
+
+async def _agenerate_columnar_insight(sensor_id, prompt_mode, timestamps, columns):
+    with timed("prompt_build"):
+        prompt_template, data_str = _to_prompt(*build_columnar_insight_data(timestamps, columns, prompt_mode))
+    response = await _ainvoke_insight_llm(sensor_id, prompt_template, data_str, prompt_mode, int(timestamps.size))
+    return response, columnar_to_json_dict(to_columnar(sensor_id, timestamps, columns))
+
+def astream_batch_insights(sensor_ids, sensor_columns, prompt_mode=None, since=None, until=None, limit=None,
+                           concurrency=BATCH_INSIGHT_CONCURRENCY, fleet_summary=False, include_data=False,
+                           refresh=False):
+    """
+    Returns an async iterator of insights for several sensors, each yielded as soon as it is ready.
+
+    prompt_mode is validated when this is called, so an invalid request fails
+    before a response starts streaming.
+
+    The readings come from afetch_batch_columns, so all sensors share one Mongo
+    query. At most `concurrency` generations run at once; each goes through the
+    insight cache under the same key as a columnar /get_insights request, with
+    the sensor's latest reading as the watermark.
+
+    Yields:
+        dict: {"type": "sensor", "sensor_id", "insights", "generated_at", "cache"[, "sensor_data"]} or
+            {"type": "error", "sensor_id", "detail"} per sensor, in completion order;
+            then {"type": "fleet_summary", "insights"} when fleet_summary is set and
+            finally {"type": "done", "sensors", "failed", "seconds"}.
+
+    Raises:
+        ValueError: If prompt_mode is not supported.
+    """
+    prompt_mode = _validate_prompt_mode(prompt_mode)
+    return _abatch_insight_results(sensor_ids, sensor_columns, prompt_mode, since, until, limit, concurrency,
+                                   fleet_summary, include_data, refresh)
+
+async def _abatch_insight_results(sensor_ids, sensor_columns, prompt_mode, since, until, limit, concurrency,
+                                  fleet_summary, include_data, refresh):
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def generate_one(sensor_id):
+        if sensor_id not in sensor_columns:
+            return {"type": "error", "sensor_id": sensor_id, "detail": "No data available for the specified sensor."}
+        timestamps, columns = sensor_columns[sensor_id]
+        key = _insight_cache_key(sensor_id, prompt_mode, "columnar", since, until, limit, "raw")
+        async with semaphore:
+            try:
+                (insights, sensor_data, generated_at), status = await insight_cache.get_or_generate(
+                    key, int(timestamps[-1]),
+                    lambda: _generated_now(_agenerate_columnar_insight(sensor_id, prompt_mode, timestamps, columns)),
+                    refresh=refresh,
+                )
+            except StageTimeoutError as e:
+                return {"type": "error", "sensor_id": sensor_id, "detail": str(e)}
+            except Exception as e:
+                logger.error("Batch insight for %s failed: %s", sensor_id, e)
+                return {"type": "error", "sensor_id": sensor_id, "detail": "An error occurred while generating insights."}
+        result = {"type": "sensor", "sensor_id": sensor_id, "insights": insights, "generated_at": generated_at,
+                  "cache": status}
+        if include_data:
+            result["sensor_data"] = sensor_data
+        return result
+
+    tasks = [asyncio.ensure_future(generate_one(sensor_id)) for sensor_id in sensor_ids]
+    failed = 0
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            failed += result["type"] == "error"
+            yield result
+    finally:
+        # A client disconnect closes the generator; stop the generations it no longer waits for
+        for task in tasks:
+            task.cancel()
+
+    if fleet_summary and len(sensor_columns) > 0:
+        try:
+            with timed("prompt_build"):
+                prompt_template, data_str = _to_prompt(FLEET_TEMPLATE, summarize_fleet(
+                    {sensor_id: sensor_columns[sensor_id] for sensor_id in sensor_ids if sensor_id in sensor_columns}
+                ))
+            response = await _ainvoke_insight_llm("fleet", prompt_template, data_str, "fleet", len(sensor_columns))
+            yield {"type": "fleet_summary", "insights": response}
+        except StageTimeoutError as e:
+            yield {"type": "error", "sensor_id": None, "detail": str(e)}
+        except Exception as e:
+            logger.error("Fleet summary failed: %s", e)
+            yield {"type": "error", "sensor_id": None, "detail": "An error occurred while generating the fleet summary."}
+
+    yield {"type": "done", "sensors": len(sensor_ids), "failed": failed,
+           "seconds": round(time.perf_counter() - started, 3)}
+
 def generate_rag_query_insight(query=None):
     """Generates insights using data retrieved from MongoDB and LangChain for analysis."""
     try:
@@ -58,5 +484,92 @@ def generate_rag_query_insight(query=None):
         return rag_response
     except Exception as e:
         return {str(e)}
+
+# Result of checking the semantic answer cache for a query; answer is None on a miss, and filters
+# (the query's parsed QueryFilters) None when the cache is disabled
+RagCacheLookup = namedtuple("RagCacheLookup", ["query_embedding", "filters", "partition", "watermark", "answer"])
+
+async def _aembed_query(query):
+    query_embedding = await run_stage("embedding", generate_embedding, query)
+    if not isinstance(query_embedding, list):
+        raise ConnectionError(f"Failed to generate query embedding: {query_embedding}")
+    return query_embedding
+
+async def alookup_rag_answer(query):
+    """
+    Embeds the query and looks for a cached answer to a semantically equivalent query.
+
+    Only queries with the same period and sensor filters are compared, and only
+    answers given since the vector data last changed are reused. The filters are
+    parsed off the event loop, as that may query MongoDB for the known sensor IDs.
+    """
+    query_embedding = await _aembed_query(query)
+    if not answer_cache.enabled:
+        return RagCacheLookup(query_embedding, None, None, None, None)
+
+    filters = await run_stage("vector_search", parse_filters, query)
+    partition = filters.partition
+    try:
+        watermark = await run_stage("vector_search", get_rag_data_watermark)
+    except Exception as e:
+        # The cache is an optimization; without a watermark the query is answered uncached
+        logger.warning("Skipping the answer cache, data watermark unavailable: %s", e)
+        return RagCacheLookup(query_embedding, filters, partition, None, None)
+
+    cached = answer_cache.lookup(partition, query_embedding, watermark)
+    return RagCacheLookup(query_embedding, filters, partition, watermark, cached[0] if cached else None)
+
+def remember_rag_answer(query, lookup, answer):
+    """Stores a generated answer in the semantic answer cache."""
+    if lookup.watermark is not None and answer:
+        answer_cache.store(lookup.partition, query, lookup.query_embedding, answer, lookup.watermark)
+
+def _search_context(query, query_embedding, filters):
+    # Runs as the vector_search stage, so parsing the filters never queries MongoDB on the event loop
+    if filters is None:
+        filters = parse_filters(query)
+    return get_query_results(query, query_embedding=query_embedding, filters=filters), filters
+
+async def abuild_rag_prompt(query, query_embedding=None, filters=None):
+    """Runs the embedding and vector search stages and returns the prompt for Claude.
+
+    `filters` are the query's QueryFilters when already parsed (see alookup_rag_answer).
+    """
+    if query_embedding is None:
+        query_embedding = await _aembed_query(query)
+
+    context_docs, filters = await run_stage("vector_search", _search_context, query, query_embedding, filters)
+    if isinstance(context_docs, dict):
+        raise ConnectionError(f"Vector search failed: {context_docs.get('error')}")
+
+    with timed("prompt_build"):
+        return construct_prompt(query, context_docs=context_docs, filters=filters)
+
+async def agenerate_rag_query_insight(query=None):
+    """
+    Async version of generate_rag_query_insight for the API routes.
+
+    Embedding, vector search and the Claude completion each run as a bounded,
+    timed stage off the event loop. Answers to semantically equivalent queries
+    come from the answer cache without vector search or a Claude call.
+    """
+    lookup = await alookup_rag_answer(query)
+    if lookup.answer is not None:
+        return lookup.answer
+
+    prompt = await abuild_rag_prompt(query, query_embedding=lookup.query_embedding, filters=lookup.filters)
+    rag_response = await run_stage("llm", generate_answer_with_claude, prompt)
+    if isinstance(rag_response, set):
+        # generate_answer_with_claude reports failures as a set holding the error message
+        raise ConnectionError(f"Failed to generate answer: {next(iter(rag_response), '')}")
+
+    if not rag_response:
+        return "Apologies, I don't have an answer to that!"
+    remember_rag_answer(query, lookup, rag_response)
+    return rag_response
+
+def astream_rag_answer(prompt):
+    """Streams Claude's answer to a RAG prompt as an async iterator of text fragments."""
+    return iterate_stage("llm", stream_answer_with_claude, prompt)
     
 # generate_insight("sensone")
\ No newline at end of file
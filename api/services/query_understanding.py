@@ -0,0 +1,216 @@
+# query_understanding.py
+"""Parses the time period and sensors a RAG question is about into typed retrieval filters."""
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+# Half-width of the window around a time of day given with a date ("on 2024-11-14 at 14:00")
+TIME_OF_DAY_WINDOW = timedelta(minutes=30)
+
+_UNIT_SECONDS = {"minute": 60, "min": 60, "hour": 3600, "hr": 3600, "day": 86400, "week": 604800, "month": 2592000}
+_NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "few": 3, "a few": 3, "couple of": 2, "a couple of": 2,
+}
+
+_DATE = r"\d{4}-\d{2}-\d{2}(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?|\d{1,2}/\d{1,2}/\d{4}"
+_RANGE_PATTERN = re.compile(rf"\b(?:between|from)\s+({_DATE})\s+(?:and|to|until|till|through)\s+({_DATE})", re.I)
+_SINCE_PATTERN = re.compile(rf"\b(?:since|after|from)\s+({_DATE})", re.I)
+_UNTIL_PATTERN = re.compile(rf"\b(?:before|until|till|up to)\s+({_DATE})", re.I)
+_DATE_PATTERN = re.compile(rf"\b({_DATE})\b")
+_RELATIVE_PATTERN = re.compile(
+    r"\b(?:last|past|previous|recent)\s+(?:(\d+|a few|a couple of|couple of|few|an?|one|two|three|four|five|six"
+    r"|seven|eight|nine|ten|eleven|twelve)\s+)?(minute|min|hour|hr|day|week|month)(s?)\b",
+    re.I,
+)
+_CALENDAR_PATTERN = re.compile(r"\b(today|yesterday|this\s+week|this\s+month)\b", re.I)
+_TIME_PATTERN = re.compile(r"\bat\s+(\d{1,2}):(\d{2})(?::(\d{2}))?\s*(am|pm)?\b", re.I)
+_SENSOR_PATTERN = re.compile(r"\bsensors?(?:\s+id)?[\s:#]+[\"']?([A-Za-z0-9_-]+)", re.I)
+_TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+
+@dataclass(frozen=True)
+class QueryFilters:
+    """
+    Retrieval filters found in a question.
+
+    since and until are inclusive bounds as naive UTC datetimes, like the stored
+    readings. period is the normalized text of the period that was found (an ISO
+    date or range, or a relative period such as "last 3 hours"), so questions
+    about the same period compare equal even when the window moved with the clock.
+    """
+
+    since: datetime = None
+    until: datetime = None
+    sensor_ids: tuple = ()
+    period: str = None
+
+    def __bool__(self):
+        return self.since is not None or self.until is not None or bool(self.sensor_ids)
+
+    @property
+    def partition(self):
+        """Key of the retrieval scope, empty for unfiltered questions."""
+        parts = []
+        if self.period:
+            parts.append(self.period)
+        if self.sensor_ids:
+            parts.append("sensors:" + ",".join(sorted(self.sensor_ids)))
+        return "|".join(parts)
+
+    def describe(self):
+        """Describes the filters for the prompt, e.g. "2024-11-14 00:00 to 2024-11-14 23:59 UTC for sensone"."""
+        parts = []
+        if self.since is not None and self.until is not None:
+            parts.append(f"{self.since:%Y-%m-%d %H:%M} to {self.until:%Y-%m-%d %H:%M} UTC")
+        elif self.since is not None:
+            parts.append(f"{self.since:%Y-%m-%d %H:%M} UTC onwards")
+        elif self.until is not None:
+            parts.append(f"up to {self.until:%Y-%m-%d %H:%M} UTC")
+        if self.sensor_ids:
+            parts.append("for " + ", ".join(self.sensor_ids))
+        return " ".join(parts)
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _day_start(value):
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _day_end(value):
+    return _day_start(value) + timedelta(days=1) - timedelta(microseconds=1)
+
+
+def _parse_date(text):
+    """Parses an ISO or MM/DD/YYYY date; returns (datetime, whether a time of day was given)."""
+    text = text.strip()
+    if "/" in text:
+        return datetime.strptime(text, "%m/%d/%Y"), False
+    value = datetime.fromisoformat(text.replace(" ", "T"))
+    return value.replace(tzinfo=None), "T" in text or " " in text
+
+
+def _lower_bound(text):
+    return _parse_date(text)[0]
+
+
+def _upper_bound(text):
+    value, has_time = _parse_date(text)
+    return value if has_time else _day_end(value)
+
+
+def _time_of_day(match):
+    hour, minute, second = int(match.group(1)), int(match.group(2)), int(match.group(3) or 0)
+    meridiem = (match.group(4) or "").lower()
+    if meridiem == "pm" and hour < 12:
+        hour += 12
+    elif meridiem == "am" and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59 or second > 59:
+        return None
+    return timedelta(hours=hour, minutes=minute, seconds=second)
+
+
+def _parse_period(query, now):
+    """Returns (since, until, period) for the first period found in the query, or Nones."""
+    try:
+        match = _RANGE_PATTERN.search(query)
+        if match:
+            since, until = _lower_bound(match.group(1)), _upper_bound(match.group(2))
+            return since, until, f"{since.isoformat()}/{until.isoformat()}"
+
+        since_match, until_match = _SINCE_PATTERN.search(query), _UNTIL_PATTERN.search(query)
+        if since_match or until_match:
+            since = _lower_bound(since_match.group(1)) if since_match else None
+            # "before" excludes the given day or instant, "until" includes it
+            until = None
+            if until_match:
+                inclusive = not until_match.group(0).lower().startswith("before")
+                until = (_upper_bound(until_match.group(1)) if inclusive
+                         else _lower_bound(until_match.group(1)) - timedelta(microseconds=1))
+            period = f"{since.isoformat() if since else ''}/{until.isoformat() if until else ''}"
+            return since, until, period
+
+        match = _DATE_PATTERN.search(query)
+        if match:
+            value, has_time = _parse_date(match.group(1))
+            if has_time:
+                return value - TIME_OF_DAY_WINDOW, value + TIME_OF_DAY_WINDOW, value.isoformat()
+            time_match = _TIME_PATTERN.search(query)
+            offset = _time_of_day(time_match) if time_match else None
+            if offset is not None:
+                value += offset
+                return value - TIME_OF_DAY_WINDOW, value + TIME_OF_DAY_WINDOW, value.isoformat()
+            return value, _day_end(value), value.date().isoformat()
+    except ValueError:
+        # A date-shaped string that is not a date (e.g. 2024-13-45) does not filter
+        pass
+
+    match = _RELATIVE_PATTERN.search(query)
+    if match:
+        amount, plural = match.group(1), match.group(3)
+        if amount is None:
+            # "last days" without a number means a few of them
+            amount = "few" if plural else "one"
+        count = int(amount) if amount.isdigit() else _NUMBER_WORDS[" ".join(amount.lower().split())]
+        unit = match.group(2).lower()
+        seconds = count * _UNIT_SECONDS[unit]
+        return now - timedelta(seconds=seconds), None, f"last {seconds}s"
+
+    match = _CALENDAR_PATTERN.search(query)
+    if match:
+        word = " ".join(match.group(1).lower().split())
+        today = _day_start(now)
+        if word == "today":
+            return today, None, today.date().isoformat()
+        if word == "yesterday":
+            yesterday = today - timedelta(days=1)
+            return yesterday, _day_end(yesterday), yesterday.date().isoformat()
+        if word == "this week":
+            start = today - timedelta(days=today.weekday())
+            return start, None, f"week of {start.date().isoformat()}"
+        start = today.replace(day=1)
+        return start, None, f"month of {start.date().isoformat()}"
+    return None, None, None
+
+
+def _parse_sensor_ids(query, known_sensor_ids):
+    """Returns the known sensor IDs named in the query, plus IDs given as "sensor <id>" when none are known."""
+    known = {sensor_id.lower(): sensor_id for sensor_id in known_sensor_ids or ()}
+    found = []
+    for token in _TOKEN_PATTERN.findall(query):
+        sensor_id = known.get(token.lower())
+        if sensor_id is not None and sensor_id not in found:
+            found.append(sensor_id)
+    if not known:
+        for match in _SENSOR_PATTERN.finditer(query):
+            candidate = match.group(1)
+            # "sensor readings" is not an ID; IDs without a known list must contain a digit or separator
+            if re.search(r"[\d_-]", candidate) and candidate not in found:
+                found.append(candidate)
+    return tuple(found)
+
+
+def parse_query_filters(query, known_sensor_ids=None, now=None):
+    """
+    Parses the period and sensors a question is about.
+
+    Recognizes ISO and MM/DD/YYYY dates (optionally with "at HH:MM"), ranges
+    ("between X and Y", "from X to Y"), open ranges ("since X", "before X"),
+    relative periods ("last 3 hours", "past week") and "today", "yesterday",
+    "this week" and "this month". Dates are interpreted as UTC.
+
+    Args:
+        query (str): The user's question.
+        known_sensor_ids (Iterable[str], optional): Sensor IDs to look for in the question.
+        now (datetime, optional): Naive UTC reference time for relative periods.
+
+    Returns:
+        QueryFilters: The filters; falsy when the question has none.
+    """
+    since, until, period = _parse_period(query, now or _utcnow())
+    return QueryFilters(since=since, until=until, sensor_ids=_parse_sensor_ids(query, known_sensor_ids),
+                        period=period)
@@ -0,0 +1,374 @@
+# reindex.py
+"""Resumable re-embedding of the readings into the vector collection, e.g. after changing the embedding model."""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+from api.config import (
+    VECTOR_DB_NAME, VECTOR_COLLECTION_NAME, VECTOR_SEARCH_BACKEND, EMBEDDING_MODEL_ID, REINDEX_BATCH_SIZE,
+    REINDEX_CONCURRENCY, REINDEX_RATE_LIMIT, REINDEX_MAX_RETRIES, REINDEX_RETRY_DELAY, REINDEX_CHECKPOINT_COLLECTION,
+)
+from api.services.answer_cache import answer_cache
+from api.services.ingestion import PROGRESS_INTERVAL, ensure_vector_indexes, reading_text, vector_upserts
+from api.services.load_rag_data import VECTOR_SEARCH_INDEX_NAME, get_embedding_cache, _invoke_embedding_model
+from api.services.mongo_client import mongo_manager, get_readings_collection
+from api.services.vector_index import get_local_vector_index, rebuild_from_collection
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the shadow collection a job builds before it is swapped in as VECTOR_COLLECTION_NAME
+SHADOW_SUFFIX = "_reindex"
+
+# Upper bound in seconds of the backoff between retries
+MAX_RETRY_DELAY = 60.0
+
+READING_PROJECTION = {field: 1 for field in ("id", "sensor_id", "timestamp", "temperature", "humidity", "AQI", "CO2_level")}
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` calls per second on average, in bursts of up to `burst`; thread-safe."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a call is allowed; returns at once when rate is 0."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+@dataclass
+class ReindexStats:
+    readings: int = 0
+    chunks: int = 0
+    embedding_requests: int = 0
+    retries: int = 0
+    elapsed_seconds: float = 0.0
+
+    @property
+    def readings_per_second(self):
+        return self.readings / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def as_dict(self):
+        stats = asdict(self)
+        stats["readings_per_second"] = round(self.readings_per_second, 1)
+        stats["elapsed_seconds"] = round(self.elapsed_seconds, 3)
+        return stats
+
+
+def get_checkpoint_collection():
+    return mongo_manager.get_collection(REINDEX_CHECKPOINT_COLLECTION, VECTOR_DB_NAME)
+
+
+def reindex_status():
+    """Returns the checkpoints of all re-embedding jobs, most recently updated first."""
+    checkpoints = list(get_checkpoint_collection().find().sort("updated_at", -1))
+    for checkpoint in checkpoints:
+        checkpoint["last_id"] = None if checkpoint.get("last_id") is None else str(checkpoint["last_id"])
+    return checkpoints
+
+
+class ReindexJob:
+    """
+    Re-embeds every reading of the readings collection into the vector collection.
+
+    Readings are read in _id order in chunks of batch_size. Each chunk is
+    embedded on one of `concurrency` worker threads (through the embedding
+    cache, so unchanged texts of the current model are not sent to Bedrock)
+    and bulk upserted by reading ID, while the next chunks are read. Embedding
+    requests are limited to rate_limit per second across workers; failed
+    requests and bulk writes are retried max_retries times with exponential
+    backoff and jitter. After each chunk, the _id up to which all chunks are
+    written is checkpointed with the job's counters, so a run after a crash
+    resumes there.
+
+    With shadow, run() only builds VECTOR_COLLECTION_NAME + SHADOW_SUFFIX and
+    leaves the live collection alone; swap() then catches up with the readings
+    ingested since and renames it over the vector collection. Renaming drops
+    the live collection with its Atlas search index, so on Atlas the shadow
+    collection must have its own queryable VECTOR_SEARCH_INDEX_NAME index
+    first. Without shadow, the readings are upserted into the vector
+    collection in place.
+    """
+
+    def __init__(self, shadow=False, batch_size=REINDEX_BATCH_SIZE, concurrency=REINDEX_CONCURRENCY,
+                 rate_limit=REINDEX_RATE_LIMIT, max_retries=REINDEX_MAX_RETRIES, retry_delay=REINDEX_RETRY_DELAY):
+        self.shadow = shadow
+        self.target_name = VECTOR_COLLECTION_NAME + SHADOW_SUFFIX if shadow else VECTOR_COLLECTION_NAME
+        # Checkpoints are kept per target, so a shadow build and an in-place run do not resume each other
+        self.job_id = self.target_name
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.limiter = RateLimiter(rate_limit)
+        self.stats = ReindexStats()
+        self.last_id = None
+        self._stats_lock = threading.Lock()
+        self._prior_seconds = 0.0
+        self._started = None
+
+    def _target(self):
+        return mongo_manager.get_collection(self.target_name, VECTOR_DB_NAME)
+
+    def _retrying(self, call, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call(*args)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(MAX_RETRY_DELAY, self.retry_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                with self._stats_lock:
+                    self.stats.retries += 1
+                logger.warning("%s failed (attempt %d), retrying in %.1fs: %s", call.__name__, attempt + 1, delay, e)
+                time.sleep(delay)
+
+    def _invoke(self, text):
+        self.limiter.acquire()
+        with self._stats_lock:
+            self.stats.embedding_requests += 1
+        return _invoke_embedding_model(text)
+
+    def _embed(self, text):
+        return self._retrying(self._invoke, text)
+
+    def _write(self, operations):
+        return self._target().bulk_write(operations, ordered=False)
+
+    def _process(self, readings):
+        """Embeds and upserts one chunk; returns the number of readings written."""
+        readings = [{field: value for field, value in reading.items() if field != "_id"} for reading in readings]
+        texts = [reading_text(reading) for reading in readings]
+        embeddings = get_embedding_cache().get_many(texts, self._embed)
+        self._retrying(self._write, vector_upserts(readings, texts, embeddings))
+        return len(readings)
+
+    def _chunks(self, after):
+        """Yields chunks of readings with a reading ID, in _id order after `after`, querying one chunk at a time."""
+        readings = get_readings_collection()
+        while True:
+            query = {"id": {"$exists": True}}
+            if after is not None:
+                query["_id"] = {"$gt": after}
+            chunk = list(readings.find(query, READING_PROJECTION).sort("_id", ASCENDING).limit(self.batch_size))
+            if not chunk:
+                return
+            after = chunk[-1]["_id"]
+            yield chunk
+
+    def _save(self, status, last_id, **fields):
+        now = datetime.now(timezone.utc)
+        get_checkpoint_collection().update_one(
+            {"_id": self.job_id},
+            {"$set": {"status": status, "last_id": last_id, "target": self.target_name, "shadow": self.shadow,
+                      "model_id": EMBEDDING_MODEL_ID, "stats": self.stats.as_dict(), "updated_at": now, **fields}},
+            upsert=True,
+        )
+
+    def _resume(self, checkpoint):
+        """Continues an unfinished job from its checkpoint."""
+        if checkpoint.get("model_id") != EMBEDDING_MODEL_ID:
+            raise ValueError(f"Job {self.job_id} was started with {checkpoint.get('model_id')}, "
+                             f"not {EMBEDDING_MODEL_ID}; restart it instead")
+        stats = checkpoint.get("stats", {})
+        self.stats = ReindexStats(**{field: stats.get(field, 0) for field in ReindexStats.__dataclass_fields__})
+        self.last_id = checkpoint.get("last_id")
+        logger.info("Resuming %s after %s: %s", self.job_id, self.last_id, self.stats.as_dict())
+
+    def _resume_point(self, restart):
+        """Sets last_id to the _id to continue after, starting a new job unless an unfinished one can be resumed."""
+        checkpoint = get_checkpoint_collection().find_one({"_id": self.job_id})
+        if checkpoint is not None and checkpoint.get("status") != "completed" and not restart:
+            self._resume(checkpoint)
+            return
+
+        self.stats = ReindexStats()
+        self.last_id = None
+        if self.shadow:
+            self._target().drop()
+        ensure_vector_indexes(self._target())
+        self._save("running", None, started_at=datetime.now(timezone.utc))
+
+    def _elapsed(self):
+        self.stats.elapsed_seconds = self._prior_seconds + time.perf_counter() - self._started
+        return self.stats.elapsed_seconds
+
+    def _walk(self):
+        """Embeds and writes the readings after last_id, checkpointing each contiguous chunk written."""
+        total = get_readings_collection().estimated_document_count()
+        last_report = time.perf_counter()
+        pending = deque()
+        max_pending = self.concurrency * 2
+
+        def collect(future):
+            self.stats.readings += future.result()
+            self.stats.chunks += 1
+            self.last_id = future.last_id
+            self._elapsed()
+            self._save("running", self.last_id)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="reindex") as pool:
+            try:
+                for chunk in self._chunks(self.last_id):
+                    while len(pending) >= max_pending:
+                        collect(pending.popleft())
+                    future = pool.submit(self._process, chunk)
+                    future.last_id = chunk[-1]["_id"]
+                    pending.append(future)
+
+                    now = time.perf_counter()
+                    if now - last_report >= PROGRESS_INTERVAL:
+                        logger.info("Reindex progress: %d/~%d readings, %s", self.stats.readings, total,
+                                    self.stats.as_dict())
+                        last_report = now
+                while pending:
+                    collect(pending.popleft())
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _check_search_index(self):
+        """Raises ValueError unless the shadow collection has a queryable Atlas search index to take over."""
+        if VECTOR_SEARCH_BACKEND != "atlas":
+            return
+        indexes = {index.get("name"): index for index in self._target().list_search_indexes()}
+        index = indexes.get(VECTOR_SEARCH_INDEX_NAME)
+        if index is None or not index.get("queryable"):
+            state = "is not queryable yet" if index else "does not exist"
+            raise ValueError(f"Search index {VECTOR_SEARCH_INDEX_NAME} of {self.target_name} {state}; "
+                             f"create it and wait until it is queryable before swapping")
+
+    def _finish(self, status):
+        """Rebuilds the local index from the live collection and records the job as `status`."""
+        if status == "completed" and VECTOR_SEARCH_BACKEND == "local":
+            rebuild_from_collection(get_local_vector_index(), mongo_manager.get_collection(VECTOR_COLLECTION_NAME, VECTOR_DB_NAME))
+        self._elapsed()
+        self._save(status, self.last_id, finished_at=datetime.now(timezone.utc), error=None)
+        if status == "completed":
+            # Answers generated from the old embeddings; other processes see the changed RAG data watermark
+            answer_cache.clear()
+
+    def _failed(self, error):
+        self._elapsed()
+        try:
+            self._save("failed", self.last_id, error=str(error) or type(error).__name__)
+        except PyMongoError as save_error:
+            logger.error("Saving the checkpoint of %s failed: %s", self.job_id, save_error)
+
+    def run(self, restart=False):
+        """
+        Runs the job to completion, resuming an interrupted run unless restart.
+
+        A shadow job ends with status "built" and is swapped in by swap().
+
+        Returns:
+            ReindexStats: Counters and throughput, including those of resumed runs.
+
+        Raises:
+            ValueError: If the unfinished job used another embedding model.
+            Exception: The error of a chunk that failed all its retries; the job
+                then stops at its last checkpoint and can be resumed.
+        """
+        self._resume_point(restart)
+        self._prior_seconds = self.stats.elapsed_seconds
+        self._started = time.perf_counter()
+        try:
+            self._walk()
+            self._finish("built" if self.shadow else "completed")
+        except BaseException as e:
+            self._failed(e)
+            raise
+
+        logger.info("Reindex %s: %s", "built" if self.shadow else "finished", self.stats.as_dict())
+        return self.stats
+
+    def swap(self):
+        """
+        Swaps a built shadow collection in as the vector collection.
+
+        Readings ingested since the build are embedded first. The rename, which
+        MongoDB does atomically, follows right after, and readings ingested
+        during it are then upserted into the new vector collection.
+
+        Returns:
+            ReindexStats: The job's counters, including the catch-up.
+
+        Raises:
+            ValueError: If this is not a shadow job, there is no unfinished
+                build, it used another embedding model, or (on Atlas) the shadow
+                collection has no queryable search index.
+        """
+        if not self.shadow:
+            raise ValueError("Only a shadow job can be swapped in")
+        checkpoint = get_checkpoint_collection().find_one({"_id": self.job_id})
+        if checkpoint is None or checkpoint.get("status") == "completed":
+            raise ValueError(f"There is no build of {self.target_name} to swap in; run with --shadow first")
+        self._resume(checkpoint)
+        self._check_search_index()
+
+        self._prior_seconds = self.stats.elapsed_seconds
+        self._started = time.perf_counter()
+        try:
+            self._walk()
+            self._target().rename(VECTOR_COLLECTION_NAME, dropTarget=True)
+            logger.info("Swapped %s in as %s", self.target_name, VECTOR_COLLECTION_NAME)
+
+            # Readings ingested between the catch-up and the rename only reached the dropped collection
+            self.target_name = VECTOR_COLLECTION_NAME
+            try:
+                self._walk()
+            finally:
+                self.target_name = self.job_id
+            self._finish("completed")
+        except BaseException as e:
+            self._failed(e)
+            raise
+
+        logger.info("Reindex swapped in: %s", self.stats.as_dict())
+        return self.stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed the readings into the vector collection, resuming an interrupted run.")
+    parser.add_argument("--shadow", action="store_true",
+                        help=f"Build {VECTOR_COLLECTION_NAME}{SHADOW_SUFFIX} without touching the vector collection")
+    parser.add_argument("--swap", action="store_true",
+                        help=f"Catch up the built {VECTOR_COLLECTION_NAME}{SHADOW_SUFFIX} and swap it in")
+    parser.add_argument("--restart", action="store_true", help="Start over instead of resuming")
+    parser.add_argument("--batch-size", type=int, default=REINDEX_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=REINDEX_CONCURRENCY)
+    parser.add_argument("--rate-limit", type=float, default=REINDEX_RATE_LIMIT, help="Embedding requests per second")
+    args = parser.parse_args()
+    if args.swap and args.restart:
+        parser.error("--swap cannot be combined with --restart")
+
+    logging.basicConfig(level=logging.INFO)
+    job = ReindexJob(shadow=args.shadow or args.swap, batch_size=args.batch_size, concurrency=args.concurrency,
+                     rate_limit=args.rate_limit)
+    stats = job.swap() if args.swap else job.run(restart=args.restart)
+    print(json.dumps(stats.as_dict()))
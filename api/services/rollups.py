@@ -0,0 +1,449 @@
+# rollups.py
+"""Per-sensor hourly and daily aggregates of the readings, maintained incrementally and rebuildable from raw data."""
+import argparse
+import itertools
+import json
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import PyMongoError
+
+from api.config import (
+    DB_NAME, ROLLUPS_ENABLED, ROLLUP_SOURCE, ROLLUP_HOURLY_COLLECTION, ROLLUP_DAILY_COLLECTION,
+    ROLLUP_REBUILD_BATCH_SIZE,
+)
+from api.services.data_retrieval import MongoDBRetriever, METRIC_FIELDS, default_since, _epoch_ms, _as_float
+from api.services.ingest_hooks import register_ingest_hook, unregister_ingest_hook, ReadingsTailer
+from api.services.mongo_client import mongo_manager, get_readings_collection
+from api.services.sensor_digest import THRESHOLDS, FIELD_METRICS
+
+logger = logging.getLogger(__name__)
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+# Rollup resolutions, finest first, with their bucket width in milliseconds
+RESOLUTIONS = {"hourly": HOUR_MS, "daily": DAY_MS}
+ROLLUP_COLLECTIONS = {"hourly": ROLLUP_HOURLY_COLLECTION, "daily": ROLLUP_DAILY_COLLECTION}
+
+# Per-metric statistics kept in each bucket; avg is sum / count and std follows from sumsq
+METRIC_STATS = ("count", "sum", "sumsq", "min", "max", "last", "last_at", "above")
+# Integer statistics; last_at is the epoch milliseconds of the metric's last value
+INTEGER_STATS = ("count", "last_at", "above")
+# last_at of a bucket without values of the metric
+NO_TIME = np.iinfo(np.int64).min
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_datetime(epoch_ms):
+    # Naive UTC, as pymongo returns stored dates
+    return _EPOCH + timedelta(milliseconds=int(epoch_ms))
+
+
+@dataclass
+class Aggregates:
+    """
+    Readings aggregated into fixed-width time buckets, as parallel arrays sorted by bucket.
+
+    `buckets`, `first` and `last` are epoch milliseconds (bucket start, first and
+    last reading); `metrics` maps each of METRIC_FIELDS to arrays of METRIC_STATS,
+    with NaN min, max and last (and NO_TIME last_at) where a bucket has no value
+    for the metric.
+    """
+
+    resolution_ms: int
+    buckets: np.ndarray
+    count: np.ndarray
+    first: np.ndarray
+    last: np.ndarray
+    metrics: dict
+
+    @classmethod
+    def empty(cls, resolution_ms):
+        integers = np.empty(0, dtype=np.int64)
+        floats = np.empty(0, dtype=np.float64)
+        metrics = {field: {stat: integers if stat in INTEGER_STATS else floats for stat in METRIC_STATS}
+                   for field in METRIC_FIELDS}
+        return cls(resolution_ms, integers, integers, integers, integers, metrics)
+
+    @property
+    def readings(self):
+        return int(self.count.sum())
+
+    def means(self):
+        """Returns {field: per-bucket mean}, NaN where a bucket has no value for the field."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return {field: np.where(stats["count"] > 0, stats["sum"] / stats["count"], np.nan)
+                    for field, stats in self.metrics.items()}
+
+
+def aggregate_columns(timestamps_ms, columns, resolution_ms, origin_ms=0):
+    """
+    Aggregates columnar readings into buckets of resolution_ms starting at origin_ms.
+
+    Args:
+        timestamps_ms (np.ndarray): Epoch milliseconds of each reading.
+        columns (dict): Maps reading fields to float arrays aligned with the timestamps (NaN when missing).
+
+    Returns:
+        Aggregates: One entry per bucket that has readings.
+    """
+    timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+    if timestamps_ms.size == 0:
+        return Aggregates.empty(resolution_ms)
+    order = np.argsort(timestamps_ms, kind="stable")
+    timestamps_ms = timestamps_ms[order]
+
+    starts = origin_ms + (timestamps_ms - origin_ms) // resolution_ms * resolution_ms
+    buckets, index = np.unique(starts, return_inverse=True)
+    size = buckets.size
+    first = np.full(size, np.iinfo(np.int64).max)
+    np.minimum.at(first, index, timestamps_ms)
+    last = np.full(size, np.iinfo(np.int64).min)
+    np.maximum.at(last, index, timestamps_ms)
+
+    metrics = {}
+    for field in METRIC_FIELDS:
+        values = np.asarray(columns.get(field, np.full(order.size, np.nan)), dtype=np.float64)[order]
+        valid = ~np.isnan(values)
+        valid_index, valid_values = index[valid], values[valid]
+        counts = np.bincount(valid_index, minlength=size)
+        minimum = np.full(size, np.nan)
+        np.fmin.at(minimum, valid_index, valid_values)
+        maximum = np.full(size, np.nan)
+        np.fmax.at(maximum, valid_index, valid_values)
+        # Position of each bucket's latest valid reading (readings are in time order)
+        latest = np.full(size, -1)
+        np.maximum.at(latest, valid_index, np.flatnonzero(valid))
+        metrics[field] = {
+            "count": counts.astype(np.int64),
+            "sum": np.bincount(valid_index, weights=valid_values, minlength=size),
+            "sumsq": np.bincount(valid_index, weights=valid_values * valid_values, minlength=size),
+            "min": minimum,
+            "max": maximum,
+            "last": np.where(latest >= 0, values[np.maximum(latest, 0)], np.nan),
+            "last_at": np.where(latest >= 0, timestamps_ms[np.maximum(latest, 0)], NO_TIME),
+            "above": np.bincount(
+                valid_index, weights=(valid_values > THRESHOLDS[FIELD_METRICS[field]]).astype(np.float64),
+                minlength=size,
+            ).astype(np.int64),
+        }
+    return Aggregates(resolution_ms, buckets, np.bincount(index, minlength=size).astype(np.int64), first, last, metrics)
+
+
+def coarsen(aggregates, width_ms, origin_ms=0):
+    """
+    Combines buckets into wider buckets of width_ms starting at origin_ms.
+
+    The input buckets must be sorted; with width_ms equal to the input
+    resolution this merges entries that share a bucket.
+    """
+    if aggregates.buckets.size == 0:
+        return Aggregates.empty(width_ms)
+    starts = origin_ms + (aggregates.buckets - origin_ms) // width_ms * width_ms
+    buckets, index = np.unique(starts, return_inverse=True)
+    size = buckets.size
+
+    def total(values):
+        return np.bincount(index, weights=values, minlength=size)
+
+    first = np.full(size, np.iinfo(np.int64).max)
+    np.minimum.at(first, index, aggregates.first)
+    last = np.full(size, np.iinfo(np.int64).min)
+    np.maximum.at(last, index, aggregates.last)
+
+    metrics = {}
+    for field, stats in aggregates.metrics.items():
+        minimum = np.full(size, np.nan)
+        np.fmin.at(minimum, index, stats["min"])
+        maximum = np.full(size, np.nan)
+        np.fmax.at(maximum, index, stats["max"])
+        last_at = np.full(size, NO_TIME)
+        np.maximum.at(last_at, index, stats["last_at"])
+        # The entry holding the latest value (the last such entry when times are unknown, as in older rollups)
+        has_latest = (stats["count"] > 0) & (stats["last_at"] == last_at[index])
+        latest = np.full(size, -1)
+        np.maximum.at(latest, index[has_latest], np.flatnonzero(has_latest))
+        metrics[field] = {
+            "count": total(stats["count"]).astype(np.int64),
+            "sum": total(stats["sum"]),
+            "sumsq": total(stats["sumsq"]),
+            "min": minimum,
+            "max": maximum,
+            "last": np.where(latest >= 0, stats["last"][np.maximum(latest, 0)], np.nan),
+            "last_at": last_at,
+            "above": total(stats["above"]).astype(np.int64),
+        }
+    return Aggregates(width_ms, buckets, total(aggregates.count).astype(np.int64), first, last, metrics)
+
+
+def merge(*parts):
+    """Merges aggregates of the same resolution into one, sorted by bucket."""
+    resolution_ms = parts[0].resolution_ms
+    parts = [part for part in parts if part.buckets.size]
+    if not parts:
+        return Aggregates.empty(resolution_ms)
+    order = np.argsort(np.concatenate([part.buckets for part in parts]), kind="stable")
+
+    def joined(arrays):
+        return np.concatenate(arrays)[order]
+
+    combined = Aggregates(
+        resolution_ms,
+        joined([part.buckets for part in parts]),
+        joined([part.count for part in parts]),
+        joined([part.first for part in parts]),
+        joined([part.last for part in parts]),
+        {field: {stat: joined([part.metrics[field][stat] for part in parts]) for stat in METRIC_STATS}
+         for field in METRIC_FIELDS},
+    )
+    return coarsen(combined, resolution_ms)
+
+
+def get_rollup_collection(resolution):
+    return mongo_manager.get_collection(ROLLUP_COLLECTIONS[resolution], DB_NAME)
+
+
+def ensure_rollup_indexes():
+    for resolution in RESOLUTIONS:
+        get_rollup_collection(resolution).create_index(
+            [("sensor_id", ASCENDING), ("bucket", ASCENDING)], name="sensor_id_bucket", unique=True,
+        )
+
+
+def _bucket_updates(sensor_id, aggregates):
+    """Yields the upserts that add aggregates to stored buckets, so batches can be applied in any split and order."""
+    for i, bucket in enumerate(aggregates.buckets):
+        key = {"sensor_id": sensor_id, "bucket": _to_datetime(bucket)}
+        increments = {"count": int(aggregates.count[i])}
+        minimums = {"first": _to_datetime(aggregates.first[i])}
+        maximums = {"last": _to_datetime(aggregates.last[i])}
+        latest = {}
+        for field, stats in aggregates.metrics.items():
+            if not stats["count"][i]:
+                continue
+            increments.update({
+                f"{field}.count": int(stats["count"][i]), f"{field}.sum": float(stats["sum"][i]),
+                f"{field}.sumsq": float(stats["sumsq"][i]), f"{field}.above": int(stats["above"][i]),
+            })
+            minimums[f"{field}.min"] = float(stats["min"][i])
+            maximums[f"{field}.max"] = float(stats["max"][i])
+            if not np.isnan(stats["last"][i]):
+                latest[field] = (float(stats["last"][i]), _to_datetime(stats["last_at"][i]))
+        yield UpdateOne(key, {"$inc": increments, "$min": minimums, "$max": maximums}, upsert=True)
+        for field, (value, last_at) in latest.items():
+            # Only a batch holding a later value of the metric than the stored one sets its last value
+            yield UpdateOne(
+                {**key, "$or": [{f"{field}.last_at": {"$lt": last_at}}, {f"{field}.last_at": {"$exists": False}}]},
+                {"$set": {f"{field}.last": value, f"{field}.last_at": last_at}},
+            )
+
+
+def apply_readings(readings):
+    """
+    Adds reading documents to the hourly and daily rollups (the ingest hook).
+
+    Returns:
+        int: The number of readings applied.
+    """
+    by_sensor = {}
+    for reading in readings:
+        by_sensor.setdefault(reading["sensor_id"], []).append(reading)
+
+    updates = {resolution: [] for resolution in RESOLUTIONS}
+    for sensor_id, rows in by_sensor.items():
+        timestamps = np.array([_epoch_ms(row["timestamp"]) for row in rows], dtype=np.int64)
+        columns = {field: np.array([_as_float(row.get(field)) for row in rows], dtype=np.float64)
+                   for field in METRIC_FIELDS}
+        hourly = aggregate_columns(timestamps, columns, HOUR_MS)
+        updates["hourly"].extend(_bucket_updates(sensor_id, hourly))
+        updates["daily"].extend(_bucket_updates(sensor_id, coarsen(hourly, DAY_MS)))
+
+    for resolution, operations in updates.items():
+        if operations:
+            # Ordered, so a bucket's upsert precedes the update of its last values
+            get_rollup_collection(resolution).bulk_write(operations, ordered=True)
+    return len(readings)
+
+
+def read_rollups(sensor_id, resolution, start_ms=None, end_ms=None):
+    """Returns the stored buckets of a sensor with start_ms <= bucket start < end_ms."""
+    query = {"sensor_id": sensor_id}
+    bucket_range = {}
+    if start_ms is not None:
+        bucket_range["$gte"] = _to_datetime(start_ms)
+    if end_ms is not None:
+        bucket_range["$lt"] = _to_datetime(end_ms)
+    if bucket_range:
+        query["bucket"] = bucket_range
+    documents = list(get_rollup_collection(resolution).find(query, {"_id": 0}).sort("bucket", ASCENDING))
+    if not documents:
+        return Aggregates.empty(RESOLUTIONS[resolution])
+
+    def column(values, dtype=np.float64):
+        return np.array(values, dtype=dtype)
+
+    def stat_column(stats, stat):
+        if stat == "last_at":
+            return column([_epoch_ms(entry["last_at"]) if entry.get("last_at") else NO_TIME for entry in stats], np.int64)
+        if stat in INTEGER_STATS:
+            return column([entry.get(stat, 0) for entry in stats], np.int64)
+        if stat in ("sum", "sumsq"):
+            return column([entry.get(stat, 0.0) for entry in stats])
+        return column([_as_float(entry.get(stat)) for entry in stats])
+
+    metrics = {}
+    for field in METRIC_FIELDS:
+        stats = [document.get(field) or {} for document in documents]
+        metrics[field] = {stat: stat_column(stats, stat) for stat in METRIC_STATS}
+    return Aggregates(
+        RESOLUTIONS[resolution],
+        column([_epoch_ms(document["bucket"]) for document in documents], np.int64),
+        column([document["count"] for document in documents], np.int64),
+        column([_epoch_ms(document["first"]) for document in documents], np.int64),
+        column([_epoch_ms(document["last"]) for document in documents], np.int64),
+        metrics,
+    )
+
+
+def window_aggregates(sensor_id, since=None, until=None, resolution="hourly", retriever=None):
+    """
+    Returns a sensor's readings in [since, until] aggregated at a rollup resolution.
+
+    Buckets that lie entirely inside the window come from the stored rollups.
+    The partial buckets at either edge, including the current one, are built
+    from finer rollups and the raw readings, so the result matches aggregating
+    the raw window exactly while reading at most two buckets' worth of readings.
+    """
+    resolution_ms = RESOLUTIONS[resolution]
+    retriever = retriever or MongoDBRetriever()
+    until_ms = _epoch_ms(until or datetime.now(timezone.utc))
+    since_ms = _epoch_ms(since) if since is not None else None
+    full_end = until_ms // resolution_ms * resolution_ms
+    full_start = None if since_ms is None else -(-since_ms // resolution_ms) * resolution_ms
+
+    if full_start is not None and full_start >= full_end:
+        return _edge_aggregates(sensor_id, since_ms, until_ms, resolution, retriever)
+
+    parts = [read_rollups(sensor_id, resolution, full_start, full_end)]
+    if full_start is not None and since_ms < full_start:
+        parts.append(_edge_aggregates(sensor_id, since_ms, full_start - 1, resolution, retriever))
+    parts.append(_edge_aggregates(sensor_id, full_end, until_ms, resolution, retriever))
+    return merge(*parts)
+
+
+def _edge_aggregates(sensor_id, since_ms, until_ms, resolution, retriever):
+    resolution_ms = RESOLUTIONS[resolution]
+    finer = [name for name, width in RESOLUTIONS.items() if width < resolution_ms]
+    if finer:
+        part = window_aggregates(sensor_id, _to_datetime(since_ms), _to_datetime(until_ms), finer[-1], retriever)
+        return coarsen(part, resolution_ms)
+    timestamps, columns = retriever.retrieve_columns(sensor_id, since=_to_datetime(since_ms), until=_to_datetime(until_ms))
+    return aggregate_columns(timestamps, columns, resolution_ms)
+
+
+def get_sensor_rollups(sensor_id, since=None, until=None, resolution="hourly"):
+    """Returns a sensor's aggregates in the window, which defaults to the last INSIGHT_WINDOW_DAYS days."""
+    return window_aggregates(sensor_id, default_since(since), until, resolution)
+
+
+def rebuild_rollups(sensor_ids=None, since=None, until=None, batch_size=ROLLUP_REBUILD_BATCH_SIZE):
+    """
+    Recomputes the rollups from the readings collection.
+
+    The range is widened to whole UTC days, its stored buckets are deleted and
+    the raw readings are re-applied in batches. Readings ingested into the
+    range while it is rebuilt may be counted twice, so pause ingestion for
+    recent ranges.
+
+    Returns:
+        dict: Readings applied, buckets written per resolution and elapsed seconds.
+    """
+    started = time.perf_counter()
+    ensure_rollup_indexes()
+    start = _to_datetime(_epoch_ms(since) // DAY_MS * DAY_MS) if since is not None else None
+    end = _to_datetime(-(-_epoch_ms(until) // DAY_MS) * DAY_MS) if until is not None else None
+
+    bucket_filter, reading_filter = {}, {}
+    if sensor_ids:
+        bucket_filter["sensor_id"] = reading_filter["sensor_id"] = {"$in": list(sensor_ids)}
+    time_range = {key: value for key, value in (("$gte", start), ("$lt", end)) if value is not None}
+    if time_range:
+        bucket_filter["bucket"] = reading_filter["timestamp"] = time_range
+    for resolution in RESOLUTIONS:
+        get_rollup_collection(resolution).delete_many(bucket_filter)
+
+    projection = {"_id": 0, "sensor_id": 1, "timestamp": 1, **{field: 1 for field in METRIC_FIELDS}}
+    cursor = get_readings_collection().find(reading_filter, projection, batch_size=batch_size).sort(
+        [("sensor_id", ASCENDING), ("timestamp", ASCENDING)]
+    )
+    applied = 0
+    while batch := list(itertools.islice(cursor, batch_size)):
+        applied += apply_readings(batch)
+
+    stats = {"readings": applied}
+    for resolution in RESOLUTIONS:
+        stats[f"{resolution}_buckets"] = get_rollup_collection(resolution).count_documents(bucket_filter)
+    stats["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("Rollup rebuild finished: %s", stats)
+    return stats
+
+
+_tailer = None
+
+
+def start_rollup_maintenance(tail=True):
+    """
+    Keeps the rollups current according to ROLLUP_SOURCE; a no-op unless ROLLUPS_ENABLED.
+
+    With ROLLUP_SOURCE="change_stream" and `tail`, the readings collection is
+    tailed; where change streams are unavailable (standalone servers,
+    time-series collections) the ingest hook is installed instead. Processes
+    that only ingest pass tail=False and leave change streams to the API.
+
+    Returns:
+        str: The active source ("change_stream" or "ingest"), or None.
+    """
+    global _tailer
+    if not ROLLUPS_ENABLED:
+        return None
+    ensure_rollup_indexes()
+    if ROLLUP_SOURCE == "change_stream":
+        if not tail:
+            return None
+        tailer = ReadingsTailer(apply_readings, name="rollup-tailer")
+        try:
+            tailer.start()
+            _tailer = tailer
+            logger.info("Maintaining rollups from the readings change stream")
+            return "change_stream"
+        except (PyMongoError, NotImplementedError) as e:
+            logger.warning("Change streams unavailable, maintaining rollups from ingestion: %s", e)
+    register_ingest_hook(apply_readings)
+    return "ingest"
+
+
+def stop_rollup_maintenance():
+    global _tailer
+    if _tailer is not None:
+        _tailer.stop()
+        _tailer = None
+    unregister_ingest_hook(apply_readings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the hourly and daily rollups from the raw readings.")
+    parser.add_argument("--sensor", action="append", dest="sensor_ids", help="Sensor ID (repeatable; default: all)")
+    parser.add_argument("--since", type=datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.fromisoformat)
+    parser.add_argument("--batch-size", type=int, default=ROLLUP_REBUILD_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = rebuild_rollups(args.sensor_ids, since=args.since, until=args.until, batch_size=args.batch_size)
+    print(json.dumps(result))
@@ -0,0 +1,288 @@
+# sensor_digest.py
+"""Vectorized summarization of a window of sensor readings into a compact prompt digest."""
+import math
+import re
+from datetime import datetime, timezone
+
+import numpy as np
+
+METRICS = ("Temperature", "Humidity", "AQI", "CO2_level")
+UNITS = {"Temperature": "°C", "Humidity": "%", "AQI": "", "CO2_level": "ppm"}
+
+# Readings above these values are counted as exceedances in the digest.
+THRESHOLDS = {"Temperature": 30.0, "Humidity": 70.0, "AQI": 100.0, "CO2_level": 1000.0}
+
+# Digest metric names of the reading fields returned by MongoDBRetriever.retrieve_columns
+FIELD_METRICS = {"temperature": "Temperature", "humidity": "Humidity", "AQI": "AQI", "CO2_level": "CO2_level"}
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+# Upper bound on the number of time buckets rendered, so the digest size does not
+# depend on the length of the window.
+MAX_BUCKETS = 24
+
+_VALUE_PATTERN = re.compile(r"(\w+):\s*(-?\d+(?:\.\d+)?)")
+
+
+def to_epoch_seconds(timestamp):
+    """Converts a datetime (naive values are treated as UTC) or ISO string to epoch seconds."""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+def documents_to_columns(documents):
+    """
+    Converts retrieved LangChain documents into columnar arrays.
+
+    Args:
+        documents (list): Documents whose page_content holds "Metric: value" pairs
+            and whose metadata holds the reading timestamp.
+
+    Returns:
+        tuple: (timestamps, columns) where timestamps is a float64 array of epoch
+            seconds and columns maps each metric in METRICS to a float64 array
+            (NaN where the reading did not report the metric).
+    """
+    count = len(documents)
+    timestamps = np.empty(count, dtype=np.float64)
+    columns = {metric: np.full(count, np.nan) for metric in METRICS}
+    for row, doc in enumerate(documents):
+        timestamps[row] = to_epoch_seconds(doc.metadata["timestamp"])
+        for key, value in _VALUE_PATTERN.findall(doc.page_content):
+            if key in columns:
+                columns[key][row] = float(value)
+    return timestamps, columns
+
+
+def _format_time(epoch_seconds):
+    return datetime.fromtimestamp(epoch_seconds, tz=timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+def _format_value(value):
+    if math.isnan(value):
+        return "n/a"
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def _format_metric_summary(metric, series_min, series_max, mean, std, percentiles, trend, above, count):
+    threshold = THRESHOLDS[metric]
+    unit = UNITS[metric]
+    label = f"{metric} ({unit})" if unit else metric
+    return (
+        f"{label}: min {_format_value(series_min)} | max {_format_value(series_max)} | "
+        f"mean {_format_value(mean)} | std {_format_value(std)} | "
+        + " ".join(f"p{p} {_format_value(v)}" for p, v in zip(PERCENTILES, percentiles))
+        + f" | trend {trend} | above {_format_value(threshold)}: "
+        f"{above} ({100.0 * above / count:.1f}%)"
+    )
+
+
+def _metric_summary(metric, timestamps, values):
+    """Returns a one-line statistical summary of a single metric."""
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return f"{metric}: no readings"
+
+    series = values[valid]
+    hours = (timestamps[valid] - timestamps[valid].min()) / 3600.0
+    percentiles = np.percentile(series, PERCENTILES)
+
+    if series.size > 1 and np.ptp(hours) > 0:
+        slope = np.polyfit(hours, series, 1)[0]
+        trend = f"{slope:+.3f}/h"
+    else:
+        trend = "n/a"
+
+    above = int((series > THRESHOLDS[metric]).sum())
+    return _format_metric_summary(metric, series.min(), series.max(), series.mean(), series.std(),
+                                  percentiles, trend, above, series.size)
+
+
+def _format_bucket_lines(start, width_hours, counts, means):
+    lines = [f"{width_hours}h buckets (mean {'/'.join(METRICS)}, readings):"]
+    for bucket in np.flatnonzero(counts):
+        values = "/".join(_format_value(means[metric][bucket]) for metric in METRICS)
+        lines.append(f"{_format_time(start + bucket * width_hours * 3600.0)}  {values} (n={counts[bucket]})")
+    return lines
+
+
+def _bucket_lines(timestamps, columns, max_buckets):
+    """Returns per-bucket metric means, widening buckets beyond one hour when needed."""
+    start = math.floor(timestamps.min() / 3600.0) * 3600.0
+    span_hours = (timestamps.max() - start) / 3600.0
+    width_hours = max(1, math.ceil((span_hours + 1e-9) / max_buckets))
+    index = ((timestamps - start) // (width_hours * 3600.0)).astype(np.int64)
+    bucket_count = int(index.max()) + 1
+
+    counts = np.bincount(index, minlength=bucket_count)
+    means = {}
+    for metric, values in columns.items():
+        valid = ~np.isnan(values)
+        sums = np.bincount(index, weights=np.where(valid, values, 0.0), minlength=bucket_count)
+        hits = np.bincount(index, weights=valid.astype(np.float64), minlength=bucket_count)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means[metric] = sums / hits
+
+    return _format_bucket_lines(start, width_hours, counts, means)
+
+
+def summarize_readings(timestamps, columns, max_buckets=MAX_BUCKETS):
+    """
+    Builds a bounded-size text digest of a window of readings.
+
+    Args:
+        timestamps (np.ndarray): Epoch seconds of each reading.
+        columns (dict): Maps metric name to an array of values aligned with timestamps.
+        max_buckets (int): Maximum number of time buckets to include.
+
+    Returns:
+        str: The digest, or an empty string when there are no readings.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if timestamps.size == 0:
+        return ""
+
+    order = np.argsort(timestamps, kind="stable")
+    timestamps = timestamps[order]
+    columns = {metric: np.asarray(columns.get(metric, np.full(order.size, np.nan)), dtype=np.float64)[order]
+               for metric in METRICS}
+
+    span_hours = (timestamps[-1] - timestamps[0]) / 3600.0
+    lines = [
+        f"Window: {_format_time(timestamps[0])} to {_format_time(timestamps[-1])} UTC "
+        f"({timestamps.size} readings over {span_hours:.1f}h)"
+    ]
+    lines.extend(_metric_summary(metric, timestamps, columns[metric]) for metric in METRICS)
+    lines.extend(_bucket_lines(timestamps, columns, max_buckets))
+    return "\n".join(lines)
+
+
+def summarize_documents(documents, max_buckets=MAX_BUCKETS):
+    """Builds the digest for a list of retrieved LangChain documents."""
+    timestamps, columns = documents_to_columns(documents)
+    return summarize_readings(timestamps, columns, max_buckets=max_buckets)
+
+
+def summarize_columns(timestamps_ms, columns, max_buckets=MAX_BUCKETS):
+    """Builds the digest for columnar readings (epoch milliseconds and arrays keyed by reading field)."""
+    timestamps = np.asarray(timestamps_ms, dtype=np.float64) / 1000.0
+    metrics = {FIELD_METRICS.get(field, field): values for field, values in columns.items()}
+    return summarize_readings(timestamps, metrics, max_buckets=max_buckets)
+
+
+def summarize_fleet(sensor_columns):
+    """
+    Builds a comparative digest with one row per sensor.
+
+    Args:
+        sensor_columns (dict): Sensor ID to (timestamps_ms, columns keyed by reading field).
+
+    Returns:
+        str: A table of each sensor's reading count, window end, per-metric mean and max,
+            and readings above THRESHOLDS.
+    """
+    header = "sensor | readings | last reading | " + " | ".join(
+        f"{metric} mean/max ({UNITS[metric]})" if UNITS[metric] else f"{metric} mean/max" for metric in METRICS
+    ) + " | above threshold"
+    lines = [header]
+    for sensor_id, (timestamps_ms, columns) in sensor_columns.items():
+        timestamps = np.asarray(timestamps_ms, dtype=np.float64) / 1000.0
+        if timestamps.size == 0:
+            lines.append(f"{sensor_id} | 0 | n/a")
+            continue
+        metrics = {FIELD_METRICS.get(field, field): np.asarray(values, dtype=np.float64)
+                   for field, values in columns.items()}
+        cells, exceeding = [], []
+        for metric in METRICS:
+            values = metrics.get(metric, np.full(timestamps.size, np.nan))
+            valid = values[~np.isnan(values)]
+            if valid.size == 0:
+                cells.append("n/a")
+                continue
+            cells.append(f"{_format_value(valid.mean())}/{_format_value(valid.max())}")
+            above = int((valid > THRESHOLDS[metric]).sum())
+            if above:
+                exceeding.append(f"{metric} {above}")
+        lines.append(
+            f"{sensor_id} | {timestamps.size} | {_format_time(timestamps.max())} | " + " | ".join(cells)
+            + f" | {', '.join(exceeding) or 'none'}"
+        )
+    return "\n".join(lines)
+
+
+def _weighted_percentiles(values, weights, percentiles):
+    order = np.argsort(values, kind="stable")
+    values, cumulative = values[order], np.cumsum(weights[order])
+    positions = np.searchsorted(cumulative, np.asarray(percentiles) / 100.0 * cumulative[-1], side="left")
+    return values[np.minimum(positions, values.size - 1)]
+
+
+def _aggregate_metric_summary(metric, hours, stats):
+    """Returns the summary line of a metric from its bucket aggregates."""
+    has_values = stats["count"] > 0
+    count = int(stats["count"].sum())
+    if not count:
+        return f"{metric}: no readings"
+
+    counts = stats["count"][has_values].astype(np.float64)
+    bucket_means = stats["sum"][has_values] / counts
+    mean = stats["sum"].sum() / count
+    std = math.sqrt(max(0.0, stats["sumsq"].sum() / count - mean * mean))
+    percentiles = _weighted_percentiles(bucket_means, counts, PERCENTILES)
+
+    bucket_hours = hours[has_values]
+    if bucket_hours.size > 1 and np.ptp(bucket_hours) > 0:
+        slope = np.polyfit(bucket_hours, bucket_means, 1, w=np.sqrt(counts))[0]
+        trend = f"{slope:+.3f}/h"
+    else:
+        trend = "n/a"
+
+    return _format_metric_summary(metric, np.nanmin(stats["min"]), np.nanmax(stats["max"]), mean, std,
+                                  percentiles, trend, int(stats["above"].sum()), count)
+
+
+def summarize_aggregates(aggregates, max_buckets=MAX_BUCKETS):
+    """
+    Builds the digest from bucketed aggregates (see api/services/rollups.py) instead of raw readings.
+
+    Counts, min, max, mean, std and exceedances are exact. Percentiles and the
+    trend are estimated from the bucket means, and time buckets are at least
+    as wide as the aggregates' resolution.
+
+    Returns:
+        str: The digest, or an empty string when there are no readings.
+    """
+    if aggregates.buckets.size == 0:
+        return ""
+    first = aggregates.first.min() / 1000.0
+    last = aggregates.last.max() / 1000.0
+    bucket_starts = aggregates.buckets / 1000.0
+    resolution_hours = max(1, aggregates.resolution_ms // (3600 * 1000))
+    # Bucket midpoints, in hours since the first reading
+    hours = (bucket_starts - first) / 3600.0 + resolution_hours / 2.0
+
+    lines = [
+        f"Window: {_format_time(first)} to {_format_time(last)} UTC "
+        f"({aggregates.readings} readings over {(last - first) / 3600.0:.1f}h)"
+    ]
+    metrics = {FIELD_METRICS.get(field, field): stats for field, stats in aggregates.metrics.items()}
+    lines.extend(_aggregate_metric_summary(metric, hours, metrics[metric]) for metric in METRICS)
+
+    start = math.floor(first / (resolution_hours * 3600.0)) * resolution_hours * 3600.0
+    span_hours = (last - start) / 3600.0
+    width_hours = max(1, math.ceil((span_hours + 1e-9) / max_buckets))
+    width_hours = -(-width_hours // resolution_hours) * resolution_hours
+    index = ((bucket_starts - start) // (width_hours * 3600.0)).astype(np.int64)
+    bucket_count = int(index.max()) + 1
+    counts = np.bincount(index, weights=aggregates.count, minlength=bucket_count).astype(np.int64)
+    means = {}
+    for metric, stats in metrics.items():
+        sums = np.bincount(index, weights=stats["sum"], minlength=bucket_count)
+        hits = np.bincount(index, weights=stats["count"], minlength=bucket_count)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means[metric] = sums / hits
+    lines.extend(_format_bucket_lines(start, width_hours, counts, means))
+    return "\n".join(lines)
@@ -0,0 +1,296 @@
+# vector_index.py
+"""In-process vector index over reading embeddings, memory-mapped from disk."""
+import argparse
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import json_util
+
+from api.config import VECTOR_INDEX_PATH
+from api.services.sensor_digest import to_epoch_seconds
+
+logger = logging.getLogger(__name__)
+
+# Fields kept for each indexed reading, matching the Atlas pipeline's projection
+RECORD_FIELDS = ("sensor_id", "timestamp", "temperature", "humidity", "AQI", "CO2_level", "id", "text")
+
+# Rows scored per matrix multiplication, bounding the temporary score matrix
+SEARCH_BLOCK_ROWS = 65536
+
+_NO_TIMESTAMP = np.iinfo(np.int64).min
+
+
+def _timestamp_ms(value):
+    if value is None:
+        return _NO_TIMESTAMP
+    try:
+        return int(to_epoch_seconds(value) * 1000)
+    except (TypeError, ValueError):
+        return _NO_TIMESTAMP
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class LocalVectorIndex:
+    """
+    Cosine top-k search over a contiguous float32 matrix of unit-normalized embeddings.
+
+    The index directory holds vectors.f32 (the row-major matrix, memory-mapped
+    read-only), records.jsonl (one Extended JSON record per row) and meta.json
+    (dimension, row count and the byte length of the records). Appends write
+    to the end of both files, so new readings can be added without rebuilding.
+    meta.json is replaced atomically after both files are written, and rows
+    past its count (left by an interrupted append) are truncated before the
+    next append.
+    """
+
+    def __init__(self, directory=VECTOR_INDEX_PATH):
+        self.directory = directory
+        self._lock = threading.Lock()
+        # Incremented whenever the contents are replaced rather than appended to
+        self.generation = 0
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.dim = None
+        self._records_bytes = 0
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.records = []
+        self.timestamps = np.empty(0, dtype=np.int64)
+        self.sensor_codes = np.empty(0, dtype=np.int32)
+        self.sensor_lookup = {}
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.directory, "vectors.f32")
+
+    @property
+    def _records_path(self):
+        return os.path.join(self.directory, "records.jsonl")
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.directory, "meta.json")
+
+    def __len__(self):
+        return len(self.records)
+
+    def sensor_ids(self):
+        """Returns the IDs of the sensors with indexed readings."""
+        with self._lock:
+            return tuple(sensor_id for sensor_id in self.sensor_lookup if sensor_id)
+
+    def _load(self):
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        records = []
+        with open(self._records_path, "rb") as f:
+            for _, line in zip(range(meta["count"]), f):
+                records.append(json_util.loads(line))
+                self._records_bytes += len(line)
+        self._truncate(len(records))
+        self._map_vectors(len(records))
+        self._index_records(records)
+        logger.info("Loaded local vector index with %d vectors from %s", len(records), self.directory)
+
+    def _truncate(self, count):
+        """Drops rows past the first count from both files, e.g. those of an append interrupted before meta.json."""
+        for path, size in ((self._vectors_path, count * (self.dim or 0) * 4), (self._records_path, self._records_bytes)):
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _write_meta(self, count):
+        # Written to a temporary file and renamed over meta.json, so it is never seen half-written
+        temporary = self._meta_path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"dim": self.dim, "count": count, "records_bytes": self._records_bytes}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self._meta_path)
+
+    def _map_vectors(self, count):
+        if count == 0:
+            self.vectors = np.empty((0, self.dim or 0), dtype=np.float32)
+        else:
+            self.vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+
+    def _index_records(self, records):
+        codes = np.empty(len(records), dtype=np.int32)
+        for row, record in enumerate(records):
+            codes[row] = self.sensor_lookup.setdefault(record.get("sensor_id"), len(self.sensor_lookup))
+        self.records.extend(records)
+        self.sensor_codes = np.concatenate([self.sensor_codes, codes])
+        self.timestamps = np.concatenate(
+            [self.timestamps, np.array([_timestamp_ms(r.get("timestamp")) for r in records], dtype=np.int64)]
+        )
+
+    def clear(self):
+        """Removes all vectors, on disk and in memory."""
+        with self._lock:
+            for path in (self._vectors_path, self._records_path, self._meta_path, self._meta_path + ".tmp"):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._reset()
+            self.generation += 1
+
+    def append(self, embeddings, records):
+        """
+        Appends embeddings and their reading records to the index.
+
+        Args:
+            embeddings (array-like): (n, dim) embedding vectors.
+            records (list[dict]): One reading per embedding; only RECORD_FIELDS are kept.
+        """
+        vectors = _normalize(embeddings)
+        if vectors.ndim != 2 or len(vectors) != len(records):
+            raise ValueError("embeddings must be a 2-D array with one row per record")
+        if len(records) == 0:
+            return
+        records = [{field: record.get(field) for field in RECORD_FIELDS} for record in records]
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {vectors.shape[1]}")
+
+            os.makedirs(self.directory, exist_ok=True)
+            self._truncate(len(self.records))
+            lines = b"".join((json_util.dumps(record) + "\n").encode("utf-8") for record in records)
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(vectors).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._records_path, "ab") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            count = len(self.records) + len(records)
+            self._records_bytes += len(lines)
+            self._write_meta(count)
+
+            self._map_vectors(count)
+            self._index_records(records)
+
+    def _filter_rows(self, sensor_ids=None, since=None, until=None):
+        """Returns the row numbers matching the metadata filters, or None when unfiltered."""
+        if not sensor_ids and since is None and until is None:
+            return None
+        mask = np.ones(len(self.records), dtype=bool)
+        if sensor_ids:
+            codes = [self.sensor_lookup[s] for s in sensor_ids if s in self.sensor_lookup]
+            mask &= np.isin(self.sensor_codes, codes)
+        if since is not None:
+            mask &= self.timestamps >= _timestamp_ms(since)
+        if until is not None:
+            mask &= (self.timestamps <= _timestamp_ms(until)) & (self.timestamps != _NO_TIMESTAMP)
+        return np.flatnonzero(mask)
+
+    def search(self, query_vectors, k, sensor_ids=None, since=None, until=None):
+        """
+        Finds the k most similar rows for each query vector.
+
+        Args:
+            query_vectors (array-like): A (dim,) vector or a (q, dim) batch of vectors.
+            k (int): Number of neighbours per query.
+            sensor_ids (list[str], optional): Only consider readings from these sensors.
+            since, until (datetime or str, optional): Only consider readings in this time range.
+
+        Returns:
+            list[list[tuple[int, float]]]: For each query, (row, cosine similarity) pairs
+                ordered by decreasing similarity.
+        """
+        queries = _normalize(np.atleast_2d(query_vectors))
+        with self._lock:
+            vectors = self.vectors
+            rows = self._filter_rows(sensor_ids, since, until)
+        total = len(vectors) if rows is None else len(rows)
+        if total == 0 or k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, total, SEARCH_BLOCK_ROWS):
+            block_rows = np.arange(start, min(start + SEARCH_BLOCK_ROWS, total))
+            if rows is not None:
+                block_rows = rows[block_rows]
+                block = vectors[block_rows]
+            else:
+                block = vectors[start:start + len(block_rows)]
+            scores = queries @ block.T
+
+            candidate_rows = np.concatenate([best_rows, np.broadcast_to(block_rows, scores.shape)], axis=1)
+            candidate_scores = np.concatenate([best_scores, scores], axis=1)
+            if candidate_scores.shape[1] > k:
+                # Partial selection: only the k best survive to the next block
+                keep = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+                candidate_rows = np.take_along_axis(candidate_rows, keep, axis=1)
+                candidate_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+            best_rows, best_scores = candidate_rows, candidate_scores
+
+        order = np.argsort(-best_scores, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        return [list(zip(r.tolist(), s.tolist())) for r, s in zip(best_rows, best_scores)]
+
+    def get_record(self, row):
+        return self.records[row]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_local_vector_index():
+    """Returns the process-wide local vector index, loading it from VECTOR_INDEX_PATH on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LocalVectorIndex(VECTOR_INDEX_PATH)
+    return _index
+
+
+def rebuild_from_collection(index, collection, batch_size=1000):
+    """Replaces the index contents with every embedded reading in a Mongo vector collection."""
+    index.clear()
+    projection = {field: 1 for field in RECORD_FIELDS}
+    projection.update({"_id": 0, "embedding": 1})
+    embeddings, records = [], []
+    cursor = collection.find({"embedding": {"$exists": True}}, projection, batch_size=batch_size)
+    for doc in cursor:
+        embeddings.append(doc.pop("embedding"))
+        records.append(doc)
+        if len(records) == batch_size:
+            index.append(embeddings, records)
+            embeddings, records = [], []
+    if records:
+        index.append(embeddings, records)
+    return len(index)
+
+
+if __name__ == "__main__":
+    from api.services.mongo_client import get_vector_collection
+
+    parser = argparse.ArgumentParser(description="Build the local vector index from the Mongo vector collection.")
+    parser.add_argument("--path", default=VECTOR_INDEX_PATH, help="Index directory")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    started = datetime.now(timezone.utc)
+    count = rebuild_from_collection(LocalVectorIndex(args.path), get_vector_collection(), args.batch_size)
+    logger.info("Indexed %d vectors into %s in %s", count, args.path, datetime.now(timezone.utc) - started)
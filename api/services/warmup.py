@@ -0,0 +1,145 @@
+# warmup.py
+"""Startup timing report and the optional warm-up of the downstream clients before the first request."""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from anyio import to_thread
+
+from api.config import (
+    WARMUP_ENABLED, WARMUP_MONGO_CONNECTIONS, WARMUP_BEDROCK_REQUEST, WARMUP_TIMEOUT, VECTOR_SEARCH_BACKEND,
+)
+from api.services.mongo_client import mongo_manager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    """
+    Durations of the API's startup phases, from the import of api.main to its first response.
+
+    Phases are module imports, each lifespan step and the warm-up, whose steps
+    run in parallel and are reported individually. All times are in seconds.
+    """
+
+    def __init__(self):
+        self.started = None
+        self.phases = {}
+        self.warmup_steps = {}
+        self.ready_seconds = None
+        self.first_response_seconds = None
+
+    def begin(self, started):
+        """Sets the time.perf_counter() value the report is relative to."""
+        self.started = started
+
+    def _elapsed(self):
+        return None if self.started is None else round(time.perf_counter() - self.started, 4)
+
+    def record(self, phase, seconds):
+        self.phases[phase] = round(seconds, 4)
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def mark_ready(self):
+        self.ready_seconds = self._elapsed()
+        logger.info("API ready %ss after import (%s)", self.ready_seconds,
+                    ", ".join(f"{phase} {seconds}s" for phase, seconds in self.phases.items()))
+
+    def mark_first_response(self):
+        if self.first_response_seconds is None:
+            self.first_response_seconds = self._elapsed()
+            logger.info("First response %ss after import", self.first_response_seconds)
+
+    def as_dict(self):
+        return {
+            "phases": dict(self.phases),
+            "warmup": dict(self.warmup_steps),
+            "ready_seconds": self.ready_seconds,
+            "first_response_seconds": self.first_response_seconds,
+        }
+
+
+startup_report = StartupReport()
+
+
+def _warm_mongo():
+    """Opens WARMUP_MONGO_CONNECTIONS pooled connections and creates the readings indexes."""
+    from api.services.data_retrieval import MongoDBRetriever
+
+    client = mongo_manager.open()
+    # Concurrent pings each check out a connection, so the pool holds that many afterwards
+    connections = max(1, WARMUP_MONGO_CONNECTIONS)
+    with ThreadPoolExecutor(connections) as executor:
+        list(executor.map(lambda _: client.admin.command("ping"), range(connections)))
+    MongoDBRetriever()
+
+
+def _warm_bedrock():
+    from api.services.load_rag_data import warm_up_bedrock
+
+    warm_up_bedrock(send_request=WARMUP_BEDROCK_REQUEST)
+
+
+def _warm_llm():
+    from api.services.prompt_handler import prepare_llm
+
+    prepare_llm()
+
+
+def _warm_vector_index():
+    from api.services.vector_index import get_local_vector_index
+
+    get_local_vector_index()
+
+
+def _warm_encoders():
+    # Loads pyarrow for the first Arrow response
+    import pyarrow
+
+
+def warmup_steps():
+    """Returns the warm-up steps for this configuration as {name: blocking function}."""
+    steps = {"mongo": _warm_mongo, "bedrock": _warm_bedrock, "llm": _warm_llm, "encoders": _warm_encoders}
+    if VECTOR_SEARCH_BACKEND == "local":
+        steps["vector_index"] = _warm_vector_index
+    return steps
+
+
+async def _run_step(name, step):
+    started = time.perf_counter()
+    try:
+        await to_thread.run_sync(step)
+        startup_report.warmup_steps[name] = round(time.perf_counter() - started, 4)
+    except Exception as e:
+        # A failed step only costs the first request that needs it the same setup
+        startup_report.warmup_steps[name] = None
+        logger.warning("Warm-up step %s failed: %s", name, e)
+
+
+async def warm_up(timeout=WARMUP_TIMEOUT, enabled=WARMUP_ENABLED):
+    """
+    Runs the warm-up steps in parallel worker threads, waiting at most timeout seconds.
+
+    Steps still running at the timeout finish in the background. Failures are
+    logged and never fail startup.
+
+    Returns:
+        bool: Whether the warm-up ran (it is off unless WARMUP_ENABLED).
+    """
+    if not enabled:
+        return False
+    with startup_report.phase("warmup"):
+        tasks = [asyncio.ensure_future(_run_step(name, step)) for name, step in warmup_steps().items()]
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+    if pending:
+        logger.warning("Warm-up did not finish within %gs; %d steps continue in the background", timeout, len(pending))
+    return True
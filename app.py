@@ -1,23 +1,42 @@
 import streamlit as st
 from components.sensor_form import sensor_form
 from components.insight_display import display_insights
-from components.sensor_charts import plot_sensor_data
-from utils import fetch_insights_from_api, fetch_rag_response_from_api
+from components.sensor_charts import (build_chart_figures, draw_chart_figures, latest_chart_timestamp, append_live_readings,
+                                     plot_sensor_series)
+from utils import (fetch_insights_from_api, fetch_chart_data_from_api, fetch_anomalies_from_api,
+                   stream_rag_response_from_api, follow_sensor_stream)
 from typing import List, Dict
 
 # Constants
 VIEW_SENSOR_INSIGHTS = "View Sensor Insights"
 CHAT_WITH_SENSOR_DATA = "Chat with Sensor Data"
+LIVE_CHARTS = "Downsampled, live"
+RAW_READINGS_CHART = "All readings (WebGL)"
 USER_AVATAR = "😎"
 ASSISTANT_AVATAR = "🤖"
 MAX_CHAT_HISTORY = 50  # Adjust as needed
-
-def display_sensor_insights(sensor_id: str) -> None:
+CHART_POINTS = 600  # Points per chart; roughly the drawable width of a chart in pixels
+LIVE_REFRESH_SECONDS = 2  # How often the charts pick up readings pushed by the API
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_sensor_charts() -> None:
+    """Draws the charts in session state, adding the readings the API pushed since they were fetched."""
+    live = st.session_state.live_charts
+    stream = live["stream"]
+    stream.ensure_running(since=live["latest"])
+    batches, live["cursor"] = stream.read(live["cursor"])
+    live["latest"] = append_live_readings(live["figures"], batches, after=live["latest"])
+    draw_chart_figures(live["figures"])
+    if stream.error:
+        st.caption(stream.error)
+
+def display_sensor_insights(sensor_id: str, chart_style: str = LIVE_CHARTS) -> None:
     """
     Display insights and sensor data visualizations.
     
     Args:
         sensor_id (str): The ID of the sensor.
+        chart_style (str): LIVE_CHARTS or RAW_READINGS_CHART.
     """
     with st.spinner("Fetching sensor insights..."):
         try:
@@ -27,15 +46,30 @@ def display_sensor_insights(sensor_id: str) -> None:
             # print(insights_data)
 
             insights = insights_data.get("insights")
-            plot_data = insights_data.get("sensor_data")
             
             st.session_state.insights = insights_data.get("insights")  # Save insights in session
 
             # Display insights
-            display_insights(insights)
-
-            # Plot sensor data and visualizations
-            plot_sensor_data(plot_data, sensor_id)
+            display_insights(insights, insights_data.get("generated_at"))
+
+            if chart_style == RAW_READINGS_CHART:
+                # Every reading in one figure, built once per sensor and window; zooming stays in the browser
+                plot_sensor_series(sensor_id, anomalies=fetch_anomalies_from_api(sensor_id))
+                return
+
+            # Plot sensor data downsampled server-side to what the charts can draw, with detected anomalies marked
+            chart_data = fetch_chart_data_from_api(sensor_id, CHART_POINTS)
+            if not isinstance(chart_data, dict):
+                st.error(chart_data or "Failed to fetch chart data.")
+                return
+            # The charts then follow the sensor's new readings without refetching them
+            st.session_state.live_charts = {
+                "figures": build_chart_figures(chart_data, sensor_id, anomalies=fetch_anomalies_from_api(sensor_id)),
+                "latest": latest_chart_timestamp(chart_data),
+                "stream": follow_sensor_stream(sensor_id),
+                "cursor": 0,
+            }
+            live_sensor_charts()
         except AttributeError as ae:
             st.error(f"Sensor ID not found!")
         except Exception as e:
@@ -65,11 +99,9 @@ def chat_with_sensor_data():
             # Display user message
             message_container.chat_message("user", avatar=USER_AVATAR).markdown(prompt)
 
-            # Get and display assistant response
+            # Get and display assistant response, rendering tokens as they arrive
             with message_container.chat_message("assistant", avatar=ASSISTANT_AVATAR):
-                with st.spinner("Give me a moment..."):
-                    response = fetch_rag_response_from_api(prompt)
-                st.markdown(response)
+                response = st.write_stream(stream_rag_response_from_api(prompt))
 
             # Add assistant response to chat history
             st.session_state.chat_history.append({"role": "assistant", "content": response})
@@ -101,9 +133,10 @@ def main():
     )
 
     if action == VIEW_SENSOR_INSIGHTS:
+        chart_style = st.sidebar.radio("Charts", (LIVE_CHARTS, RAW_READINGS_CHART))
         sensor_id = sensor_form()
         if sensor_id:
-            display_sensor_insights(sensor_id)
+            display_sensor_insights(sensor_id, chart_style)
     elif action == CHAT_WITH_SENSOR_DATA:
         chat_with_sensor_data()
 
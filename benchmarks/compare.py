@@ -0,0 +1,86 @@
+# compare.py
+"""
+Compares two benchmark result files and flags latency and throughput regressions.
+
+    python -m benchmarks.compare benchmarks/results/baseline.json benchmarks/results/candidate.json
+
+Exits with status 1 when any metric regressed by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+THROUGHPUT_METRICS = ("throughput_rps", "throughput_records_per_second")
+
+
+def _change(baseline, candidate):
+    if not baseline:
+        return None
+    return (candidate - baseline) / baseline
+
+
+def compare(baseline, candidate, threshold):
+    """
+    Returns one row per metric present in both reports.
+
+    Returns:
+        list[dict]: {"metric", "baseline", "candidate", "change", "regression"} where
+            change is relative, and regression means slower latency or lower throughput
+            by more than threshold.
+    """
+    rows = []
+
+    def add(metric, old, new, higher_is_better):
+        change = _change(old, new)
+        worse = change is not None and (-change if higher_is_better else change) > threshold
+        rows.append({"metric": metric, "baseline": old, "candidate": new, "change": change, "regression": worse})
+
+    for name, old in baseline.get("scenarios", {}).items():
+        new = candidate.get("scenarios", {}).get(name)
+        if new is None or "skipped" in old or "skipped" in new:
+            continue
+        for metric in THROUGHPUT_METRICS:
+            if metric in old and metric in new:
+                add(f"{name}.{metric}", old[metric], new[metric], higher_is_better=True)
+        if "latency" in old and "latency" in new:
+            for metric in LATENCY_METRICS:
+                if metric in old["latency"] and metric in new["latency"]:
+                    add(f"{name}.{metric}", old["latency"][metric], new["latency"][metric], higher_is_better=False)
+        for stage, old_stats in old.get("stages", {}).items():
+            new_stats = new.get("stages", {}).get(stage, {})
+            for metric in LATENCY_METRICS:
+                if metric in old_stats and metric in new_stats:
+                    add(f"{name}.{stage}.{metric}", old_stats[metric], new_stats[metric], higher_is_better=False)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    if baseline.get("meta", {}).get("parameters") != candidate.get("meta", {}).get("parameters"):
+        print("Warning: the runs used different parameters")
+
+    rows = compare(baseline, candidate, args.threshold)
+    width = max((len(row["metric"]) for row in rows), default=0)
+    for row in rows:
+        change = "n/a" if row["change"] is None else f"{row['change']:+.1%}"
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['metric']:<{width}}  {row['baseline']:>12}  {row['candidate']:>12}  {change:>8}{flag}")
+
+    regressions = [row for row in rows if row["regression"]]
+    print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# fakes.py
+"""Stand-ins for the Bedrock runtime client and the ChatBedrock LLM with configurable latency."""
+import hashlib
+import io
+import json
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+ANSWER_WORDS = (
+    "Readings were stable over the period with temperature near the weekly mean, humidity within its usual "
+    "range and CO2 levels elevated during the afternoon peaks. AQI exceeded the threshold briefly before "
+    "returning to normal levels."
+).split()
+
+
+@dataclass
+class FakeLatency:
+    """Latency model of a fake model call: a fixed delay plus generation time at a token rate."""
+
+    embedding_seconds: float = 0.02
+    llm_seconds: float = 0.3
+    tokens_per_second: float = 200.0
+    answer_tokens: int = 120
+
+    def generation_delay(self):
+        return self.answer_tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+
+def fake_embedding(text, dim):
+    """Returns a deterministic unit vector for a text, so identical texts embed identically."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def fake_answer(tokens):
+    return " ".join(ANSWER_WORDS[i % len(ANSWER_WORDS)] for i in range(tokens))
+
+
+class FakeBedrockClient:
+    """
+    Implements the parts of the bedrock-runtime client used by load_rag_data.
+
+    Embedding requests return deterministic vectors after embedding_seconds;
+    Claude requests return a fixed answer after llm_seconds plus the generation
+    time of answer_tokens at tokens_per_second, streamed token by token when the
+    response-stream API is used.
+    """
+
+    def __init__(self, latency, embedding_dim=1536):
+        self.latency = latency
+        self.embedding_dim = embedding_dim
+
+    @staticmethod
+    def _response(payload):
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8"))}
+
+    def invoke_model(self, modelId, body, contentType=None, accept=None):
+        request = json.loads(body)
+        if "inputText" in request:
+            time.sleep(self.latency.embedding_seconds)
+            return self._response({"embedding": fake_embedding(request["inputText"], self.embedding_dim)})
+        time.sleep(self.latency.llm_seconds + self.latency.generation_delay())
+        return self._response({"completion": fake_answer(self.latency.answer_tokens)})
+
+    def invoke_model_with_response_stream(self, modelId, body, contentType=None, accept=None):
+        def events():
+            time.sleep(self.latency.llm_seconds)
+            per_token = self.latency.generation_delay() / max(1, self.latency.answer_tokens)
+            for word in fake_answer(self.latency.answer_tokens).split():
+                time.sleep(per_token)
+                yield {"chunk": {"bytes": json.dumps({"completion": f" {word}"}).encode("utf-8")}}
+
+        return {"body": events()}
+
+
+def fake_chat_model(latency):
+    """Returns a runnable that stands in for ChatBedrock in prompt_template | llm chains."""
+    def invoke(prompt_value):
+        prompt = prompt_value.to_string()
+        time.sleep(latency.llm_seconds + latency.generation_delay())
+        return AIMessage(
+            content=fake_answer(latency.answer_tokens),
+            usage_metadata={
+                "input_tokens": len(prompt) // 4,
+                "output_tokens": latency.answer_tokens,
+                "total_tokens": len(prompt) // 4 + latency.answer_tokens,
+            },
+        )
+
+    return RunnableLambda(invoke)
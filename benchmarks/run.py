@@ -0,0 +1,518 @@
+# run.py
+"""
+Offline benchmark of the API hot paths against a Mongo stand-in and a fake Bedrock.
+
+Loads sensor_data.txt (optionally replicated into more sensors), ingests it,
+then drives /get_insights, /get_rag_query and /get_sensor_series in-process at
+the requested concurrency. Reports throughput and p50/p95/p99 latencies per
+scenario and per stage, and writes them as JSON for benchmarks/compare.py.
+
+    python -m benchmarks.run --concurrency 16 --requests 200
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ("ingest", "insights", "rag_query", "rag_retrieval", "sensor_reads", "charts", "cold_start")
+
+RAG_QUERIES = (
+    "how are the readings?",
+    "how are readings today",
+    "what was the highest CO2 level?",
+    "was the air quality bad on 2024-11-14?",
+    "is the temperature rising for senstwo?",
+    "summarize humidity over the last days",
+)
+
+# Questions with a period or sensor filter; {day} is yesterday and {sensor} one of the fixture's sensors
+FILTERED_RAG_QUERIES = (
+    "how was the air quality in the last 3 hours?",
+    "what was the highest CO2 level yesterday?",
+    "was the air quality bad on {day}?",
+    "is the temperature rising for {sensor}?",
+    "how did humidity change for {sensor} between {day} and {today}?",
+    "how are the readings today?",
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the API with a Mongo stand-in and a fake Bedrock.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent requests per scenario")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--fixture", default=os.path.join(ROOT, "sensor_data.txt"))
+    parser.add_argument("--replicate", type=int, default=1,
+                        help="Copies of the fixture, each under its own sensor IDs")
+    parser.add_argument("--mongo-uri", help="Use a local MongoDB instead of the in-memory mongomock stand-in")
+    parser.add_argument("--embedding-latency", type=float, default=0.02, help="Seconds per fake embedding call")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds before a fake completion starts")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Fake completion token rate")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="Tokens per fake completion")
+    parser.add_argument("--embedding-dim", type=int, default=1536)
+    parser.add_argument("--with-caches", action="store_true",
+                        help="Keep the insight and answer caches enabled (they are disabled to time full generations)")
+    parser.add_argument("--cold-starts", type=int, default=5, help="API processes started by the cold_start scenario")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<UTC time>.json)")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args, index_dir):
+    """Points the app's settings at the stand-ins; must run before any api module is imported."""
+    os.environ.update({
+        "MONGO_URI": args.mongo_uri or "mongodb://localhost:27017",
+        "MONGO_TLS": "false",
+        "DB_NAME": "benchmark",
+        "COLLECTION_NAME": "readings",
+        "VECTOR_DB_NAME": "benchmark",
+        "VECTOR_COLLECTION_NAME": "reading_vectors",
+        "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+        # Atlas $search is not available locally
+        "VECTOR_SEARCH_BACKEND": "local",
+        "VECTOR_INDEX_PATH": index_dir,
+        "EMBEDDING_CACHE_BACKEND": "none",
+        "INSIGHT_WINDOW_DAYS": "0",
+    })
+    if not args.with_caches:
+        os.environ.update({"INSIGHT_CACHE_TTL": "0", "ANSWER_CACHE_TTL": "0"})
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def load_fixture(path, replicate):
+    """Parses the fixture and shifts it to end now, adding a suffixed copy of every sensor per replica."""
+    from api.services.ingestion import parse_text_records
+
+    with open(path, encoding="utf-8") as f:
+        records = list(parse_text_records(f))
+    # Readings are stored as naive UTC datetimes
+    shift = datetime.now(timezone.utc).replace(tzinfo=None) - max(record["timestamp"].replace(tzinfo=None) for record in records)
+    readings = []
+    for copy in range(replicate):
+        suffix = f"_{copy}" if copy else ""
+        for record in records:
+            readings.append({
+                **record,
+                "sensor_id": record["sensor_id"] + suffix,
+                "id": record["id"] + suffix,
+                "timestamp": record["timestamp"].replace(tzinfo=None) + shift,
+            })
+    return readings
+
+
+def latency_summary(seconds):
+    """Returns count and latency percentiles in milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds) * 1000.0
+    p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+    return {
+        "count": int(ms.size),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+class StageRecorder:
+    """Collects per-stage durations by wrapping the functions a scenario calls."""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self._patches = []
+
+    def record(self, stage, seconds):
+        self.durations[stage].append(seconds)
+
+    def patch(self, module, name, stage=None):
+        """Times module.name; async run_stage-style functions are timed per stage name."""
+        original = getattr(module, name)
+        if asyncio.iscoroutinefunction(original):
+            async def timed(stage_name, *args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await original(stage_name, *args, **kwargs)
+                finally:
+                    self.record(stage or stage_name, time.perf_counter() - started)
+        else:
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.record(stage or name, time.perf_counter() - started)
+        setattr(module, name, timed)
+        self._patches.append((module, name, original))
+
+    def restore(self):
+        for module, name, original in reversed(self._patches):
+            setattr(module, name, original)
+        self._patches.clear()
+
+    def summary(self):
+        return {stage: latency_summary(seconds) for stage, seconds in sorted(self.durations.items())}
+
+
+async def drive(client, requests, concurrency, on_response=None):
+    """Sends requests with at most `concurrency` in flight and returns latencies, errors and wall time."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], defaultdict(int)
+
+    async def send(path, params, headers):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.get(path, params=params, headers=headers)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors[str(response.status_code)] += 1
+                elif on_response is not None:
+                    on_response(response)
+            except Exception:
+                errors["exception"] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(path, params, headers) for path, params, headers in requests))
+    return latencies, dict(errors), time.perf_counter() - started
+
+
+def scenario_result(latencies, errors, wall_seconds, recorder):
+    return {
+        "requests": len(latencies) + errors.get("exception", 0),
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        "latency": latency_summary(latencies),
+        "stages": recorder.summary(),
+    }
+
+
+def run_ingest(records):
+    from api.services import ingestion
+
+    recorder = StageRecorder()
+    recorder.patch(ingestion, "insert_readings")
+    recorder.patch(ingestion, "embed_and_upsert")
+    try:
+        stats = ingestion.ingest_records(records)
+    finally:
+        recorder.restore()
+    return {
+        "records": stats.records_read,
+        "wall_seconds": round(stats.elapsed_seconds, 3),
+        "throughput_records_per_second": round(stats.records_per_second, 1),
+        "ingest": stats.as_dict(),
+        "stages": recorder.summary(),
+    }
+
+
+async def run_insights(client, sensors, args):
+    from api.services import prompt_handler
+
+    recorder = StageRecorder()
+    recorder.patch(prompt_handler, "run_stage")
+    requests = [("/api/v1/get_insights", {"sensor_id": sensors[i % len(sensors)], "format": "columnar"}, None)
+                for i in range(args.requests)]
+    try:
+        result = await drive(client, requests, args.concurrency)
+    finally:
+        recorder.restore()
+    return scenario_result(*result, recorder)
+
+
+async def run_rag_query(client, args):
+    from api.services import prompt_handler
+
+    recorder = StageRecorder()
+    recorder.patch(prompt_handler, "run_stage")
+    recorder.patch(prompt_handler, "construct_prompt", stage="context_packing")
+    requests = [("/api/v1/get_rag_query", {"query": RAG_QUERIES[i % len(RAG_QUERIES)]}, None)
+                for i in range(args.requests)]
+    try:
+        result = await drive(client, requests, args.concurrency)
+    finally:
+        recorder.restore()
+    return scenario_result(*result, recorder)
+
+
+def run_rag_retrieval(sensors, args):
+    """
+    Times the vector search for filtered questions with the filters pushed into
+    the search (adaptive k) and with VECTOR_SEARCH_K candidates post-filtered.
+
+    The pre-filtered run is reported as the scenario latency, both runs as stages,
+    with the k, candidates fetched and results kept per question.
+    """
+    from api.services import load_rag_data
+
+    today = datetime.now(timezone.utc).date()
+    queries = [query.format(sensor=sensors[i % len(sensors)], day=(today - timedelta(days=1)).isoformat(),
+                            today=today.isoformat())
+               for i, query in enumerate(FILTERED_RAG_QUERIES)]
+    embeddings = load_rag_data.generate_embeddings(queries)
+
+    recorder = StageRecorder()
+    candidates = {}
+    for mode, prefilter in (("post_filter", False), ("prefilter", True)):
+        ks, fetched, kept = [], [], []
+        for i in range(args.requests):
+            started = time.perf_counter()
+            retrieval = load_rag_data.retrieve_context(queries[i % len(queries)], embeddings[i % len(queries)],
+                                                       prefilter=prefilter)
+            recorder.record(mode, time.perf_counter() - started)
+            ks.append(retrieval.k)
+            fetched.append(retrieval.candidates)
+            kept.append(len(retrieval.documents))
+        candidates[mode] = {
+            "k_mean": round(float(np.mean(ks)), 1),
+            "candidates_mean": round(float(np.mean(fetched)), 1),
+            "results_mean": round(float(np.mean(kept)), 1),
+        }
+
+    seconds = recorder.durations["prefilter"]
+    return {
+        "requests": len(seconds),
+        "errors": {},
+        "wall_seconds": round(sum(seconds), 3),
+        "throughput_rps": round(len(seconds) / sum(seconds), 2) if sum(seconds) else 0.0,
+        "latency": latency_summary(seconds),
+        "stages": recorder.summary(),
+        "candidates": candidates,
+    }
+
+
+def run_sensor_reads(sensors, args):
+    """
+    Times reading the last day of a sensor as columns and as documents from
+    MongoDB and from the hot window store (after it loaded each sensor once).
+
+    Store reads are reported as the scenario latency, both sources as stages.
+    """
+    from api.services.data_retrieval import get_sensor_columns, get_sensor_data
+    from api.services.hot_store import hot_store
+
+    since = datetime.now(timezone.utc) - timedelta(days=1)
+    recorder = StageRecorder()
+    enabled, window_ms = hot_store.enabled, hot_store.window_ms
+    # The benchmark reads whole histories by default (INSIGHT_WINDOW_DAYS=0), so the store holds two days
+    hot_store.window_ms = 2 * 24 * 3600 * 1000
+    try:
+        for source, use_store in (("mongo", False), ("hot_store", True)):
+            hot_store.enabled = use_store
+            for sensor_id in sensors:
+                get_sensor_columns(sensor_id, since=since)
+            for i in range(args.requests):
+                sensor_id = sensors[i % len(sensors)]
+                started = time.perf_counter()
+                get_sensor_columns(sensor_id, since=since)
+                recorder.record(f"{source}_columns", time.perf_counter() - started)
+                started = time.perf_counter()
+                get_sensor_data(sensor_id, since=since)
+                recorder.record(f"{source}_documents", time.perf_counter() - started)
+    finally:
+        hot_store.clear()
+        hot_store.enabled, hot_store.window_ms = enabled, window_ms
+
+    seconds = recorder.durations["hot_store_columns"]
+    return {
+        "requests": len(seconds),
+        "errors": {},
+        "wall_seconds": round(sum(seconds), 3),
+        "throughput_rps": round(len(seconds) / sum(seconds), 2) if sum(seconds) else 0.0,
+        "latency": latency_summary(seconds),
+        "stages": recorder.summary(),
+    }
+
+
+async def run_charts(client, sensors, args):
+    """Fetches sensor series (Arrow and JSON alternately) and times decoding and plotting them, per metric and as one WebGL figure."""
+    import pyarrow as pa
+    from api.routes import charts
+
+    try:
+        from utils import sensor_series_to_dataframe
+        from components.sensor_charts import plot_sensor_data
+    except ImportError as e:
+        return {"skipped": f"Streamlit front end not importable: {e}"}
+
+    recorder = StageRecorder()
+    recorder.patch(charts, "run_stage")
+    arrow = "application/vnd.apache.arrow.stream"
+
+    requests = [("/api/v1/get_sensor_series", {"sensor_id": sensors[i % len(sensors)]},
+                 {"Accept": arrow if i % 2 == 0 else "application/json"})
+                for i in range(args.requests)]
+    responses = []
+    try:
+        result = await drive(client, requests, args.concurrency, on_response=responses.append)
+    finally:
+        recorder.restore()
+
+    # Client-side work is timed after the requests, so it does not hold up the server's event loop
+    for response in responses:
+        started = time.perf_counter()
+        if response.headers["content-type"].startswith(arrow):
+            df = pa.ipc.open_stream(response.content).read_pandas()
+            recorder.record("decode_arrow", time.perf_counter() - started)
+        else:
+            df = sensor_series_to_dataframe(response.json())
+            recorder.record("decode_json", time.perf_counter() - started)
+        started = time.perf_counter()
+        plot_sensor_data(df, "benchmark")
+        recorder.record("plot_sensor_data", time.perf_counter() - started)
+        started = time.perf_counter()
+        plot_sensor_data(df, "benchmark", webgl=True)
+        recorder.record("plot_sensor_figure", time.perf_counter() - started)
+    return scenario_result(*result, recorder)
+
+
+# Runs in a fresh interpreter: imports the API, starts it and sends one request
+COLD_START_SCRIPT = """
+import json
+from api.main import app
+from api.services.warmup import startup_report
+from fastapi.testclient import TestClient
+
+with TestClient(app) as client:
+    client.get("/")
+print(json.dumps(startup_report.as_dict()))
+"""
+
+
+def run_cold_start(args):
+    """Starts the API in new processes and reports the time from importing it to its first response."""
+    first_responses, phases = [], defaultdict(list)
+    for _ in range(args.cold_starts):
+        completed = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], cwd=ROOT, capture_output=True,
+                                   text=True, check=True)
+        report = json.loads(completed.stdout.strip().splitlines()[-1])
+        first_responses.append(report["first_response_seconds"])
+        for phase, seconds in {**report["phases"], **report["warmup"]}.items():
+            if seconds is not None:
+                phases[phase].append(seconds)
+    return {
+        "latency": latency_summary(first_responses),
+        "stages": {phase: latency_summary(seconds) for phase, seconds in sorted(phases.items())},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    from benchmarks.fakes import FakeBedrockClient, FakeLatency, fake_chat_model
+    from api.services import load_rag_data, prompt_handler
+    from api.services.mongo_client import mongo_manager
+
+    if not args.mongo_uri:
+        import mongomock
+        mongo_manager._client = mongomock.MongoClient()
+
+    latency = FakeLatency(args.embedding_latency, args.llm_latency, args.tokens_per_second, args.answer_tokens)
+    load_rag_data.bedrock_client = FakeBedrockClient(latency, args.embedding_dim)
+    prompt_handler._get_llm = lambda: fake_chat_model(latency)
+
+    import httpx
+    from api.main import app
+
+    records = load_fixture(args.fixture, args.replicate)
+    sensors = sorted({record["sensor_id"] for record in records})
+    results = {}
+
+    # Ingestion always runs, since the other scenarios read the ingested data
+    results["ingest"] = run_ingest(records)
+    if "ingest" not in args.scenarios:
+        del results["ingest"]
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        if "insights" in args.scenarios:
+            results["insights"] = await run_insights(client, sensors, args)
+        if "rag_query" in args.scenarios:
+            results["rag_query"] = await run_rag_query(client, args)
+        if "rag_retrieval" in args.scenarios:
+            results["rag_retrieval"] = run_rag_retrieval(sensors, args)
+        if "sensor_reads" in args.scenarios:
+            results["sensor_reads"] = run_sensor_reads(sensors, args)
+        if "charts" in args.scenarios:
+            results["charts"] = await run_charts(client, sensors, args)
+    if "cold_start" in args.scenarios:
+        results["cold_start"] = run_cold_start(args)
+    return results, len(records)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    index_dir = tempfile.mkdtemp(prefix="benchmark-vector-index-")
+    configure_environment(args, index_dir)
+    logging.basicConfig(level=logging.WARNING)
+
+    # The services print whole result sets; keep that out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        results, record_count = asyncio.run(run(args))
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "records": record_count,
+            "mongo": "mongodb" if args.mongo_uri else "mongomock",
+            "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "mongo_uri")},
+        },
+        "scenarios": results,
+    }
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results",
+                                         datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, result in results.items():
+        if "skipped" in result:
+            print(f"{name}: skipped ({result['skipped']})")
+            continue
+        if "throughput_rps" in result:
+            summary = result["latency"]
+            print(f"{name}: {result['throughput_rps']} req/s, p50 {summary.get('p50_ms')} ms, "
+                  f"p95 {summary.get('p95_ms')} ms, p99 {summary.get('p99_ms')} ms, errors {result['errors']}")
+        elif "latency" in result:
+            summary = result["latency"]
+            print(f"{name}: p50 {summary.get('p50_ms')} ms, p95 {summary.get('p95_ms')} ms, "
+                  f"max {summary.get('max_ms')} ms over {summary['count']} runs")
+        else:
+            print(f"{name}: {result['throughput_records_per_second']} records/s over {result['records']} records")
+        for stage, stats in result.get("stages", {}).items():
+            print(f"  {stage}: n={stats['count']} p50 {stats.get('p50_ms')} ms, p95 {stats.get('p95_ms')} ms, "
+                  f"p99 {stats.get('p99_ms')} ms")
+        for mode, counts in result.get("candidates", {}).items():
+            print(f"  {mode} candidates: k {counts['k_mean']}, {counts['candidates_mean']} fetched, "
+                  f"{counts['results_mean']} results")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
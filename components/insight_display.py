@@ -1,10 +1,12 @@
 # components/insights_display.py
 import streamlit as st
 
-def display_insights(insights):
+def display_insights(insights, generated_at=None):
     """Displays the insights received from the API"""
     if insights:
         st.subheader("Sensor Insights")
+        if generated_at:
+            st.caption(f"Generated at {generated_at}")
         content = insights.get("content", "No insights available.")
         st.markdown(content)
 
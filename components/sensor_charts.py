@@ -1,45 +1,65 @@
 # components/sensor_charts.py
 import streamlit as st
 import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 import pandas as pd
 import numpy as np
-import re
+from utils import sensor_series_to_dataframe, fetch_sensor_series_from_api
 
-def plot_sensor_data(data, sensor_id):
-    """Plots sensor data and trends using Plotly, with separate charts for each metric."""
-    # Log raw data for debugging
-    print("Raw data received:", data)
+# Horizontal pixels a chart is drawn across; series are decimated to about this many points per trace
+CHART_WIDTH = 1200
+# Pixel columns kept per drawn pixel, so ranges zoomed into by up to this factor still show every extreme
+DECIMATION_OVERSAMPLE = 4
 
-    if data is None or len(data) == 0:
-        st.warning("No data available to plot.")
+def _add_anomaly_markers(fig, anomalies, metric, utc=False, row=None):
+    """Marks a metric's anomalies (from fetch_anomalies_from_api) on a chart, or on a row of a subplot figure.
+
+    Payloads other than a list of anomalies are ignored.
+    """
+    if not isinstance(anomalies, list):
+        return
+    points = [anomaly for anomaly in anomalies if anomaly.get("metric") == metric]
+    if not points:
         return
+    fig.add_trace(go.Scatter(
+        x=pd.to_datetime([anomaly["timestamp"] for anomaly in points], unit="ms", utc=utc),
+        y=[anomaly["value"] for anomaly in points],
+        mode="markers", marker=dict(color="red", size=9, symbol="x"), name="anomaly",
+        text=[", ".join(anomaly["reasons"]) for anomaly in points],
+        hovertemplate="%{x}<br>%{y}<br>%{text}<extra>anomaly</extra>",
+    ), row=row, col=None if row is None else 1)
 
-    # Parse data into a structured DataFrame
-    parsed_data = []
-    for item in data:
-        try:
-            timestamp = item.get("metadata", {}).get("timestamp")
-            page_content = item.get("page_content", "")
-            
-            # Extract sensor values using regex
-            matches = re.findall(r"(\w+):\s([\d.]+)", page_content)
-            sensor_values = {key.lower(): float(value) for key, value in matches}
-            
-            parsed_data.append({"timestamp": timestamp, **sensor_values})
-        except Exception as e:
-            print(f"Error processing item: {item}, Error: {e}")
-            continue
 
-    # Convert parsed data into a DataFrame
-    if not parsed_data:
-        st.error("Failed to parse sensor data.")
+def plot_sensor_data(data, sensor_id, anomalies=None, webgl=False):
+    """Plots sensor data and trends using Plotly, with separate charts for each metric.
+
+    `data` is a DataFrame with a timestamp column and one column per metric (as
+    returned by fetch_sensor_series_from_api), or a columnar sensor_data payload.
+    `anomalies` (from fetch_anomalies_from_api) are marked on their metric's chart.
+    With webgl, all metrics are drawn decimated in one figure (see build_sensor_figure).
+    """
+    if isinstance(data, dict):
+        data = sensor_series_to_dataframe(data)
+    if not isinstance(data, pd.DataFrame):
+        st.error(data or "Failed to fetch sensor data.")
         return
+    if data.empty:
+        st.warning("No data available to plot.")
+        return
+
+    df = data
 
-    df = pd.DataFrame(parsed_data)
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    if webgl:
+        fig = build_sensor_figure(df, sensor_id, anomalies)
+        if fig is None:
+            st.warning("No valid metrics found in the data.")
+        else:
+            st.plotly_chart(fig, use_container_width=True)
+        return
 
     # Check for available metrics
-    metrics = [col for col in df.columns if col != "timestamp"]
+    metrics = [col for col in df.columns if col != "timestamp" and df[col].notna().any()]
     if not metrics:
         st.warning("No valid metrics found in the data.")
         return
@@ -58,7 +78,190 @@ def plot_sensor_data(data, sensor_id):
             labels={"timestamp": "Time", metric: metric.capitalize()},
             color_discrete_sequence=color
         )
+        _add_anomaly_markers(fig, anomalies, metric, utc=True)
         st.plotly_chart(fig)
 
 
+def decimate(values, buckets):
+    """Returns the indexes of the minimum and maximum of each of `buckets` equal runs of values, in order.
+
+    Series of at most 2 * buckets values are kept whole. NaN values are skipped,
+    so runs without a value contribute no points.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if buckets <= 0 or values.size <= 2 * buckets:
+        return np.flatnonzero(~np.isnan(values))
+    size = -(-values.size // buckets)
+    padded = np.full(size * buckets, np.nan)
+    padded[:values.size] = values
+    runs = padded.reshape(buckets, size)
+    missing = np.isnan(runs)
+    lows = np.argmin(np.where(missing, np.inf, runs), axis=1)
+    highs = np.argmax(np.where(missing, -np.inf, runs), axis=1)
+    offsets = np.arange(buckets) * size
+    present = ~missing.all(axis=1)
+    return np.unique(np.concatenate((lows[present] + offsets[present], highs[present] + offsets[present])))
+
+def build_sensor_figure(df, sensor_id, anomalies=None, width=CHART_WIDTH):
+    """Builds one figure of a sensor's readings, a WebGL line per metric in rows sharing the time axis.
 
+    Each metric is decimated to the minimum and maximum of width * DECIMATION_OVERSAMPLE
+    runs of readings, so the figure stays the same size however long the series
+    is. Zooming, panning and the range buttons all stay in the browser.
+
+    Returns:
+        plotly.graph_objects.Figure: The figure, or None when no metric has values.
+    """
+    metrics = [col for col in df.columns if col != "timestamp" and df[col].notna().any()]
+    if not metrics:
+        return None
+
+    color_palette = px.colors.qualitative.Plotly
+    fig = make_subplots(rows=len(metrics), cols=1, shared_xaxes=True, vertical_spacing=0.04,
+                        subplot_titles=[metric.capitalize() for metric in metrics])
+    timestamps = df["timestamp"]
+    for i, metric in enumerate(metrics):
+        kept = decimate(df[metric].to_numpy(dtype=np.float64, na_value=np.nan), width * DECIMATION_OVERSAMPLE)
+        fig.add_trace(go.Scattergl(x=timestamps.iloc[kept], y=df[metric].iloc[kept], mode="lines",
+                                   line=dict(color=color_palette[i % len(color_palette)]), name=metric),
+                      row=i + 1, col=1)
+        _add_anomaly_markers(fig, anomalies, metric, utc=True, row=i + 1)
+
+    fig.update_xaxes(row=len(metrics), col=1, title_text="Time", rangeselector=dict(buttons=[
+        dict(count=1, label="1h", step="hour", stepmode="backward"),
+        dict(count=6, label="6h", step="hour", stepmode="backward"),
+        dict(count=1, label="1d", step="day", stepmode="backward"),
+        dict(count=7, label="7d", step="day", stepmode="backward"),
+        dict(step="all"),
+    ]))
+    # uirevision keeps the selected range across Streamlit reruns
+    fig.update_layout(title=f"Readings (Sensor ID: {sensor_id})", height=220 * len(metrics) + 80, showlegend=False,
+                      hovermode="x unified", uirevision=sensor_id)
+    return fig
+
+@st.cache_resource(ttl=60, max_entries=32)
+def sensor_series_figure(sensor_id, since=None, until=None, limit=None, anomalies=None, width=CHART_WIDTH):
+    """Fetches a sensor's readings in a window and builds their figure once per sensor, window and width.
+
+    The cached figure is shared by reruns and sessions and must not be modified.
+
+    Raises:
+        ValueError: With the error message when the readings could not be fetched.
+    """
+    data = fetch_sensor_series_from_api(sensor_id, since=since, until=until, limit=limit)
+    if not isinstance(data, pd.DataFrame):
+        # Errors are raised rather than returned, so they are not cached
+        raise ValueError(data or "Failed to fetch sensor data.")
+    return build_sensor_figure(data, sensor_id, anomalies, width)
+
+def plot_sensor_series(sensor_id, since=None, until=None, limit=None, anomalies=None, width=CHART_WIDTH):
+    """Plots a sensor's raw readings as one WebGL figure, built once and reused across reruns."""
+    try:
+        fig = sensor_series_figure(sensor_id, since=since, until=until, limit=limit, anomalies=anomalies, width=width)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    if fig is None:
+        st.warning("No data available to plot.")
+        return
+    st.plotly_chart(fig, use_container_width=True)
+
+# Pushed readings a chart's live trace keeps; older ones drop off its start
+LIVE_MAX_POINTS = 5000
+
+def build_chart_figures(chart_data, sensor_id, anomalies=None):
+    """Builds the figures of server-side downsampled series from /get_chart_data, one per metric.
+
+    `anomalies` (from fetch_anomalies_from_api) are marked at their raw values, so
+    they remain visible where downsampling averaged them away. Metrics without
+    points are left out.
+    """
+    color_palette = px.colors.qualitative.Plotly
+    method = chart_data.get("method")
+    figures = {}
+
+    for i, (metric, series) in enumerate(chart_data.get("metrics", {}).items()):
+        color = color_palette[i % len(color_palette)]
+        title = f"{metric.capitalize()} Over Time (Sensor ID: {sensor_id})"
+
+        if method == "bucket":
+            timestamps = pd.to_datetime(chart_data.get("timestamps", []), unit="ms")
+            if len(timestamps) == 0:
+                continue
+            fig = go.Figure([
+                # Shaded band between each bucket's min and max, with the average on top
+                go.Scatter(x=timestamps, y=series["max"], mode="lines", line=dict(width=0), showlegend=False, hoverinfo="skip"),
+                go.Scatter(x=timestamps, y=series["min"], mode="lines", line=dict(width=0), fill="tonexty",
+                           fillcolor="rgba(128, 128, 128, 0.2)", name="min–max"),
+                go.Scatter(x=timestamps, y=series["avg"], mode="lines", line=dict(color=color), name="average"),
+            ])
+        else:
+            timestamps = pd.to_datetime(series.get("timestamps", []), unit="ms")
+            if len(timestamps) == 0:
+                continue
+            fig = go.Figure(go.Scatter(x=timestamps, y=series["values"], mode="lines", line=dict(color=color), name=metric))
+
+        _add_anomaly_markers(fig, anomalies, metric)
+        fig.update_layout(title=title, xaxis_title="Time", yaxis_title=metric.capitalize())
+        figures[metric] = fig
+
+    return figures
+
+def draw_chart_figures(figures):
+    """Draws the figures of build_chart_figures."""
+    for fig in figures.values():
+        st.plotly_chart(fig)
+    if not figures:
+        st.warning("No data available to plot.")
+
+def plot_chart_data(chart_data, sensor_id, anomalies=None):
+    """Plots server-side downsampled series from /get_chart_data, one chart per metric."""
+    if not isinstance(chart_data, dict):
+        st.error(chart_data or "Failed to fetch chart data.")
+        return
+    draw_chart_figures(build_chart_figures(chart_data, sensor_id, anomalies))
+
+def latest_chart_timestamp(chart_data):
+    """Returns the epoch millisecond time of the latest point in /get_chart_data series, or None."""
+    if chart_data.get("method") == "bucket":
+        timestamps = chart_data.get("timestamps") or []
+    else:
+        timestamps = [ts for series in chart_data.get("metrics", {}).values() for ts in series.get("timestamps", [])]
+    return max(timestamps) if timestamps else None
+
+def append_live_readings(figures, batches, after=None):
+    """Adds pushed readings newer than `after` (epoch ms) to the figures' live traces.
+
+    `batches` are columnar sensor_data payloads from the /sensor_stream. Each
+    figure gets a dotted "live" trace after its series, holding at most
+    LIVE_MAX_POINTS readings.
+
+    Returns:
+        The epoch millisecond time of the latest reading added, or `after`.
+    """
+    color_palette = px.colors.qualitative.Plotly
+    latest = after
+    points = {metric: ([], []) for metric in figures}
+    for batch in batches:
+        for index, ts in enumerate(batch.get("timestamps", [])):
+            if after is not None and ts <= after:
+                continue
+            latest = ts if latest is None else max(latest, ts)
+            for metric, (xs, ys) in points.items():
+                values = batch.get("metrics", {}).get(metric)
+                if values is not None:
+                    xs.append(ts)
+                    ys.append(values[index])
+
+    for i, (metric, fig) in enumerate(figures.items()):
+        xs, ys = points[metric]
+        if not xs:
+            continue
+        trace = next((trace for trace in fig.data if trace.name == "live"), None)
+        if trace is None:
+            color = color_palette[i % len(color_palette)]
+            fig.add_trace(go.Scatter(x=[], y=[], mode="lines", line=dict(color=color, dash="dot"), name="live"))
+            trace = fig.data[-1]
+        trace.x = (tuple(trace.x) + tuple(pd.to_datetime(xs, unit="ms")))[-LIVE_MAX_POINTS:]
+        trace.y = (tuple(trace.y) + tuple(ys))[-LIVE_MAX_POINTS:]
+    return latest
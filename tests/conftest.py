@@ -0,0 +1,36 @@
+# conftest.py
+"""Shared test setup: settings pointing at in-memory stand-ins, and a mongomock client."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must be set before any api module is imported, as api.config reads them at import
+os.environ.update({
+    "MONGO_URI": "mongodb://localhost:27017",
+    "MONGO_TLS": "false",
+    "DB_NAME": "test",
+    "COLLECTION_NAME": "readings",
+    "VECTOR_DB_NAME": "test",
+    "VECTOR_COLLECTION_NAME": "reading_vectors",
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "VECTOR_SEARCH_BACKEND": "local",
+    "EMBEDDING_CACHE_BACKEND": "none",
+})
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Replaces the shared MongoDB client with an empty in-memory mongomock client."""
+    mongomock = pytest.importorskip("mongomock")
+    from api.services.data_retrieval import MongoDBRetriever
+    from api.services.mongo_client import mongo_manager
+
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mongo_manager, "_client", client)
+    monkeypatch.setattr(MongoDBRetriever, "_ensured_collections", set())
+    return client
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from api.services.anomalies import AnomalyDetector
+
+
+def _series(n=500, seed=7):
+    """A noisy daily cycle at one-minute intervals, with spikes and a fast drift."""
+    rng = np.random.default_rng(seed)
+    timestamps = 1_700_000_000_000 + np.arange(n, dtype=np.int64) * 60_000
+    values = 22 + 3 * np.sin(np.arange(n) / 60) + rng.normal(0, 0.3, n)
+    values[[120, 260, 261, 400]] += [9.0, -7.5, 8.0, 12.0]
+    values[300:310] += np.linspace(0, 6, 10)
+    values[[50, 51, 350]] = np.nan
+    return timestamps, values
+
+
+def _streamed(detector, field, timestamps, values, state=None):
+    state = state or detector.new_state()
+    anomalies = [detector.observe(state, field, t, v) for t, v in zip(timestamps.tolist(), values.tolist())
+                 if not np.isnan(v)]
+    return [anomaly for anomaly in anomalies if anomaly is not None], state
+
+
+def _key(anomalies):
+    return [(a["timestamp"], a["metric"], tuple(a["reasons"])) for a in anomalies]
+
+
+@pytest.mark.parametrize("field", ["temperature", "CO2_level"])
+def test_vectorized_scoring_flags_the_streamed_anomalies(field):
+    detector = AnomalyDetector(alpha=0.1, z_threshold=3.0, window=30, min_readings=10,
+                               rate_limits={"temperature": 2.0}, rate_min_interval=30)
+    timestamps, values = _series()
+
+    streamed, _ = _streamed(detector, field, timestamps, values)
+    vectorized, _ = detector.score_metric(field, timestamps, values)
+
+    assert streamed
+    assert _key(vectorized) == _key(streamed)
+    for fast, slow in zip(vectorized, streamed):
+        assert fast["score"] == pytest.approx(slow["score"], abs=1e-3)
+        assert fast["expected"] == pytest.approx(slow["expected"], abs=1e-3)
+
+
+def test_scoring_in_windows_continues_from_the_state():
+    detector = AnomalyDetector(alpha=0.1, z_threshold=3.0, window=30, min_readings=10,
+                               rate_limits={"temperature": 2.0})
+    timestamps, values = _series()
+
+    whole, _ = detector.score_metric("temperature", timestamps, values)
+    first, state = detector.score_metric("temperature", timestamps[:250], values[:250])
+    second, state = detector.score_metric("temperature", timestamps[250:], values[250:], state)
+    streamed, _ = _streamed(detector, "temperature", timestamps[250:], values[250:],
+                            detector.score_metric("temperature", timestamps[:250], values[:250])[1])
+
+    assert _key(first + second) == _key(whole)
+    assert _key(second) == _key(streamed)
+    assert state.count == np.count_nonzero(~np.isnan(values))
+
+
+def test_score_columns_orders_anomalies_by_time():
+    detector = AnomalyDetector(alpha=0.1, z_threshold=3.0, window=30, min_readings=10, rate_limits={})
+    timestamps, values = _series()
+    anomalies, states = detector.score_columns(timestamps, {"temperature": values, "humidity": values * 2})
+
+    assert set(states) == {"temperature", "humidity"}
+    assert [(a["timestamp"], a["metric"]) for a in anomalies] == sorted((a["timestamp"], a["metric"]) for a in anomalies)
+
+
+def test_alpha_must_be_a_fraction():
+    with pytest.raises(ValueError):
+        AnomalyDetector(alpha=1.0)
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from api.services import answer_cache as answer_cache_module
+from api.services.answer_cache import SemanticAnswerCache
+
+
+def _unit(seed, dim=16):
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return vector / np.linalg.norm(vector)
+
+
+def _near(vector, seed, distance=0.05):
+    """A vector whose cosine similarity to `vector` is above 0.99."""
+    return vector + distance * _unit(seed, len(vector))
+
+
+@pytest.fixture
+def cache():
+    return SemanticAnswerCache(max_entries=3, ttl=60, threshold=0.95)
+
+
+def test_similar_queries_reuse_the_answer(cache):
+    query = _unit(1)
+    cache.store("2024-11-14", "what was the temperature?", query, "about 22 degrees", watermark=1)
+
+    answer, similarity = cache.lookup("2024-11-14", _near(query, 2), watermark=1)
+
+    assert answer == "about 22 degrees"
+    assert similarity > 0.95
+    assert cache.lookup("2024-11-14", _unit(3), watermark=1) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_partitions_are_never_compared(cache):
+    query = _unit(1)
+    cache.store("2024-11-14", "readings on 2024-11-14", query, "answer", watermark=1)
+    assert cache.lookup("2024-11-13", query, watermark=1) is None
+    assert cache.lookup("", query, watermark=1) is None
+
+
+def test_a_changed_watermark_invalidates_the_entry(cache):
+    query = _unit(1)
+    cache.store("", "query", query, "old answer", watermark=(1, 100))
+
+    assert cache.lookup("", query, watermark=(2, 100)) is None
+    assert cache.stats()["invalidated"] == 1
+    # The stale entry is gone even when the old watermark comes back
+    assert cache.lookup("", query, watermark=(1, 100)) is None
+
+
+def test_entries_expire_after_the_ttl(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache_module.time, "monotonic", lambda: now[0])
+    cache.store("", "query", _unit(1), "answer", watermark=1)
+
+    now[0] += 59
+    assert cache.lookup("", _unit(1), watermark=1) is not None
+    now[0] += 1
+    assert cache.lookup("", _unit(1), watermark=1) is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_the_least_recently_used_entry_is_evicted(cache):
+    for seed in range(3):
+        cache.store("", f"query {seed}", _unit(seed), f"answer {seed}", watermark=1)
+    assert cache.lookup("", _unit(0), watermark=1)[0] == "answer 0"
+
+    cache.store("", "query 3", _unit(3), "answer 3", watermark=1)
+
+    assert cache.lookup("", _unit(1), watermark=1) is None
+    assert [cache.lookup("", _unit(seed), watermark=1)[0] for seed in (0, 2, 3)] == ["answer 0", "answer 2", "answer 3"]
+    assert cache.stats()["evictions"] == 1 and cache.stats()["entries"] == 3
+
+
+def test_clear_and_disabled_cache(cache):
+    cache.store("", "query", _unit(1), "answer", watermark=1)
+    cache.clear()
+    assert cache.lookup("", _unit(1), watermark=1) is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["partitions"] == 0
+
+    disabled = SemanticAnswerCache(max_entries=3, ttl=0)
+    disabled.store("", "query", _unit(1), "answer", watermark=1)
+    assert not disabled.enabled
+    assert disabled.lookup("", _unit(1), watermark=1) is None
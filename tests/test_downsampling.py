@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from api.services import downsampling
+from api.services.downsampling import bucket_series, lttb_indices, lttb_series
+
+
+def _reference_lttb(x, y, threshold):
+    """The textbook per-point LTTB, with the same bucket edges as lttb_indices."""
+    count = len(x)
+    edges = np.floor(np.linspace(1, count - 1, threshold - 1)).astype(int)
+    selected, previous = [0], 0
+    for bucket in range(threshold - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_lo, next_hi = edges[bucket + 1], edges[bucket + 2]
+            avg_x, avg_y = np.mean(x[next_lo:next_hi]), np.mean(y[next_lo:next_hi])
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        best, best_area = lo, -1.0
+        for i in range(lo, hi):
+            area = abs((x[previous] - avg_x) * (y[i] - y[previous]) - (x[previous] - x[i]) * (avg_y - y[previous]))
+            if area > best_area:
+                best, best_area = i, area
+        selected.append(best)
+        previous = best
+    return selected + [count - 1]
+
+
+def test_lttb_matches_the_reference_implementation():
+    rng = np.random.default_rng(3)
+    x = np.cumsum(rng.integers(1, 5, 2000)).astype(np.float64)
+    y = np.cumsum(rng.normal(0, 1, 2000))
+
+    keep = lttb_indices(x, y, 150)
+
+    assert keep.tolist() == _reference_lttb(x, y, 150)
+    assert len(keep) == 150
+    assert keep[0] == 0 and keep[-1] == len(x) - 1
+    assert np.all(np.diff(keep) > 0)
+
+
+def test_lttb_keeps_spikes():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.zeros(1000)
+    y[[137, 600]] = [50.0, -40.0]
+    assert {137, 600} <= set(lttb_indices(x, y, 20).tolist())
+
+
+@pytest.mark.parametrize("threshold", [2, 10, 11])
+def test_lttb_returns_short_series_whole(threshold):
+    x = np.arange(10, dtype=np.float64)
+    assert lttb_indices(x, x, threshold).tolist() == list(range(10))
+
+
+START = datetime(2024, 11, 14)
+
+
+@pytest.fixture
+def readings(mongo):
+    collection = mongo["test"]["readings"]
+    collection.insert_many([
+        {"id": f"r{i}", "sensor_id": "s1", "timestamp": START + timedelta(minutes=i),
+         "temperature": float(i % 60), "humidity": 40.0, "AQI": 10.0 + i, "CO2_level": 400.0}
+        for i in range(240)
+    ] + [{"id": "other", "sensor_id": "s2", "timestamp": START, "temperature": 99.0}])
+    return collection
+
+
+def test_bucket_series_aggregates_equal_time_buckets(readings, monkeypatch):
+    monkeypatch.setattr(downsampling, "ROLLUPS_ENABLED", False)
+    result = bucket_series("s1", START, START + timedelta(hours=4), 8)
+
+    assert result["source"] == "raw"
+    assert result["bucket_ms"] == 30 * 60 * 1000
+    start_ms = int(START.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    assert result["timestamps"] == [start_ms + i * result["bucket_ms"] for i in range(8)]
+    assert result["count"] == [30] * 8
+    temperature = result["metrics"]["temperature"]
+    assert temperature["min"] == [0.0, 30.0] * 4
+    assert temperature["max"] == [29.0, 59.0] * 4
+    assert temperature["avg"] == [14.5, 44.5] * 4
+    assert result["metrics"]["AQI"]["max"][-1] == 249.0
+
+
+def test_lttb_series_reduces_each_metric(readings):
+    result = lttb_series("s1", START, START + timedelta(hours=4), 50)
+
+    assert result["points"] == 240
+    for metric in ("temperature", "AQI"):
+        series = result["metrics"][metric]
+        assert len(series["timestamps"]) == len(series["values"]) == 50
+        assert series["timestamps"] == sorted(series["timestamps"])
+
+
+@pytest.fixture
+def client(readings):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from api.routes import charts
+
+    app = FastAPI()
+    app.include_router(charts.router, prefix="/api/v1")
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("method", ["bucket", "lttb"])
+def test_chart_route_takes_naive_datetimes_as_utc(client, monkeypatch, method):
+    monkeypatch.setattr(downsampling, "ROLLUPS_ENABLED", False)
+    naive = client.get("/api/v1/get_chart_data", params={
+        "sensor_id": "s1", "start": "2024-11-14T00:00:00", "points": 8, "method": method,
+    })
+    aware = client.get("/api/v1/get_chart_data", params={
+        "sensor_id": "s1", "start": "2024-11-14T00:00:00+00:00", "points": 8, "method": method,
+    })
+
+    assert naive.status_code == 200, naive.text
+    data = naive.json()["data"]
+    assert data["start"].startswith("2024-11-14T00:00:00")
+    assert data["metrics"] == aware.json()["data"]["metrics"]
+
+
+def test_chart_route_rejects_a_start_after_the_end(client):
+    response = client.get("/api/v1/get_chart_data", params={
+        "sensor_id": "s1", "start": "2024-11-15T00:00:00", "end": "2024-11-14T00:00:00+00:00",
+    })
+    assert response.status_code == 400
@@ -0,0 +1,162 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo.errors import AutoReconnect, OperationFailure
+
+from api.services import hot_store as hot_store_module
+from api.services import ingest_hooks
+from api.services.hot_store import HotWindowStore
+from api.services.ingest_hooks import ReadingsTailer
+
+
+@pytest.fixture(autouse=True)
+def fast_reopen(monkeypatch):
+    monkeypatch.setattr(ingest_hooks, "REOPEN_DELAY", 0.01)
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class _Stream:
+    """A change stream that raises `error` (if any) once its changes are consumed, then yields nothing."""
+
+    def __init__(self, changes=(), error=None):
+        self.changes = list(changes)
+        self.error = error
+
+    def try_next(self):
+        if self.changes:
+            return self.changes.pop(0)
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        time.sleep(0.005)
+        return None
+
+    def close(self):
+        pass
+
+
+class _Collection:
+    """Hands out the scripted streams (or raises the scripted errors) of successive watch() calls."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.resume_tokens = []
+        self.lock = threading.Lock()
+
+    def watch(self, pipeline, resume_after=None, max_await_time_ms=None):
+        with self.lock:
+            self.resume_tokens.append(resume_after)
+            outcome = self.outcomes.pop(0) if self.outcomes else _Stream()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def _change(token, minute=0):
+    return {"_id": token, "fullDocument": {"sensor_id": "s1", "timestamp": datetime(2024, 11, 14) + timedelta(minutes=minute)}}
+
+
+def _tail(collection, gaps):
+    applied = []
+    tailer = ReadingsTailer(applied.extend, collection=collection, flush_seconds=0, on_gap=lambda: gaps.append(tailer.healthy))
+    tailer.start()
+    return tailer, applied
+
+
+def test_a_transient_error_resumes_without_a_gap():
+    collection = _Collection(_Stream([_change("t1")], error=AutoReconnect("blip")), _Stream([_change("t2", 1)]))
+    gaps = []
+    tailer, applied = _tail(collection, gaps)
+    _wait_for(lambda: len(applied) == 2)
+    tailer.stop()
+
+    assert collection.resume_tokens[:2] == [None, "t1"]
+    assert gaps == [] and tailer.healthy is False
+
+
+def test_lost_history_is_a_gap_and_restarts_the_stream():
+    lost = OperationFailure("resume point no longer in the oplog", code=286)
+    collection = _Collection(_Stream([_change("t1")], error=lost), _Stream())
+    gaps = []
+    tailer, _ = _tail(collection, gaps)
+    _wait_for(lambda: len(collection.resume_tokens) >= 2)
+    _wait_for(lambda: tailer.healthy)
+    tailer.stop()
+
+    assert gaps == [False]
+    assert collection.resume_tokens[1] is None
+
+
+def test_a_failed_reopen_is_a_gap_until_the_stream_opens():
+    collection = _Collection(_Stream([_change("t1")], error=AutoReconnect("down")), AutoReconnect("still down"),
+                             AutoReconnect("still down"), _Stream())
+    gaps = []
+    tailer, _ = _tail(collection, gaps)
+    _wait_for(lambda: len(collection.resume_tokens) >= 4)
+    _wait_for(lambda: tailer.healthy)
+    tailer.stop()
+
+    # One gap per outage, and the stream is reopened from now rather than replayed
+    assert gaps == [False]
+    assert collection.resume_tokens == [None, "t1", None, None]
+
+
+NOW = datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@pytest.fixture
+def store(mongo):
+    mongo["test"]["readings"].insert_many([
+        {"id": f"r{i}", "sensor_id": "s1", "timestamp": NOW - timedelta(minutes=i), "temperature": 20.0 + i}
+        for i in range(30)
+    ])
+    return HotWindowStore(enabled=True, window_hours=1, max_mb=16, source="change_stream")
+
+
+def test_the_store_is_disabled_when_the_change_stream_cannot_open(store, monkeypatch):
+    registered = []
+    monkeypatch.setattr(hot_store_module, "register_ingest_hook", registered.append)
+    monkeypatch.setattr(hot_store_module.ReadingsTailer, "start",
+                        lambda self: (_ for _ in ()).throw(OperationFailure("not a replica set", code=40573)))
+
+    assert store.start() is None
+    assert registered == []
+    assert store.get("s1", NOW - timedelta(minutes=10)) is None
+    assert store.stats()["enabled"] is False
+
+
+def test_a_gap_clears_the_windows_and_reads_go_to_mongo_until_the_stream_reopens(store):
+    tailer = ReadingsTailer(store.apply_readings, on_gap=store.clear)
+    tailer.healthy = True
+    store._tailer = tailer
+    since = NOW - timedelta(minutes=10)
+    assert store.get("s1", since)[0].size == 11
+    assert store.stats()["sensors"] == 1
+
+    tailer.healthy = False
+    tailer.on_gap()
+    assert store.stats()["sensors"] == 0
+    assert store.get("s1", since) is None
+
+    tailer.healthy = True
+    assert store.get("s1", since)[0].size == 11
+
+
+def test_a_window_loaded_across_a_clear_is_discarded(store, monkeypatch):
+    load = HotWindowStore._load
+
+    def clear_while_loading(self, sensor_id, generation):
+        self.clear()
+        return load(self, sensor_id, generation)
+
+    monkeypatch.setattr(HotWindowStore, "_load", clear_while_loading)
+    assert store.get("s1", NOW - timedelta(minutes=10)) is None
+    assert store.stats()["sensors"] == 0
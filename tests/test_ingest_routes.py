@@ -0,0 +1,65 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pymongo.errors import BulkWriteError, ServerSelectionTimeoutError
+
+from api.routes import ingest
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(ingest.router, prefix="/api/v1")
+    return TestClient(app)
+
+
+def _failing(error):
+    def ingest_stream(stream, format, embed=True):
+        raise error
+    return ingest_stream
+
+
+@pytest.mark.parametrize("error", [
+    ServerSelectionTimeoutError("localhost:27017: [Errno 111] Connection refused"),
+    BulkWriteError({"writeErrors": [{"errmsg": "E11000 duplicate key"}]}),
+    ConnectionError("refused"),
+])
+def test_database_errors_are_503_without_driver_details(client, monkeypatch, error):
+    monkeypatch.setattr(ingest, "ingest_stream", _failing(error))
+    response = client.post("/api/v1/ingest?format=ndjson", content=b'{"id": "r1"}\n')
+
+    assert response.status_code == 503
+    assert response.json()["detail"] == "Service unavailable. Please try again later."
+
+
+def test_unexpected_errors_are_500_without_their_message(client, monkeypatch):
+    monkeypatch.setattr(ingest, "ingest_stream", _failing(RuntimeError("secret internals")))
+    response = client.post("/api/v1/ingest?format=ndjson", content=b'{"id": "r1"}\n')
+
+    assert response.status_code == 500
+    assert "secret internals" not in response.text
+
+
+def test_invalid_input_is_400(client, monkeypatch):
+    monkeypatch.setattr(ingest, "ingest_stream", _failing(ValueError("bad record")))
+    assert client.post("/api/v1/ingest?format=ndjson", content=b"x").status_code == 400
+    assert client.post("/api/v1/ingest?format=xml", content=b"x").status_code == 400
+
+
+def _failing_rebuild(error):
+    def rebuild_rollups(sensor_ids, since=None, until=None):
+        raise error
+    return rebuild_rollups
+
+
+@pytest.mark.parametrize("error,status", [
+    (ServerSelectionTimeoutError("localhost:27017: [Errno 111] Connection refused"), 503),
+    (RuntimeError("secret internals"), 500),
+])
+def test_rollup_rebuild_errors_do_not_leak_details(client, monkeypatch, error, status):
+    monkeypatch.setattr(ingest, "ROLLUPS_ENABLED", True)
+    monkeypatch.setattr(ingest, "rebuild_rollups", _failing_rebuild(error))
+    response = client.post("/api/v1/rollups/rebuild")
+
+    assert response.status_code == status
+    assert "27017" not in response.text and "secret internals" not in response.text
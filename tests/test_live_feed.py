@@ -0,0 +1,123 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from api.routes import live
+from api.services.data_retrieval import METRIC_FIELDS
+from api.services.live_feed import RESYNC, LiveFeedBroker, LiveFeedFullError, encode_batch
+
+START = datetime(2024, 11, 14, 12, 0)
+
+
+def _reading(minute, sensor_id="s1"):
+    return {"sensor_id": sensor_id, "timestamp": START + timedelta(minutes=minute), "temperature": 20.0 + minute,
+            "humidity": 40.0, "AQI": 12.0, "CO2_level": 410.0}
+
+
+def _batch(*minutes):
+    readings = [_reading(minute) for minute in minutes]
+    timestamps = np.array([int((r["timestamp"] - datetime(1970, 1, 1)).total_seconds() * 1000) for r in readings])
+    return encode_batch("s1", timestamps, {field: np.array([r[field] for r in readings]) for field in METRIC_FIELDS})
+
+
+def _broker(**options):
+    return LiveFeedBroker(**{"enabled": True, "source": "ingest", "queue_size": 4, "max_subscribers": 3, **options})
+
+
+async def _settle():
+    # Published batches are handed to the loop with call_soon_threadsafe
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_batches_reach_only_the_followers_of_their_sensor():
+    async def scenario():
+        broker = _broker()
+        broker.start()
+        first, second, other = broker.subscribe("s1"), broker.subscribe("s1"), broker.subscribe("s2")
+        broker.publish_readings([_reading(3), _reading(1), _reading(2, sensor_id="s9")])
+        await _settle()
+        broker.stop()
+        return first, second, other, broker
+
+    first, second, other, broker = asyncio.run(scenario())
+
+    batch = first.queue.get_nowait()
+    # Encoded once and shared, in time order
+    assert second.queue.get_nowait() is batch
+    assert batch.timestamps == sorted(batch.timestamps) and len(batch.timestamps) == 2
+    assert json.loads(batch.data)["sensor_id"] == "s1"
+    assert other.queue.get_nowait() is RESYNC
+    assert broker.counts["deliveries"] == 2 and broker.counts["readings"] == 2
+
+
+def test_a_subscriber_that_falls_behind_gets_resync_instead_of_its_backlog():
+    async def scenario():
+        broker = _broker(queue_size=2)
+        broker.start()
+        subscription = broker.subscribe("s1")
+        for minute in range(3):
+            broker.publish_readings([_reading(minute)])
+        await _settle()
+        broker.stop()
+        return subscription, broker
+
+    subscription, broker = asyncio.run(scenario())
+
+    assert subscription.queue.get_nowait() is RESYNC
+    assert broker.counts["resyncs"] >= 1
+
+
+def test_subscriber_limit():
+    broker = _broker(max_subscribers=1)
+    subscription = broker.subscribe("s1")
+    with pytest.raises(LiveFeedFullError):
+        broker.subscribe("s2")
+    broker.unsubscribe(subscription)
+    broker.unsubscribe(subscription)
+    assert broker.stats()["subscribers"] == 0
+    broker.subscribe("s2")
+
+
+class _Request:
+    async def is_disconnected(self):
+        return False
+
+
+def test_stream_skips_queued_batches_already_sent_in_the_backlog(monkeypatch):
+    async def read_backlog(request, sensor_id, since_ms):
+        # Readings ingested while the backlog was read are queued as well as returned in it
+        broker.publish_readings([_reading(1), _reading(2)])
+        broker.publish_readings([_reading(2), _reading(3)])
+        await _settle()
+        return _batch(1, 2)
+
+    async def scenario():
+        broker.start()
+        response = await live.sensor_stream(_Request(), sensor_id="s1", since=START, last_event_id=None)
+        events = response.body_iterator
+        received = [await events.__anext__() for _ in range(3)]
+        broker.publish_readings([_reading(4)])
+        await _settle()
+        received.append(await events.__anext__())
+        await events.aclose()
+        broker.stop()
+        return received
+
+    broker = _broker()
+    monkeypatch.setattr(live, "live_feed", broker)
+    monkeypatch.setattr(live, "_read_backlog", read_backlog)
+
+    received = asyncio.run(scenario())
+
+    assert received[0].startswith("event: readings\nid: ") and received[1].startswith("event: ready")
+    readings = [event.split("\n") for event in (received[0], received[2], received[3])]
+    assert [int(lines[1][len("id: "):]) for lines in readings] == [_batch(2).timestamps[0], _batch(3).timestamps[0],
+                                                                    _batch(4).timestamps[0]]
+    # The queued [2, 3] batch overlaps the backlog, so only reading 3 is sent again
+    payloads = [json.loads(lines[2][len("data: "):]) for lines in readings]
+    assert payloads == [json.loads(_batch(1, 2).data), json.loads(_batch(3).data), json.loads(_batch(4).data)]
+    assert broker.stats()["subscribers"] == 0
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from api.services.query_understanding import QueryFilters, parse_query_filters
+
+NOW = datetime(2024, 11, 14, 15, 30)  # a Thursday
+
+
+def _period(query):
+    filters = parse_query_filters(query, now=NOW)
+    return filters.since, filters.until, filters.period
+
+
+@pytest.mark.parametrize("query, since, until, period", [
+    ("What was the temperature on 2024-11-12?",
+     datetime(2024, 11, 12), datetime(2024, 11, 12, 23, 59, 59, 999999), "2024-11-12"),
+    ("readings on 11/12/2024", datetime(2024, 11, 12), datetime(2024, 11, 12, 23, 59, 59, 999999), "2024-11-12"),
+    ("CO2 on 2024-11-12 at 2:15 pm",
+     datetime(2024, 11, 12, 13, 45), datetime(2024, 11, 12, 14, 45), "2024-11-12T14:15:00"),
+    ("humidity at 2024-11-12 08:00", datetime(2024, 11, 12, 7, 30), datetime(2024, 11, 12, 8, 30), "2024-11-12T08:00:00"),
+    ("between 2024-11-10 and 2024-11-12",
+     datetime(2024, 11, 10), datetime(2024, 11, 12, 23, 59, 59, 999999),
+     "2024-11-10T00:00:00/2024-11-12T23:59:59.999999"),
+    ("since 2024-11-10", datetime(2024, 11, 10), None, "2024-11-10T00:00:00/"),
+    ("before 2024-11-10", None, datetime(2024, 11, 9, 23, 59, 59, 999999), "/2024-11-09T23:59:59.999999"),
+    ("AQI in the last 3 hours", NOW - timedelta(hours=3), None, "last 10800s"),
+    ("AQI over the past week", NOW - timedelta(weeks=1), None, "last 604800s"),
+    ("readings today", datetime(2024, 11, 14), None, "2024-11-14"),
+    ("readings yesterday", datetime(2024, 11, 13), datetime(2024, 11, 13, 23, 59, 59, 999999), "2024-11-13"),
+    ("readings this week", datetime(2024, 11, 11), None, "week of 2024-11-11"),
+    ("readings this month", datetime(2024, 11, 1), None, "month of 2024-11-01"),
+])
+def test_periods(query, since, until, period):
+    assert _period(query) == (since, until, period)
+
+
+def test_questions_without_a_period_or_sensor_are_unfiltered():
+    filters = parse_query_filters("How is the air quality?", now=NOW)
+    assert not filters
+    assert filters.partition == ""
+    assert _period("Any readings on 2024-13-45?") == (None, None, None)
+
+
+def test_known_sensor_ids_are_matched_case_insensitively():
+    filters = parse_query_filters("Compare SENSONE and senstwo with sensone", known_sensor_ids=["sensone", "senstwo"])
+    assert filters.sensor_ids == ("sensone", "senstwo")
+
+
+def test_sensor_ids_without_a_known_list():
+    assert parse_query_filters("temperature of sensor 12-b").sensor_ids == ("12-b",)
+    assert parse_query_filters("show sensor readings").sensor_ids == ()
+
+
+def test_relative_periods_share_a_partition_as_the_clock_moves():
+    earlier = parse_query_filters("CO2 in the last 2 hours for sensor_1", known_sensor_ids=["sensor_1"], now=NOW)
+    later = parse_query_filters("co2 over the past two hours, sensor_1", known_sensor_ids=["sensor_1"],
+                                now=NOW + timedelta(minutes=20))
+
+    assert earlier.since != later.since
+    assert earlier.partition == later.partition == "last 7200s|sensors:sensor_1"
+
+
+def test_describe():
+    filters = QueryFilters(since=datetime(2024, 11, 14), until=datetime(2024, 11, 14, 23, 59), sensor_ids=("sensone",))
+    assert filters.describe() == "2024-11-14 00:00 to 2024-11-14 23:59 UTC for sensone"
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from api.services.data_retrieval import METRIC_FIELDS, _as_float, _epoch_ms
+from api.services.rollups import (
+    DAY_MS, HOUR_MS, aggregate_columns, apply_readings, coarsen, merge, read_rollups,
+)
+
+START = datetime(2024, 11, 13, 22, 0)
+
+
+def _readings(count=300, seed=5):
+    rng = np.random.default_rng(seed)
+    # Distinct times, so each bucket's last reading is well defined whatever order the batches come in
+    minutes = rng.choice(6 * 60, count, replace=False)
+    readings = []
+    for i in range(count):
+        reading = {"sensor_id": f"s{i % 2}", "timestamp": START + timedelta(minutes=int(minutes[i]))}
+        for field in METRIC_FIELDS:
+            if rng.random() > 0.1:
+                reading[field] = round(float(rng.normal(50, 30)), 2)
+        readings.append(reading)
+    return readings
+
+
+def _expected(readings, sensor_id, resolution_ms):
+    rows = [reading for reading in readings if reading["sensor_id"] == sensor_id]
+    timestamps = np.array([_epoch_ms(row["timestamp"]) for row in rows], dtype=np.int64)
+    columns = {field: np.array([_as_float(row.get(field)) for row in rows]) for field in METRIC_FIELDS}
+    return aggregate_columns(timestamps, columns, resolution_ms)
+
+
+def _assert_same(stored, expected):
+    np.testing.assert_array_equal(stored.buckets, expected.buckets)
+    np.testing.assert_array_equal(stored.count, expected.count)
+    np.testing.assert_array_equal(stored.first, expected.first)
+    np.testing.assert_array_equal(stored.last, expected.last)
+    for field in METRIC_FIELDS:
+        for stat in ("count", "above", "min", "max", "last"):
+            np.testing.assert_array_equal(stored.metrics[field][stat], expected.metrics[field][stat], err_msg=f"{field}.{stat}")
+        for stat in ("sum", "sumsq"):
+            np.testing.assert_allclose(stored.metrics[field][stat], expected.metrics[field][stat])
+
+
+@pytest.mark.parametrize("splits", [1, 3, 7])
+def test_upserts_add_up_to_the_aggregate_in_any_split(mongo, splits):
+    readings = _readings()
+    # Out-of-order batches, so later batches both extend and lower existing buckets
+    for batch in np.array_split(np.random.default_rng(splits).permutation(len(readings)), splits):
+        apply_readings([readings[i] for i in batch])
+
+    for sensor_id in ("s0", "s1"):
+        _assert_same(read_rollups(sensor_id, "hourly"), _expected(readings, sensor_id, HOUR_MS))
+        _assert_same(read_rollups(sensor_id, "daily"), _expected(readings, sensor_id, DAY_MS))
+
+
+def test_read_rollups_limits_the_bucket_range(mongo):
+    readings = _readings()
+    apply_readings(readings)
+    start_ms = _epoch_ms(START + timedelta(hours=2))
+
+    stored = read_rollups("s0", "hourly", start_ms, start_ms + 2 * HOUR_MS)
+
+    assert stored.buckets.tolist() == [start_ms, start_ms + HOUR_MS]
+    assert read_rollups("unknown", "hourly").readings == 0
+
+
+def test_coarsen_and_merge_match_direct_aggregation():
+    readings = _readings()
+    hourly = _expected(readings, "s0", HOUR_MS)
+    _assert_same(coarsen(hourly, DAY_MS), _expected(readings, "s0", DAY_MS))
+
+    middle = len(hourly.buckets) // 2
+    halves = [
+        aggregate_columns(*_columns(readings, "s0", lambda ms: ms < hourly.buckets[middle]), HOUR_MS),
+        aggregate_columns(*_columns(readings, "s0", lambda ms: ms >= hourly.buckets[middle]), HOUR_MS),
+    ]
+    _assert_same(merge(*halves), hourly)
+
+
+def _columns(readings, sensor_id, keep):
+    rows = [row for row in readings if row["sensor_id"] == sensor_id and keep(_epoch_ms(row["timestamp"]))]
+    rows.sort(key=lambda row: row["timestamp"])
+    timestamps = np.array([_epoch_ms(row["timestamp"]) for row in rows], dtype=np.int64)
+    return timestamps, {field: np.array([_as_float(row.get(field)) for row in rows]) for field in METRIC_FIELDS}
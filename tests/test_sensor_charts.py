@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("plotly")
+
+from components.sensor_charts import decimate  # noqa: E402
+
+
+def test_short_series_are_kept_whole_without_gaps():
+    values = np.array([1.0, np.nan, 3.0, 4.0])
+    assert decimate(values, 2).tolist() == [0, 2, 3]
+    assert decimate(values, 0).tolist() == [0, 2, 3]
+
+
+def test_each_run_keeps_its_minimum_and_maximum():
+    rng = np.random.default_rng(2)
+    values = rng.normal(0, 1, 10_000)
+    values[[1234, 8765]] = [25.0, -25.0]
+
+    keep = decimate(values, 100)
+
+    assert len(keep) <= 200
+    assert np.all(np.diff(keep) > 0)
+    assert {1234, 8765} <= set(keep.tolist())
+    for run in np.array_split(np.arange(values.size), 100):
+        kept = values[keep[(keep >= run[0]) & (keep <= run[-1])]]
+        assert kept.min() == values[run].min() and kept.max() == values[run].max()
+
+
+def test_runs_without_values_contribute_no_points():
+    values = np.arange(1000, dtype=np.float64)
+    values[100:300] = np.nan
+    keep = decimate(values, 10)
+    assert not np.isnan(values[keep]).any()
+    assert not ((keep >= 100) & (keep < 300)).any()
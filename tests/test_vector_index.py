@@ -0,0 +1,105 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from api.services.vector_index import LocalVectorIndex, rebuild_from_collection
+
+
+def _records(count, offset=0):
+    return [{"id": f"r{offset + i}", "sensor_id": f"s{(offset + i) % 3}", "timestamp": datetime(2024, 11, 1 + (offset + i) % 20),
+             "temperature": float(i), "text": f"reading {offset + i}"} for i in range(count)]
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(11).standard_normal((60, 8)).astype(np.float32)
+
+
+def test_search_returns_the_nearest_rows(tmp_path, vectors):
+    index = LocalVectorIndex(str(tmp_path))
+    index.append(vectors, _records(60))
+
+    scores = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)) @ (vectors[7] / np.linalg.norm(vectors[7]))
+    results = index.search(vectors[7], 5)[0]
+
+    assert [row for row, _ in results] == np.argsort(-scores)[:5].tolist()
+    assert results[0] == (7, pytest.approx(1.0, abs=1e-5))
+
+
+def test_search_applies_sensor_and_time_filters(tmp_path, vectors):
+    index = LocalVectorIndex(str(tmp_path))
+    index.append(vectors, _records(60))
+
+    results = index.search(vectors[:2], 60, sensor_ids=["s1"], since=datetime(2024, 11, 5), until=datetime(2024, 11, 10))
+
+    for query_results in results:
+        records = [index.get_record(row) for row, _ in query_results]
+        assert records
+        assert all(record["sensor_id"] == "s1" and datetime(2024, 11, 5) <= record["timestamp"] <= datetime(2024, 11, 10)
+                   for record in records)
+    assert index.search(vectors[0], 5, sensor_ids=["unknown"]) == [[]]
+
+
+def test_appends_survive_a_reload(tmp_path, vectors):
+    index = LocalVectorIndex(str(tmp_path))
+    index.append(vectors[:40], _records(40))
+    index.append(vectors[40:], _records(20, offset=40))
+
+    reloaded = LocalVectorIndex(str(tmp_path))
+
+    assert len(reloaded) == 60
+    assert reloaded.sensor_ids() == index.sensor_ids()
+    assert reloaded.get_record(45) == index.get_record(45)
+    assert reloaded.search(vectors[45], 1)[0][0][0] == 45
+
+
+def test_rows_of_an_interrupted_append_are_dropped(tmp_path, vectors):
+    index = LocalVectorIndex(str(tmp_path))
+    index.append(vectors[:30], _records(30))
+    # An append that wrote both files but crashed before replacing meta.json
+    with open(os.path.join(tmp_path, "vectors.f32"), "ab") as f:
+        f.write(vectors[30:35].tobytes())
+    with open(os.path.join(tmp_path, "records.jsonl"), "ab") as f:
+        f.write(b'{"id": "torn", "sensor_id": "s9"}\n{"id": "tor')
+
+    reloaded = LocalVectorIndex(str(tmp_path))
+    assert len(reloaded) == 30
+    assert "s9" not in reloaded.sensor_ids()
+
+    reloaded.append(vectors[30:], _records(30, offset=30))
+    again = LocalVectorIndex(str(tmp_path))
+    assert len(again) == 60
+    assert [again.get_record(row)["id"] for row in (29, 30, 59)] == ["r29", "r30", "r59"]
+    assert again.search(vectors[50], 1)[0][0][0] == 50
+
+
+def test_clear_removes_the_files_and_bumps_the_generation(tmp_path, vectors):
+    index = LocalVectorIndex(str(tmp_path))
+    index.append(vectors, _records(60))
+    generation = index.generation
+
+    index.clear()
+
+    assert len(index) == 0 and index.generation == generation + 1
+    assert len(LocalVectorIndex(str(tmp_path))) == 0
+
+
+def test_append_rejects_mismatched_embeddings(tmp_path, vectors):
+    index = LocalVectorIndex(str(tmp_path))
+    with pytest.raises(ValueError):
+        index.append(vectors[:3], _records(2))
+    index.append(vectors[:3], _records(3))
+    with pytest.raises(ValueError):
+        index.append(np.ones((1, 4)), _records(1))
+
+
+def test_rebuild_from_collection(tmp_path, vectors, mongo):
+    collection = mongo["test"]["reading_vectors"]
+    collection.insert_many([{**record, "embedding": vector.tolist()} for record, vector in zip(_records(60), vectors)])
+    collection.insert_one({"id": "unembedded", "sensor_id": "s0"})
+
+    index = LocalVectorIndex(str(tmp_path))
+    assert rebuild_from_collection(index, collection, batch_size=25) == 60
+    assert index.search(vectors[12], 1)[0][0][0] == 12
@@ -1,24 +1,38 @@
+import json
+import threading
+import time
+from collections import deque
+import pandas as pd
+import pyarrow as pa
 import requests
 import streamlit as st
 
 # BASE_API_URL = "http://127.0.0.1:8000/api/v1"
 BASE_API_URL = "https://insightpulse.onrender.com/api/v1"
 
-@st.cache_data
+# The API caches insights until new readings arrive, so this only saves round trips between reruns
+INSIGHTS_CACHE_TTL = 30
+
+# Batches of pushed readings a followed sensor keeps for the sessions reading it
+LIVE_BUFFER_BATCHES = 1000
+# A followed sensor's stream is closed once no session has read it for this many seconds
+LIVE_IDLE_SECONDS = 60
+
+@st.cache_data(ttl=INSIGHTS_CACHE_TTL)
+def _get_insights(sensor_id):
+    # Raises on error responses so that only successful results are cached
+    response = requests.get(f"{BASE_API_URL}/get_insights", params={"sensor_id": sensor_id, "format": "columnar"})
+    response.raise_for_status()
+    return response.json().get("data", "No insights available.")
+
 def fetch_insights_from_api(sensor_id):
     """Fetches insights from FastAPI based on the provided sensor ID."""
     try:
-        API_URL = f"{BASE_API_URL}/get_insights"
-        response = requests.get(API_URL, params={"sensor_id": sensor_id})
-
-        # Check if the response is successful
-        if response.status_code == 200:
-            
-            data = response.json()
-            print(data)
-            return data.get("data", "No insights available.")
+        return _get_insights(sensor_id)
+    except requests.exceptions.HTTPError as e:
         # Handle specific error responses from the API
-        elif response.status_code == 400:
+        response = e.response
+        if response.status_code == 400:
             return "Bad request: Please check your input parameters."
         elif response.status_code == 404:
             return "No insights found for the provided sensor ID."
@@ -34,6 +48,101 @@ def fetch_insights_from_api(sensor_id):
         # General exception handling
         return f"An unexpected error occurred: {str(e)}"
 
+@st.cache_data(ttl=60)
+def fetch_chart_data_from_api(sensor_id, points, start=None, end=None, method="bucket"):
+    """Fetches a sensor's chart series, downsampled server-side to at most `points` points."""
+    try:
+        API_URL = f"{BASE_API_URL}/get_chart_data"
+        params = {"sensor_id": sensor_id, "points": points, "method": method}
+        if start:
+            params["start"] = start.isoformat()
+        if end:
+            params["end"] = end.isoformat()
+        response = requests.get(API_URL, params=params)
+
+        if response.status_code == 200:
+            return response.json().get("data")
+        elif response.status_code == 400:
+            return "Bad request: Please check your input parameters."
+        elif response.status_code == 503:
+            return "The API service is temporarily unavailable. Please try again later."
+        else:
+            return f"Error fetching data: {response.status_code} - {response.text}"
+
+    except requests.exceptions.RequestException as e:
+        # Specific error handling for network or request-related issues
+        return f"Network error: {str(e)}"
+    except Exception as e:
+        # General exception handling
+        return f"An unexpected error occurred: {str(e)}"
+
+@st.cache_data(ttl=60)
+def fetch_anomalies_from_api(sensor_id, start=None, end=None):
+    """Fetches the anomalies detected in a sensor's readings, as a list of anomaly dicts."""
+    try:
+        API_URL = f"{BASE_API_URL}/get_anomalies"
+        params = {"sensor_id": sensor_id}
+        if start:
+            params["since"] = start.isoformat()
+        if end:
+            params["until"] = end.isoformat()
+        response = requests.get(API_URL, params=params)
+
+        if response.status_code == 200:
+            return response.json().get("anomalies", [])
+        elif response.status_code == 400:
+            return "Bad request: Please check your input parameters."
+        elif response.status_code == 503:
+            return "The API service is temporarily unavailable. Please try again later."
+        else:
+            return f"Error fetching data: {response.status_code} - {response.text}"
+
+    except requests.exceptions.RequestException as e:
+        # Specific error handling for network or request-related issues
+        return f"Network error: {str(e)}"
+    except Exception as e:
+        # General exception handling
+        return f"An unexpected error occurred: {str(e)}"
+
+def sensor_series_to_dataframe(series):
+    """Builds a DataFrame (timestamp plus one column per metric) from a columnar sensor_data payload."""
+    df = pd.DataFrame(series.get("metrics", {}), dtype="float64")
+    df.insert(0, "timestamp", pd.to_datetime(series.get("timestamps", []), unit="ms", utc=True))
+    return df
+
+@st.cache_data(ttl=60)
+def fetch_sensor_series_from_api(sensor_id, since=None, until=None, limit=None):
+    """Fetches a sensor's raw readings from /get_sensor_series as a DataFrame, using the Arrow encoding."""
+    try:
+        API_URL = f"{BASE_API_URL}/get_sensor_series"
+        params = {"sensor_id": sensor_id}
+        if since:
+            params["since"] = since.isoformat()
+        if until:
+            params["until"] = until.isoformat()
+        if limit:
+            params["limit"] = limit
+        headers = {"Accept": "application/vnd.apache.arrow.stream, application/json;q=0.5"}
+        response = requests.get(API_URL, params=params, headers=headers)
+
+        if response.status_code == 200:
+            if response.headers.get("content-type", "").startswith("application/vnd.apache.arrow.stream"):
+                return pa.ipc.open_stream(response.content).read_pandas()
+            return sensor_series_to_dataframe(response.json())
+        elif response.status_code == 400:
+            return "Bad request: Please check your input parameters."
+        elif response.status_code == 503:
+            return "The API service is temporarily unavailable. Please try again later."
+        else:
+            return f"Error fetching data: {response.status_code} - {response.text}"
+
+    except requests.exceptions.RequestException as e:
+        # Specific error handling for network or request-related issues
+        return f"Network error: {str(e)}"
+    except Exception as e:
+        # General exception handling
+        return f"An unexpected error occurred: {str(e)}"
+
 @st.cache_data
 def fetch_rag_response_from_api(query):
     """Fetches insights from FastAPI based on the provided query."""
@@ -61,3 +170,122 @@ def fetch_rag_response_from_api(query):
     except Exception as e:
         # General exception handling
         return f"An unexpected error occurred: {str(e)}"
+
+def _sse_events(response, keep_alive=False):
+    """Parses a Server-Sent Events response into (event, data, last event ID) tuples.
+
+    With keep_alive, comment lines are yielded as (None, None, last event ID), so
+    readers of an idle stream regain control.
+    """
+    event, event_id = None, None
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            event = None
+        elif line.startswith(":"):
+            if keep_alive:
+                yield None, None, event_id
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("id:"):
+            event_id = line[len("id:"):].strip()
+        elif line.startswith("data:"):
+            yield event, json.loads(line[len("data:"):]), event_id
+
+def stream_rag_response_from_api(query):
+    """Streams the answer for a query from FastAPI, yielding text fragments as they arrive."""
+    try:
+        API_URL = f"{BASE_API_URL}/get_rag_query_stream"
+        with requests.get(API_URL, params={"query": query}, stream=True, timeout=(10, 120)) as response:
+            if response.status_code != 200:
+                if response.status_code == 400:
+                    yield "Bad request: Please check your input parameters."
+                elif response.status_code == 503:
+                    yield "The API service is temporarily unavailable. Please try again later."
+                else:
+                    yield f"Error fetching data: {response.status_code} - {response.text}"
+                return
+
+            for event, data, _ in _sse_events(response):
+                if event == "done":
+                    return
+                if event == "error":
+                    yield f"\n\n{data.get('detail', 'An error occurred while generating the answer.')}"
+                    return
+                yield data.get("token", "")
+
+    except requests.exceptions.RequestException as e:
+        # Specific error handling for network or request-related issues
+        yield f"Network error: {str(e)}"
+    except Exception as e:
+        # General exception handling
+        yield f"An unexpected error occurred: {str(e)}"
+
+class SensorStream:
+    """Follows a sensor's /sensor_stream in a background thread, keeping the batches of readings pushed to it.
+
+    One stream is shared by every session viewing the sensor (see follow_sensor_stream);
+    each session reads the batches after its own cursor. The thread reconnects from the
+    last event ID after errors and resyncs, and exits once no session has read the
+    stream for LIVE_IDLE_SECONDS.
+    """
+
+    def __init__(self, sensor_id):
+        self.sensor_id = sensor_id
+        self.error = None
+        self._batches = deque(maxlen=LIVE_BUFFER_BATCHES)
+        self._sequence = 0
+        self._last_event_id = None
+        self._last_read = time.monotonic()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def ensure_running(self, since=None):
+        """Starts following the sensor, from the readings after `since` (epoch ms), unless it already is."""
+        with self._lock:
+            self._last_read = time.monotonic()
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if since is not None and (self._last_event_id is None or since > int(self._last_event_id)):
+                self._last_event_id = str(since)
+            self._thread = threading.Thread(target=self._run, name=f"sensor-stream-{self.sensor_id}", daemon=True)
+            self._thread.start()
+
+    def read(self, cursor=0):
+        """Returns the batches (columnar sensor_data payloads) received after cursor, and the new cursor."""
+        with self._lock:
+            self._last_read = time.monotonic()
+            return [batch for sequence, batch in self._batches if sequence > cursor], self._sequence
+
+    def _idle(self):
+        return time.monotonic() - self._last_read > LIVE_IDLE_SECONDS
+
+    def _run(self):
+        delay = 1.0
+        while not self._idle():
+            headers = {"Last-Event-ID": self._last_event_id} if self._last_event_id else {}
+            try:
+                with requests.get(f"{BASE_API_URL}/sensor_stream", params={"sensor_id": self.sensor_id},
+                                  headers=headers, stream=True, timeout=(10, 60)) as response:
+                    if response.status_code != 200:
+                        self.error = f"Live updates unavailable: {response.status_code} - {response.text}"
+                    else:
+                        self.error = None
+                        delay = 1.0
+                        for event, data, event_id in _sse_events(response, keep_alive=True):
+                            if event == "readings":
+                                with self._lock:
+                                    self._sequence += 1
+                                    self._batches.append((self._sequence, data))
+                                    self._last_event_id = event_id
+                            elif event == "resync" or self._idle():
+                                break
+            except requests.exceptions.RequestException as e:
+                self.error = f"Network error: {str(e)}"
+            # Back off before reconnecting, unless the server asked for a resync
+            time.sleep(delay if self.error else 0.1)
+            delay = min(delay * 2, 30.0)
+
+@st.cache_resource(max_entries=100)
+def follow_sensor_stream(sensor_id):
+    """Returns the SensorStream of a sensor, shared by all sessions; call ensure_running before reading it."""
+    return SensorStream(sensor_id)